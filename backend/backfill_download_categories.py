@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Backfill resource_category and resource_title on existing download records
+
+Download records written before these fields were denormalized only carry a
+resource_id. This copies the category and title from each resource onto its
+downloads, then rebuilds the analytics rollups so the per-category download
+counts include the backfilled history. Safe to run more than once.
+
+Usage: python backfill_download_categories.py [--skip-rollups]
+"""
+
+import asyncio
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+import os
+from pathlib import Path
+
+from rollups import rebuild_rollups
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# MongoDB connection
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ['DB_NAME']]
+
+async def backfill_download_categories(db) -> int:
+    """Copy category and title onto downloads missing them; returns the number updated"""
+    updated = 0
+    resources = await db.resources.find({}, {"_id": 0, "id": 1, "category": 1, "title": 1}).to_list(None)
+    for resource in resources:
+        # Served by the resource_id index; records already backfilled are skipped
+        result = await db.resource_downloads.update_many(
+            {"resource_id": resource["id"], "resource_category": {"$exists": False}},
+            {"$set": {"resource_category": resource.get("category"), "resource_title": resource.get("title")}}
+        )
+        if result.modified_count:
+            print(f"Backfilled {result.modified_count} downloads of {resource['id']} ({resource.get('category')})")
+        updated += result.modified_count
+    return updated
+
+async def main():
+    try:
+        updated = await backfill_download_categories(db)
+        print(f"Backfilled {updated} download records")
+        
+        if "--skip-rollups" not in sys.argv:
+            # Downloads that expired under a retention policy are no longer counted after a rebuild
+            processed = await rebuild_rollups(db)
+            if processed is None:
+                print("Another process is rebuilding the analytics rollups; run again with --skip-rollups once it finishes")
+            else:
+                print(f"Rebuilt analytics rollups: {processed}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Load-test and benchmark the API
+
+Drives each scenario at a fixed request rate for a fixed duration and reports
+p50/p95/p99 latency, throughput and memory allocated while it ran. Results can
+be saved as a JSON baseline and later runs compared against it, failing when
+a scenario regresses beyond the tolerance.
+
+By default the app is served in-process over an ASGI transport (lifespan
+included) against a local mongod, using a separate benchmark database that
+is seeded with the files under public/resources. Every in-process request
+comes from the same client address and session, so rate limiting is turned
+off there (set RATE_LIMIT_ENABLED=true to measure it). Pass --url to drive a
+running server instead (it must already have resources, and its rate limits
+must allow the load, or the run measures 429 responses).
+
+Usage:
+    MONGO_URL=mongodb://localhost:27017 python benchmark.py --rps 200 --duration 10
+    python benchmark.py --scenarios download_resource,track_event --save baselines/main.json
+    python benchmark.py --compare baselines/main.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+DEFAULT_DB_NAME = "trustml_benchmark"
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    requests: int
+    errors: int
+    duration: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    allocated_kb: Optional[float] = None
+    peak_kb: Optional[float] = None
+    status_codes: Dict[str, int] = field(default_factory=dict)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+# Scenarios: each sends one request and returns the response
+def build_scenarios(resource_id: str) -> Dict[str, Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]]:
+    session_id = str(uuid.uuid4())
+
+    async def list_resources(http):
+        return await http.get("/api/resources")
+
+    async def get_resource(http):
+        return await http.get(f"/api/resources/{resource_id}")
+
+    async def download_resource(http):
+        return await http.get(f"/api/resources/{resource_id}/download", params={"session_id": session_id})
+
+    async def track_event(http):
+        return await http.post("/api/analytics/track", json={
+            "event_type": "page_view",
+            "element_id": "benchmark",
+            "session_id": session_id,
+            "page_url": "/benchmark",
+        })
+
+    async def track_batch(http):
+        return await http.post("/api/analytics/track/batch", json=[
+            {"event_type": "click", "element_id": f"benchmark-{i}", "session_id": session_id} for i in range(20)
+        ])
+
+    async def dashboard(http):
+        return await http.get("/api/analytics/dashboard")
+
+    async def resource_analytics(http):
+        return await http.get("/api/analytics/resources")
+
+    return {
+        "list_resources": list_resources,
+        "get_resource": get_resource,
+        "download_resource": download_resource,
+        "track_event": track_event,
+        "track_batch": track_batch,
+        "dashboard": dashboard,
+        "resource_analytics": resource_analytics,
+    }
+
+
+async def run_scenario(
+    name: str,
+    send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]],
+    http: httpx.AsyncClient,
+    rps: float,
+    duration: float,
+    concurrency: int,
+    trace_allocations: bool,
+) -> ScenarioResult:
+    """Issue requests at a fixed rate (open loop) and collect latencies.
+
+    Latency is measured from each request's scheduled start, so time spent
+    waiting for a free connection slot counts against the server rather than
+    being hidden by a slowed-down client.
+    """
+    latencies: List[float] = []
+    status_codes: Dict[str, int] = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(scheduled: float):
+        nonlocal errors
+        async with semaphore:
+            try:
+                response = await send(http)
+                await response.aread()
+                code = str(response.status_code)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+                errors += 1
+        latencies.append(time.perf_counter() - scheduled)
+        status_codes[code] = status_codes.get(code, 0) + 1
+
+    total = max(int(rps * duration), 1)
+    interval = 1.0 / rps
+    if trace_allocations:
+        tracemalloc.reset_peak()
+        allocated_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        scheduled = started + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    allocated_kb = peak_kb = None
+    if trace_allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        allocated_kb = round((current - allocated_before) / 1024, 1)
+        peak_kb = round(peak / 1024, 1)
+
+    ordered = sorted(latencies)
+    return ScenarioResult(
+        name=name,
+        requests=len(latencies),
+        errors=errors,
+        duration=round(elapsed, 3),
+        throughput=round(len(latencies) / elapsed, 1),
+        p50_ms=round(percentile(ordered, 0.50) * 1000, 2),
+        p95_ms=round(percentile(ordered, 0.95) * 1000, 2),
+        p99_ms=round(percentile(ordered, 0.99) * 1000, 2),
+        max_ms=round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        allocated_kb=allocated_kb,
+        peak_kb=peak_kb,
+        status_codes=status_codes,
+    )
+
+
+def compare_to_baseline(results: List[ScenarioResult], baseline: dict, tolerance: float) -> List[str]:
+    """Describe every scenario whose p95 latency or throughput regressed beyond the tolerance"""
+    regressions = []
+    previous = {scenario["name"]: scenario for scenario in baseline.get("scenarios", [])}
+    for result in results:
+        before = previous.get(result.name)
+        if before is None:
+            continue
+        if before["p95_ms"] and result.p95_ms > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{result.name}: p95 {before['p95_ms']}ms -> {result.p95_ms}ms")
+        if before["throughput"] and result.throughput < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{result.name}: throughput {before['throughput']}/s -> {result.throughput}/s")
+        if result.errors > before.get("errors", 0):
+            regressions.append(f"{result.name}: errors {before.get('errors', 0)} -> {result.errors}")
+    return regressions
+
+
+def print_results(results: List[ScenarioResult]):
+    print(f"{'scenario':<20}{'reqs':>7}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'alloc KB':>11}")
+    for r in results:
+        allocated = "-" if r.allocated_kb is None else f"{r.allocated_kb:.0f}"
+        print(f"{r.name:<20}{r.requests:>7}{r.errors:>6}{r.throughput:>9.1f}"
+              f"{r.p50_ms:>9.2f}{r.p95_ms:>9.2f}{r.p99_ms:>9.2f}{allocated:>11}")
+
+
+async def seed_benchmark_db(db, root: Path) -> int:
+    """Reset the benchmark database with one resource per file under public/resources"""
+    from file_manifest import FileManifest
+    from server import Resource
+
+    for collection_name in await db.list_collection_names():
+        await db.drop_collection(collection_name)
+    manifest = FileManifest(root / "public" / "resources")
+    manifest.scan()
+    resources = [
+        Resource(
+            title=entry.path.stem.replace("-", " ").title(),
+            description="Benchmark resource",
+            type=entry.path.suffix.lstrip(".") or "file",
+            category=entry.relative_path.split("/")[0],
+            file_path=entry.relative_path,
+            file_size=entry.size,
+        ).dict()
+        for entry in manifest.entries()
+    ]
+    if resources:
+        await db.resources.insert_many(resources)
+    return len(resources)
+
+
+async def pick_resource_id(http: httpx.AsyncClient) -> str:
+    response = await http.get("/api/resources", params={"limit": 1})
+    response.raise_for_status()
+    resources = response.json()
+    if not resources:
+        raise SystemExit("No resources to benchmark against; run init_resources.py first")
+    return resources[0]["id"]
+
+
+async def run(args) -> List[ScenarioResult]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as http:
+            return await run_scenarios(args, http, trace_allocations=False)
+
+    os.environ.setdefault("DB_NAME", DEFAULT_DB_NAME)
+    if os.environ["DB_NAME"] != DEFAULT_DB_NAME and not args.allow_db:
+        raise SystemExit(f"Refusing to reset {os.environ['DB_NAME']}; pass --allow-db to benchmark it anyway")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    import server
+
+    seeded = await seed_benchmark_db(server.connect_database(), ROOT_DIR)
+    print(f"Seeded {seeded} resources into {os.environ['DB_NAME']}")
+    if args.trace_allocations:
+        tracemalloc.start()
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=30) as http:
+            return await run_scenarios(args, http, trace_allocations=args.trace_allocations)
+
+
+async def run_scenarios(args, http: httpx.AsyncClient, trace_allocations: bool) -> List[ScenarioResult]:
+    scenarios = build_scenarios(await pick_resource_id(http))
+    names = args.scenarios.split(",") if args.scenarios else list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(scenarios)})")
+
+    results = []
+    for name in names:
+        # Warm up connections, caches and the write buffer before measuring
+        for _ in range(min(args.warmup, int(args.rps))):
+            await scenarios[name](http)
+        results.append(await run_scenario(
+            name, scenarios[name], http, args.rps, args.duration, args.concurrency, trace_allocations
+        ))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TrustML API")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--scenarios", help="Comma-separated scenarios to run (default: all)")
+    parser.add_argument("--rps", type=float, default=100.0, help="Target requests per second per scenario")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="Maximum requests in flight")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each scenario")
+    parser.add_argument("--no-allocations", dest="trace_allocations", action="store_false",
+                        help="Skip tracemalloc (it adds overhead to every allocation)")
+    parser.add_argument("--allow-db", action="store_true", help=f"Allow resetting a DB_NAME other than {DEFAULT_DB_NAME}")
+    parser.add_argument("--save", type=Path, help="Write the results to this JSON baseline")
+    parser.add_argument("--compare", type=Path, help="Compare against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression as a fraction (default 0.2)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "target": args.url or "in-process",
+        "rate_limited": bool(args.url) or os.environ.get("RATE_LIMIT_ENABLED", "true").lower() != "false",
+        "rps": args.rps,
+        "duration": args.duration,
+        "concurrency": args.concurrency,
+        "python": sys.version.split()[0],
+        "scenarios": [asdict(result) for result in results],
+    }
+    regressions = []
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("rate_limited", False) != report["rate_limited"]:
+            print(f"Warning: {args.compare} was recorded with rate limiting "
+                  f"{'on' if baseline.get('rate_limited') else 'off'}; latencies are not comparable")
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+        else:
+            print(f"No regressions against {args.compare}")
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(report, indent=2))
+        print(f"Saved baseline to {args.save}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
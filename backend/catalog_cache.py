@@ -0,0 +1,217 @@
+"""
+In-process cache of the resource catalog.
+
+The catalog is a handful of rarely changing documents, so it is loaded whole
+and indexed by id, category and featured flag. It is invalidated by writes
+through the API, by a MongoDB change stream when the deployment supports one
+(replica sets and Atlas), and otherwise by a TTL.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import PyMongoError
+
+import pagination
+from download_counters import APPLIED_KEYS_FIELD
+
+logger = logging.getLogger(__name__)
+
+# Fields the download path bumps on every download; updates touching only these
+# are applied to the cached document instead of forcing a reload
+COUNTER_FIELDS = {"download_count", "last_downloaded_at", APPLIED_KEYS_FIELD}
+
+
+class ResourceCatalogCache:
+    """Whole-catalog cache with id/category/featured indexes"""
+
+    def __init__(self, db, ttl: float = 300.0, use_change_stream: bool = True):
+        self.db = db
+        self.ttl = ttl
+        self.use_change_stream = use_change_stream
+
+        self._by_id: Dict[str, dict] = {}
+        self._id_by_object_id: Dict[object, str] = {}
+        self._ordered: List[dict] = []
+        self._by_category: Dict[str, List[dict]] = {}
+        self._featured: List[dict] = []
+        self._loaded_at: Optional[float] = None
+        self._stale = True
+        self._lock = asyncio.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self._active = False
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.invalidations = 0
+        self.change_stream_active = False
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    async def start(self):
+        """Load the catalog and start watching for changes"""
+        self._active = True
+        try:
+            await self._reload()
+        except PyMongoError as e:
+            # Leave the cache stale; the first read retries the load
+            logger.error(f"Initial resource catalog load failed: {str(e)}")
+        if self.use_change_stream:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        self._active = False
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        self._stale = True
+        self.invalidations += 1
+
+    def record_download(self, resource_id: str):
+        """Mirror a download counter increment made by this process.
+
+        With a change stream the increment arrives from MongoDB instead, which
+        also covers increments made by other workers.
+        """
+        if self.change_stream_active:
+            return
+        resource = self._by_id.get(resource_id)
+        if resource is not None:
+            resource["download_count"] = resource.get("download_count", 0) + 1
+
+    async def get(self, resource_id: str) -> Optional[dict]:
+        await self._ensure_fresh()
+        return self._by_id.get(resource_id)
+
+    async def list(self, category: Optional[str] = None, featured: Optional[bool] = None) -> List[dict]:
+        """Resources matching the filters, ordered by (created_at, id)"""
+        await self._ensure_fresh()
+        if featured and not category:
+            return self._featured
+        resources = self._by_category.get(category, []) if category else self._ordered
+        if featured is not None:
+            return [r for r in resources if r.get("featured", False) == featured]
+        return resources
+
+    async def most_downloaded(self, limit: int) -> List[dict]:
+        await self._ensure_fresh()
+        return sorted(self._ordered, key=lambda r: r.get("download_count", 0), reverse=True)[:limit]
+
+    async def page(
+        self,
+        category: Optional[str] = None,
+        featured: Optional[bool] = None,
+        limit: Optional[int] = pagination.DEFAULT_PAGE_SIZE,
+        after: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Keyset page over the cached catalog, matching pagination.fetch_page; no limit returns every match"""
+        resources = await self.list(category, featured)
+        if after:
+            key = pagination.decode_cursor(after)
+            resources = [r for r in resources if (r["created_at"], r["id"]) > key]
+        next_cursor = None
+        if limit is not None and len(resources) > limit:
+            resources = resources[:limit]
+            last = resources[-1]
+            next_cursor = pagination.encode_cursor(last["created_at"], last["id"])
+        return resources, next_cursor
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "active": self._active,
+            "size": len(self._by_id),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "reloads": self.reloads,
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 3) if self._loaded_at else None,
+            "change_stream_active": self.change_stream_active,
+        }
+
+    def _is_fresh(self) -> bool:
+        return (
+            not self._stale
+            and self._loaded_at is not None
+            and time.monotonic() - self._loaded_at < self.ttl
+        )
+
+    async def _ensure_fresh(self):
+        if self._is_fresh():
+            self.hits += 1
+            return
+        async with self._lock:
+            # Another request may have reloaded while we waited for the lock
+            if self._is_fresh():
+                self.hits += 1
+                return
+            self.misses += 1
+            await self._reload()
+
+    async def _reload(self):
+        resources = await self.db.resources.find({}, {APPLIED_KEYS_FIELD: 0}).to_list(None)
+        id_by_object_id = {resource.pop("_id"): resource["id"] for resource in resources}
+        resources.sort(key=lambda r: (r["created_at"], r["id"]))
+
+        by_category = defaultdict(list)
+        for resource in resources:
+            by_category[resource["category"]].append(resource)
+
+        self._ordered = resources
+        self._by_id = {resource["id"]: resource for resource in resources}
+        self._id_by_object_id = id_by_object_id
+        self._by_category = dict(by_category)
+        self._featured = [resource for resource in resources if resource.get("featured", False)]
+        self._loaded_at = time.monotonic()
+        self._stale = False
+        self.reloads += 1
+
+    async def _watch(self):
+        try:
+            async with self.db.resources.watch() as stream:
+                self.change_stream_active = True
+                logger.info("Resource catalog cache is watching the resources change stream")
+                async for change in stream:
+                    self._apply_change(change)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            # Standalone servers have no change streams; fall back to the TTL
+            logger.info(f"Resource change stream unavailable, using {self.ttl}s TTL: {str(e)}")
+        finally:
+            self.change_stream_active = False
+
+    def _apply_change(self, change: dict):
+        description = change.get("updateDescription") or {}
+        updated_fields = description.get("updatedFields") or {}
+        if (
+            change.get("operationType") == "update"
+            and updated_fields
+            and {field.split(".")[0] for field in updated_fields} <= COUNTER_FIELDS
+            and not description.get("removedFields")
+        ):
+            # Counter bumps from the download path; apply them in place
+            object_id = (change.get("documentKey") or {}).get("_id")
+            resource = self._by_id.get(self._id_by_object_id.get(object_id))
+            if resource is not None:
+                resource.update({
+                    field: value for field, value in updated_fields.items()
+                    if field in ("download_count", "last_downloaded_at")
+                })
+                return
+        self.invalidate()
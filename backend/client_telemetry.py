@@ -0,0 +1,262 @@
+"""
+Ingestion of browser error reports and performance beacons.
+
+The frontend monitors post to ``/api/errors/batch`` and
+``/api/analytics/performance``, often through ``navigator.sendBeacon``, which
+sends a ``text/plain`` body. ``read_beacon_body`` reads at most
+``MAX_BEACON_BYTES`` of it and ``parse_beacon`` accepts JSON under any content
+type. ``TelemetryGate`` decides which documents are stored:
+
+* sampling: a fraction of sessions is kept (by a hash of the session id, so a
+  sampled session is kept whole); high-severity errors are always kept
+* deduplication: identical error fingerprints from one session are stored once
+  per window; repeats within a batch are folded into ``occurrences``
+* rate caps: fixed one-minute windows per session and for the whole process,
+  so a single broken page cannot flood the collections
+"""
+
+import hashlib
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+ERRORS_COLLECTION = "client_errors"
+PERFORMANCE_COLLECTION = "performance_metrics"
+
+MAX_BEACON_BYTES = 64 * 1024
+MAX_MESSAGE_LENGTH = 1000
+MAX_STACK_LENGTH = 8000
+# Bounds on the per-session bookkeeping kept in memory
+MAX_TRACKED_SESSIONS = 10000
+MAX_TRACKED_FINGERPRINTS = 50000
+
+ALWAYS_KEPT_SEVERITIES = {"high", "critical"}
+
+_NUMBERS = re.compile(r"\d+")
+
+
+class BeaconError(ValueError):
+    """A beacon the endpoint rejects; ``status_code`` is the HTTP status to answer with"""
+    status_code = 400
+
+
+class BeaconTooLarge(BeaconError):
+    status_code = 413
+
+
+async def read_beacon_body(request, limit: int = MAX_BEACON_BYTES) -> bytes:
+    """Read a request body, refusing it once it exceeds ``limit`` bytes.
+
+    A declared Content-Length is checked before anything is read; a chunked or
+    understated body is read incrementally and abandoned at the limit.
+    """
+    declared = request.headers.get("content-length")
+    if declared is not None:
+        try:
+            declared = int(declared)
+        except ValueError:
+            raise BeaconError("Invalid Content-Length")
+        if declared > limit:
+            raise BeaconTooLarge(f"Payload exceeds {limit} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > limit:
+            raise BeaconTooLarge(f"Payload exceeds {limit} bytes")
+    return bytes(body)
+
+
+def parse_beacon(body: bytes) -> Any:
+    """Decode a JSON beacon body regardless of the Content-Type it was sent with"""
+    if len(body) > MAX_BEACON_BYTES:
+        raise BeaconTooLarge(f"Payload exceeds {MAX_BEACON_BYTES} bytes")
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise BeaconError("Payload is not valid JSON")
+
+
+def client_time(value) -> Optional[datetime]:
+    """Convert a browser Date.now() value (epoch milliseconds) to a datetime"""
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return None
+    try:
+        return datetime.utcfromtimestamp(value / 1000)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def _truncate(value, length: int) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value)
+    return value if len(value) <= length else value[:length]
+
+
+def error_fingerprint(error: dict) -> str:
+    """Identify an error independently of the values interpolated into its message.
+
+    Numbers are masked so "Request failed: 502" and "... 504", or "Slow request:
+    5123ms" and "6001ms", count as the same error.
+    """
+    message = _NUMBERS.sub("#", str(error.get("message") or ""))
+    location = error.get("filename") or error.get("url") or ""
+    parts = [str(error.get("type") or "unknown"), message[:200], str(location).split("?")[0], str(error.get("lineno") or "")]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def build_error_document(error: dict, envelope: dict, client_ip: Optional[str], user_agent: Optional[str]) -> dict:
+    """Normalize one reported error; unknown fields are kept under ``details``"""
+    known = {"id", "type", "message", "stack", "severity", "session_id", "timestamp", "page_url", "url", "user_agent"}
+    return {
+        "id": str(uuid.uuid4()),
+        "client_error_id": _truncate(error.get("id"), 100),
+        "fingerprint": error_fingerprint(error),
+        "type": _truncate(error.get("type") or "unknown", 100),
+        "message": _truncate(error.get("message"), MAX_MESSAGE_LENGTH),
+        "stack": _truncate(error.get("stack"), MAX_STACK_LENGTH),
+        "severity": _truncate(error.get("severity") or "medium", 20),
+        "session_id": _truncate(error.get("session_id") or envelope.get("session_id"), 100),
+        "page_url": _truncate(error.get("page_url") or envelope.get("page_url") or error.get("url"), 2000),
+        "url": _truncate(error.get("url"), 2000),
+        "details": {key: value for key, value in error.items() if key not in known},
+        "occurrences": 1,
+        "user_agent": _truncate(envelope.get("user_agent") or user_agent, 500),
+        "ip_address": client_ip,
+        "client_timestamp": client_time(error.get("timestamp")),
+        "timestamp": datetime.utcnow(),
+    }
+
+
+def build_performance_document(beacon: dict, client_ip: Optional[str], user_agent: Optional[str]) -> dict:
+    data = beacon.get("data")
+    return {
+        "id": str(uuid.uuid4()),
+        "type": _truncate(beacon.get("type") or "unknown", 100),
+        "data": data if isinstance(data, dict) else {},
+        "session_id": _truncate(beacon.get("session_id"), 100),
+        "page_url": _truncate(beacon.get("url"), 2000),
+        "user_agent": _truncate(beacon.get("user_agent") or user_agent, 500),
+        "ip_address": client_ip,
+        "client_timestamp": client_time(beacon.get("timestamp")),
+        "timestamp": datetime.utcnow(),
+    }
+
+
+def session_sampled(session_id: Optional[str], rate: float) -> bool:
+    """Deterministic per-session sampling decision"""
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    digest = hashlib.sha1(str(session_id or "").encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64 < rate
+
+
+class _Windows:
+    """Fixed one-minute counters per key, dropping the least recently used keys past a bound"""
+
+    def __init__(self, limit: int, max_keys: int = MAX_TRACKED_SESSIONS, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._counts: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+
+    def admit(self, key: str, amount: int, now: float) -> int:
+        """How many of ``amount`` new documents fit in the key's current window"""
+        if self.limit <= 0:
+            return amount
+        started, used = self._counts.pop(key, (now, 0))
+        if now - started >= self.window:
+            started, used = now, 0
+        admitted = max(min(amount, self.limit - used), 0)
+        self._counts[key] = (started, used + admitted)
+        while len(self._counts) > self.max_keys:
+            self._counts.popitem(last=False)
+        return admitted
+
+
+class TelemetryGate:
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        session_limit: int = 0,
+        global_limit: int = 0,
+        dedup_window: float = 0.0,
+    ):
+        self.sample_rate = sample_rate
+        self.dedup_window = dedup_window
+        self._sessions = _Windows(session_limit)
+        self._global = _Windows(global_limit, max_keys=1)
+        self._seen: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"received": 0, "stored": 0, "sampled_out": 0, "duplicates": 0, "rate_limited": 0}
+
+    def _duplicate(self, session_id: str, fingerprint: str, now: float) -> bool:
+        key = (session_id, fingerprint)
+        seen_at = self._seen.get(key)
+        if seen_at is not None and now - seen_at < self.dedup_window:
+            return True
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+        while len(self._seen) > MAX_TRACKED_FINGERPRINTS:
+            self._seen.popitem(last=False)
+        return False
+
+    def admit(self, documents: List[dict], dedupe: bool = False) -> Tuple[List[dict], Dict[str, int]]:
+        """Filter documents through sampling, deduplication and the rate caps"""
+        outcome = {"received": len(documents), "stored": 0, "sampled_out": 0, "duplicates": 0, "rate_limited": 0}
+        now = time.monotonic()
+        kept: List[dict] = []
+        with self._lock:
+            by_fingerprint: Dict[Tuple[str, str], dict] = {}
+            for document in documents:
+                session_id = document.get("session_id") or ""
+                if document.get("severity") not in ALWAYS_KEPT_SEVERITIES and not session_sampled(session_id, self.sample_rate):
+                    outcome["sampled_out"] += 1
+                    continue
+                if dedupe:
+                    key = (session_id, document["fingerprint"])
+                    if key in by_fingerprint:
+                        by_fingerprint[key]["occurrences"] += 1
+                        outcome["duplicates"] += 1
+                        continue
+                    if self.dedup_window > 0 and self._duplicate(session_id, document["fingerprint"], now):
+                        outcome["duplicates"] += 1
+                        continue
+                    by_fingerprint[key] = document
+                kept.append(document)
+
+            admitted: List[dict] = []
+            per_session: Dict[str, List[dict]] = {}
+            for document in kept:
+                per_session.setdefault(document.get("session_id") or "", []).append(document)
+            for session_id, session_documents in per_session.items():
+                allowed = self._sessions.admit(session_id, len(session_documents), now)
+                admitted.extend(session_documents[:allowed])
+            allowed = self._global.admit("all", len(admitted), now)
+            outcome["rate_limited"] = len(kept) - allowed
+            admitted = admitted[:allowed]
+            outcome["stored"] = len(admitted)
+
+            for key, value in outcome.items():
+                self.counts[key] += value
+        return admitted, outcome
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "session_limit_per_minute": self._sessions.limit,
+                "global_limit_per_minute": self._global.limit,
+                "dedup_window_seconds": self.dedup_window,
+                "tracked_sessions": len(self._sessions._counts),
+                "tracked_fingerprints": len(self._seen),
+                **self.counts,
+            }
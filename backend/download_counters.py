@@ -0,0 +1,56 @@
+"""
+Idempotent resource download counters.
+
+Each download record's ``id`` is its idempotency key. The counter increment
+on the resource is guarded by a bounded list of recently applied keys, so
+retrying a flush (or a client retrying with the same key) never counts a
+download twice. The time of the latest download is kept in
+``last_downloaded_at`` so that ``updated_at`` (and the catalog validators
+derived from it) still means the last edit.
+"""
+
+import asyncio
+import logging
+from typing import List
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+APPLIED_KEYS_FIELD = "_applied_downloads"
+# How many recent keys each resource remembers; retries older than this are not deduplicated
+APPLIED_KEYS_WINDOW = 500
+
+
+def build_counter_operations(downloads: List[dict]) -> List[UpdateOne]:
+    operations = []
+    for download in downloads:
+        operations.append(UpdateOne(
+            {"id": download["resource_id"], APPLIED_KEYS_FIELD: {"$ne": download["id"]}},
+            {
+                "$inc": {"download_count": 1},
+                "$max": {"last_downloaded_at": download["timestamp"]},
+                "$push": {APPLIED_KEYS_FIELD: {"$each": [download["id"]], "$slice": -APPLIED_KEYS_WINDOW}},
+            },
+        ))
+    return operations
+
+
+async def apply_download_counters(db, downloads: List[dict], max_retries: int = 3, retry_backoff: float = 0.5) -> int:
+    """Increment download_count once per download record; returns the number applied.
+
+    Safe to retry: increments already applied are skipped by the key guard.
+    """
+    operations = build_counter_operations(downloads)
+    if not operations:
+        return 0
+    for attempt in range(max_retries + 1):
+        try:
+            result = await db.resources.bulk_write(operations, ordered=False)
+            return result.modified_count
+        except Exception as e:
+            if attempt == max_retries:
+                logger.error(f"Failed to apply {len(operations)} download counter increments: {str(e)}")
+                raise
+            await asyncio.sleep(retry_backoff * (2 ** attempt))
+    return 0
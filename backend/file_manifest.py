@@ -0,0 +1,190 @@
+"""
+Startup-built manifest of the downloadable files under public/resources.
+
+Each file's size, mtime, sha256 and content type are recorded once, so the
+download path needs no filesystem calls per request and ETags are content
+hashes. An optional polling task picks up added, changed and removed files.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import stat
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from file_responses import detect_content_type, file_etag
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    relative_path: str
+    path: Path
+    stat_result: os.stat_result
+    content_type: str
+    sha256: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return self.stat_result.st_size
+
+    @property
+    def mtime(self) -> datetime:
+        return datetime.fromtimestamp(int(self.stat_result.st_mtime), tz=timezone.utc)
+
+    @property
+    def etag(self) -> str:
+        """Content-hash ETag when the file was hashed, size/mtime ETag otherwise"""
+        if self.sha256:
+            return f'"{self.sha256[:32]}"'
+        return file_etag(self.stat_result)
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.relative_path,
+            "size": self.size,
+            "mtime": self.mtime,
+            "sha256": self.sha256,
+            "content_type": self.content_type,
+        }
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_entry(root: Path, relative_path: str, hash_contents: bool = True) -> Optional[ManifestEntry]:
+    """Stat (and hash) one file under root; None if missing, not a file, or outside root"""
+    path = (root / relative_path).resolve()
+    if not path.is_relative_to(root.resolve()):
+        return None
+    try:
+        stat_result = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    return ManifestEntry(
+        relative_path=Path(relative_path).as_posix(),
+        path=path,
+        stat_result=stat_result,
+        content_type=detect_content_type(path),
+        sha256=_sha256(path) if hash_contents else None,
+    )
+
+
+class FileManifest:
+    """Index of files under ``root`` keyed by their path relative to it"""
+
+    def __init__(self, root: Path, refresh_interval: float = 0.0):
+        self.root = Path(root)
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[str, ManifestEntry] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._active = False
+        self.built_at: Optional[datetime] = None
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def get(self, relative_path: str) -> Optional[ManifestEntry]:
+        return self._entries.get(Path(relative_path).as_posix())
+
+    def entries(self) -> List[ManifestEntry]:
+        return sorted(self._entries.values(), key=lambda entry: entry.relative_path)
+
+    async def start(self):
+        """Build the manifest off the event loop and start the polling refresh"""
+        await asyncio.to_thread(self.scan)
+        self._active = True
+        logger.info(f"File manifest built with {len(self._entries)} files under {self.root}")
+        if self.refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        self._active = False
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def load(self, relative_path: str) -> Optional[ManifestEntry]:
+        """Index a file that is not in the manifest yet, e.g. added since the last scan"""
+        entry = await asyncio.to_thread(load_entry, self.root, relative_path)
+        if entry is not None:
+            self._entries[entry.relative_path] = entry
+        return entry
+
+    def scan(self) -> dict:
+        """Rescan the tree, rehashing only files whose size or mtime changed"""
+        seen = {}
+        added = changed = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                relative_path = (Path(directory) / filename).relative_to(self.root).as_posix()
+                current = self._entries.get(relative_path)
+                try:
+                    stat_result = os.stat(self.root / relative_path)
+                except FileNotFoundError:
+                    continue
+                if (
+                    current is not None
+                    and current.stat_result.st_size == stat_result.st_size
+                    and current.stat_result.st_mtime_ns == stat_result.st_mtime_ns
+                ):
+                    seen[relative_path] = current
+                    continue
+                entry = load_entry(self.root, relative_path)
+                if entry is None:
+                    continue
+                seen[relative_path] = entry
+                if current is None:
+                    added += 1
+                else:
+                    changed += 1
+        removed = len(set(self._entries) - set(seen))
+        self._entries = seen
+        self.built_at = datetime.utcnow()
+        return {"files": len(seen), "added": added, "changed": changed, "removed": removed}
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                result = await asyncio.to_thread(self.scan)
+            except OSError as e:
+                logger.error(f"File manifest refresh failed: {str(e)}")
+                continue
+            if result["added"] or result["changed"] or result["removed"]:
+                logger.info(f"File manifest refreshed: {result}")
+
+
+async def sync_resource_file_sizes(db, manifest: FileManifest) -> int:
+    """Correct resources whose stored file_size differs from the real file; returns the number updated"""
+    updated = 0
+    resources = await db.resources.find({}, {"_id": 0, "id": 1, "file_path": 1, "file_size": 1}).to_list(None)
+    for resource in resources:
+        entry = manifest.get(resource.get("file_path", ""))
+        if entry is None or resource.get("file_size") == entry.size:
+            continue
+        await db.resources.update_one(
+            {"id": resource["id"]},
+            {"$set": {"file_size": entry.size, "updated_at": datetime.utcnow()}}
+        )
+        updated += 1
+    return updated
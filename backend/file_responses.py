@@ -0,0 +1,174 @@
+"""
+File delivery with byte-range support.
+
+``RangedFileResponse`` extends Starlette's ``FileResponse`` with single-range
+``Range`` / ``If-Range`` handling (206 / 416 responses) and hands the transfer
+to the server via the ASGI ``http.response.pathsend`` or
+``http.response.zerocopy`` extensions when the server offers them.
+"""
+
+import mimetypes
+import os
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from hashlib import blake2b
+from typing import Mapping, Optional, Tuple
+
+import anyio
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+# Leading bytes of file types we serve, for files without a useful extension
+SIGNATURES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"GIF8", "image/gif"),
+)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag from the file's size and modification time"""
+    digest = blake2b(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def file_last_modified(stat_result: os.stat_result) -> datetime:
+    return datetime.fromtimestamp(int(stat_result.st_mtime), tz=timezone.utc)
+
+
+def detect_content_type(path, sniff: bool = True) -> str:
+    """Content type from the file extension, falling back to the file's magic bytes"""
+    content_type, _ = mimetypes.guess_type(str(path))
+    if content_type:
+        return content_type
+    if sniff:
+        try:
+            with open(path, "rb") as file:
+                head = file.read(16)
+        except OSError:
+            head = b""
+        for signature, signature_type in SIGNATURES:
+            if head.startswith(signature):
+                return signature_type
+    return "application/octet-stream"
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single byte range into an inclusive (start, end) pair.
+
+    Returns None when the header should be ignored (not a bytes range, or
+    several ranges, which we serve as a full response). Raises
+    RangeNotSatisfiable when the range lies outside the file.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def is_resumed_download(range_header: Optional[str]) -> bool:
+    """True when a Range request continues a transfer rather than starting one"""
+    if not range_header:
+        return False
+    unit, _, ranges = range_header.partition("=")
+    first = ranges.split(",")[0].strip().partition("-")[0]
+    return unit.strip().lower() == "bytes" and first.isdigit() and int(first) > 0
+
+
+class RangedFileResponse(FileResponse):
+    """FileResponse with Range/If-Range support and zero-copy delivery"""
+
+    def __init__(self, path, stat_result: os.stat_result, etag: str, headers: Optional[Mapping[str, str]] = None, **kwargs):
+        headers = dict(headers or {})
+        headers.setdefault("etag", etag)
+        headers["accept-ranges"] = "bytes"
+        super().__init__(path, headers=headers, stat_result=stat_result, **kwargs)
+        self.etag = etag
+
+    def _if_range_matches(self, if_range: Optional[str]) -> bool:
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # If-Range requires a strong match
+            return if_range == self.etag
+        try:
+            since = parsedate_to_datetime(if_range)
+        except (TypeError, ValueError):
+            return False
+        return int(self.stat_result.st_mtime) <= since.timestamp()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        size = self.stat_result.st_size
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        byte_range = None
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_matches(request_headers.get("if-range")):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                await self._send_not_satisfiable(size, send)
+                return
+
+        if byte_range is None or byte_range == (0, size - 1):
+            await super().__call__(scope, receive, send)
+            return
+
+        start, end = byte_range
+        count = end - start + 1
+        self.status_code = 206
+        self.headers["content-length"] = str(count)
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+
+        extensions = scope.get("extensions") or {}
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopy" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopy", "file": file, "offset": start, "count": count})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = count
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+    async def _send_not_satisfiable(self, size: int, send: Send):
+        headers = [
+            (b"content-range", f"bytes */{size}".encode("latin-1")),
+            (b"content-length", b"0"),
+            (b"accept-ranges", b"bytes"),
+        ]
+        await send({"type": "http.response.start", "status": 416, "headers": headers})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,109 @@
+"""
+HTTP validators and conditional request handling.
+
+Endpoints compute a strong ETag and Last-Modified from the documents they are
+about to return and answer ``If-None-Match`` / ``If-Modified-Since`` with a 304
+before building any response models.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+
+# Fields that change whenever a resource representation changes
+ETAG_FIELDS = ("id", "updated_at", "download_count")
+
+
+def compute_etag(documents: Iterable[dict], variant: str = "") -> str:
+    """Strong ETag over the identity and version fields of the documents.
+
+    ``variant`` distinguishes representations built from the same documents,
+    e.g. different query strings for the same list endpoint.
+    """
+    digest = hashlib.blake2b(variant.encode(), digest_size=16)
+    for document in documents:
+        for field in ETAG_FIELDS:
+            value = document.get(field)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            digest.update(f"{value}\x1f".encode())
+        digest.update(b"\x1e")
+    return f'"{digest.hexdigest()}"'
+
+
+# Fields that time a change to a resource representation; download_count
+# changes with last_downloaded_at and leaves updated_at alone
+LAST_MODIFIED_FIELDS = ("updated_at", "last_downloaded_at")
+
+
+def compute_last_modified(documents: Iterable[dict], fields: Iterable[str] = LAST_MODIFIED_FIELDS) -> Optional[datetime]:
+    """Latest modification time across the documents, as an aware UTC datetime"""
+    latest = None
+    for document in documents:
+        for field in fields:
+            value = document.get(field)
+            if isinstance(value, datetime) and (latest is None or value > latest):
+                latest = value
+    if latest is None:
+        return None
+    if latest.tzinfo is None:
+        latest = latest.replace(tzinfo=timezone.utc)
+    return latest
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since when it is absent"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime], cache_control: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def conditional_response(
+    request: Request,
+    response: Response,
+    documents: list,
+    cache_control: str,
+    variant: str = "",
+) -> Optional[Response]:
+    """Return a 304 response if the client's copy is current, otherwise set validators on ``response``"""
+    etag = compute_etag(documents, variant)
+    last_modified = compute_last_modified(documents)
+    headers = validator_headers(etag, last_modified, cache_control)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,228 @@
+"""
+Declarative index registry and query-shape coverage report.
+
+``INDEXES`` lists the indexes every collection needs for the queries in
+server.py; ``ensure_indexes`` applies them idempotently at startup.
+``QUERY_SHAPES`` mirrors those queries so ``explain_query_shapes`` can flag any
+that fall back to a collection scan or an in-memory sort.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS_CONFLICT = 85
+
+# Index names are left to the server's defaults so they match indexes created by
+# earlier versions of init_resources.py
+INDEXES: Dict[str, List[IndexModel]] = {
+    "resources": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("category", ASCENDING)]),
+        IndexModel([("featured", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("download_count", DESCENDING)]),
+    ],
+    "resource_downloads": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("resource_id", ASCENDING)]),
+        IndexModel([("timestamp", ASCENDING)]),
+        IndexModel([("resource_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "link_interactions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("link_category", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "analytics_events": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("event_type", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "contact_forms": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "status_checks": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "client_errors": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("fingerprint", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "performance_metrics": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("type", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "sessions": [
+        IndexModel([("session_id", ASCENDING), ("last_seen_at", DESCENDING)]),
+        IndexModel([("started_at", ASCENDING)]),
+        IndexModel([("step_names", ASCENDING), ("started_at", ASCENDING)]),
+    ],
+    "rate_limit_buckets": [
+        # Buckets are deleted once they would be full again
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "web_vitals_sketches": [
+        IndexModel([("metric", ASCENDING), ("bucket", ASCENDING)]),
+        IndexModel([("metric", ASCENDING), ("page", ASCENDING), ("bucket", ASCENDING)]),
+    ],
+    "analytics_rollups": [
+        IndexModel([("kind", ASCENDING), ("interactions", DESCENDING)]),
+        IndexModel([("kind", ASCENDING), ("downloads", DESCENDING)]),
+        IndexModel([("kind", ASCENDING), ("bucket", ASCENDING)]),
+    ],
+}
+
+SAMPLE_ID = "00000000-0000-0000-0000-000000000000"
+
+# Query shapes issued by server.py, with placeholder values
+QUERY_SHAPES = [
+    {"name": "resource_by_id", "collection": "resources", "filter": {"id": SAMPLE_ID}},
+    {"name": "resources_page", "collection": "resources", "filter": {"category": "guides"},
+     "sort": {"created_at": 1, "id": 1}, "limit": 101},
+    {"name": "featured_resources_page", "collection": "resources", "filter": {"featured": True},
+     "sort": {"created_at": 1, "id": 1}, "limit": 101},
+    {"name": "most_downloaded", "collection": "resources", "filter": {},
+     "sort": {"download_count": -1}, "limit": 10},
+    {"name": "resource_recent_downloads", "collection": "resource_downloads",
+     "filter": {"resource_id": SAMPLE_ID}, "sort": {"timestamp": -1}, "limit": 10},
+    {"name": "recent_downloads", "collection": "resource_downloads", "filter": {},
+     "sort": {"timestamp": -1}, "limit": 10},
+    {"name": "recent_interactions", "collection": "link_interactions", "filter": {},
+     "sort": {"timestamp": -1}, "limit": 10},
+    {"name": "contact_forms_page", "collection": "contact_forms", "filter": {},
+     "sort": {"timestamp": 1, "id": 1}, "limit": 101},
+    {"name": "status_checks_page", "collection": "status_checks", "filter": {},
+     "sort": {"timestamp": 1, "id": 1}, "limit": 101},
+    {"name": "rollup_categories", "collection": "analytics_rollups", "filter": {"kind": "link_category"},
+     "sort": {"interactions": -1}, "limit": 10},
+    {"name": "rollup_hours", "collection": "analytics_rollups",
+     "filter": {"kind": "hour", "bucket": {"$gte": "$$RANGE_START"}}},
+    {"name": "rollup_download_categories", "collection": "analytics_rollups", "filter": {"kind": "download_category"},
+     "sort": {"downloads": -1}, "limit": 10},
+    {"name": "web_vitals_sketches", "collection": "web_vitals_sketches",
+     "filter": {"metric": {"$in": ["lcp", "inp"]}, "page": "/", "bucket": {"$gte": "$$RANGE_START", "$lt": "$$RANGE_END"}}},
+    {"name": "web_vitals_sketches_all_pages", "collection": "web_vitals_sketches",
+     "filter": {"metric": {"$in": ["lcp", "inp"]}, "bucket": {"$gte": "$$RANGE_START", "$lt": "$$RANGE_END"}}},
+    {"name": "unique_counts_by_day", "collection": "unique_counts",
+     "filter": {"_id": {"$in": ["all|2024-05-01", "all|2024-05-02"]}}},
+    {"name": "funnel_sessions", "collection": "sessions",
+     "filter": {"started_at": {"$gte": "$$RANGE_START"}, "step_names": "page_view"}},
+    # Sessionizer: first unprocessed event, then one window of events, per source collection
+    {"name": "sessionizer_earliest_event", "collection": "analytics_events",
+     "filter": {"timestamp": {"$gte": "$$RANGE_START"}}, "sort": {"timestamp": 1}, "limit": 1},
+    {"name": "sessionizer_earliest_interaction", "collection": "link_interactions",
+     "filter": {"timestamp": {"$gte": "$$RANGE_START"}}, "sort": {"timestamp": 1}, "limit": 1},
+    {"name": "sessionizer_event_window", "collection": "analytics_events",
+     "filter": {"timestamp": {"$gte": "$$RANGE_START", "$lt": "$$RANGE_END"}, "session_id": {"$nin": [None, ""]}}},
+    {"name": "sessionizer_interaction_window", "collection": "link_interactions",
+     "filter": {"timestamp": {"$gte": "$$RANGE_START", "$lt": "$$RANGE_END"}, "session_id": {"$nin": [None, ""]}}},
+    {"name": "open_sessions", "collection": "sessions",
+     "filter": {"session_id": {"$in": [SAMPLE_ID]}, "last_seen_at": {"$gte": "$$RANGE_START"}}},
+    {"name": "downloads_missing_category", "collection": "resource_downloads",
+     "filter": {"resource_id": SAMPLE_ID, "resource_category": {"$exists": False}}},
+]
+
+
+async def ensure_indexes(db) -> dict:
+    """Create any missing registry indexes; existing ones are left untouched"""
+    report = {"created": {}, "errors": {}}
+    for collection_name, models in INDEXES.items():
+        try:
+            report["created"][collection_name] = await db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            # One conflicting index (e.g. duplicate ids blocking a unique index)
+            # should not keep the others from being built
+            created = []
+            for model in models:
+                try:
+                    created.extend(await db[collection_name].create_indexes([model]))
+                except OperationFailure as index_error:
+                    if index_error.code == INDEX_OPTIONS_CONFLICT:
+                        # Same keys already indexed with other options, e.g. a TTL set by retention.py
+                        continue
+                    report["errors"].setdefault(collection_name, []).append(str(index_error))
+            report["created"][collection_name] = created
+            logger.error(f"Index creation on {collection_name} partially failed: {str(e)}")
+    return report
+
+
+def _plan_stages(node, stages: List[str]):
+    """Collect every stage name in an explain document, skipping rejected plans"""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.append(value)
+            else:
+                _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, stages)
+    return stages
+
+
+def _explain_command(shape: dict) -> dict:
+    if "pipeline" in shape:
+        return {"aggregate": shape["collection"], "pipeline": shape["pipeline"], "cursor": {}}
+    command = {"find": shape["collection"], "filter": _with_sample_values(shape["filter"])}
+    if "sort" in shape:
+        command["sort"] = shape["sort"]
+    if "limit" in shape:
+        command["limit"] = shape["limit"]
+    return command
+
+
+def _with_sample_values(query):
+    if isinstance(query, dict):
+        return {key: _with_sample_values(value) for key, value in query.items()}
+    if query == "$$RANGE_START":
+        return datetime.utcnow() - timedelta(days=30)
+    if query == "$$RANGE_END":
+        return datetime.utcnow()
+    return query
+
+
+async def explain_query_shapes(db) -> List[dict]:
+    """Explain each registered query shape and flag collection scans and blocking sorts"""
+    results = []
+    for shape in QUERY_SHAPES:
+        result = {"name": shape["name"], "collection": shape["collection"]}
+        try:
+            explain = await db.command({"explain": _explain_command(shape), "verbosity": "queryPlanner"})
+        except OperationFailure as e:
+            result["error"] = str(e)
+            results.append(result)
+            continue
+        stages = _plan_stages(explain, [])
+        result["stages"] = stages
+        result["collection_scan"] = "COLLSCAN" in stages
+        result["in_memory_sort"] = "SORT" in stages
+        results.append(result)
+    return results
+
+
+async def index_report(db) -> dict:
+    """Current indexes per collection plus the explain results for every query shape"""
+    current = {}
+    for collection_name in INDEXES:
+        current[collection_name] = [index async for index in db[collection_name].list_indexes()]
+        for index in current[collection_name]:
+            index["key"] = dict(index["key"])
+    shapes = await explain_query_shapes(db)
+    return {
+        "indexes": current,
+        "query_shapes": shapes,
+        "collection_scans": [shape["name"] for shape in shapes if shape.get("collection_scan")],
+        "in_memory_sorts": [shape["name"] for shape in shapes if shape.get("in_memory_sort")],
+    }
@@ -11,6 +11,9 @@ from pathlib import Path
 from datetime import datetime
 import uuid
 
+from file_manifest import FileManifest, sync_resource_file_sizes
+from indexes import ensure_indexes
+
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -128,13 +131,15 @@ async def init_resources():
     result = await db.resources.insert_many(SAMPLE_RESOURCES)
     print(f"Inserted {len(result.inserted_ids)} resources")
     
-    # Create indexes for better performance
-    await db.resources.create_index("category")
-    await db.resources.create_index("featured")
-    await db.resources.create_index("id", unique=True)
-    await db.resource_downloads.create_index("resource_id")
-    await db.resource_downloads.create_index("timestamp")
-    print("Created database indexes")
+    # Replace the estimated file sizes with the real ones
+    manifest = FileManifest(ROOT_DIR / "public" / "resources")
+    manifest.scan()
+    synced = await sync_resource_file_sizes(db, manifest)
+    print(f"Synced file sizes for {synced} resources from {len(manifest.entries())} files")
+    
+    # Create indexes for better performance (the server also applies these at startup)
+    report = await ensure_indexes(db)
+    print(f"Created database indexes: {report['created']}")
     
     print("Resource initialization complete!")
 
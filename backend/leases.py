@@ -0,0 +1,43 @@
+"""
+Leases on MongoDB state documents for jobs that every worker process starts.
+
+gunicorn runs one copy of each background service per worker. Before working,
+a service claims a lease on its state document with a single atomic
+``find_one_and_update``; the other workers see it held and skip that run. A
+lease expires by itself, so a worker that dies while holding one only delays
+the job until ``lease_until``.
+"""
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def new_owner() -> str:
+    """Identifies one service instance across hosts, workers and restarts"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lease(collection, key: str, owner: str, duration: float, now: Optional[datetime] = None) -> bool:
+    """Take or renew the lease on ``collection[key]``; False while another owner holds it"""
+    now = now or datetime.utcnow()
+    try:
+        document = await collection.find_one_and_update(
+            {"_id": key, "$or": [{"lease_owner": owner}, {"lease_until": None}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=duration)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # The document exists but the filter did not match: someone else holds the lease
+        return False
+    return document is not None
+
+
+async def release_lease(collection, key: str, owner: str):
+    await collection.update_one({"_id": key, "lease_owner": owner}, {"$set": {"lease_until": None}})
@@ -0,0 +1,360 @@
+"""
+Prometheus-compatible metrics without a client library.
+
+Counters, gauges and fixed-bucket histograms keyed by label tuples, rendered
+in the text exposition format. ``MetricsMiddleware`` times every HTTP request
+per route template; ``MongoCommandMetrics`` and ``MongoPoolMetrics`` are
+PyMongo event listeners for per-collection operation latency and connection
+pool usage, including checkout wait time and saturation. Observations are a dict lookup, a bisect and two additions, so
+instrumentation stays off the profile. PyMongo listeners fire on Motor's
+worker threads, hence the per-metric lock.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Route label for requests that matched no route, so 404 scans cannot explode label cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (non-cumulative, +Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def average(self, *labels: str) -> float:
+        series = self._series.get(labels)
+        count = sum(series[0]) if series else 0
+        return series[1] / count if count else 0.0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status code", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route", ("method", "route")
+)
+http_response_size = registry.histogram(
+    "http_response_size_bytes", "HTTP response body size by method and route", ("method", "route"), SIZE_BUCKETS
+)
+http_requests_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+app_startup = registry.gauge("app_startup_seconds", "Time spent importing and starting the app, by phase", ("phase",))
+
+mongo_commands = registry.counter(
+    "mongodb_commands_total", "MongoDB commands by collection, command and outcome", ("collection", "command", "outcome")
+)
+mongo_command_duration = registry.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command", ("collection", "command")
+)
+mongo_pool_connections = registry.gauge(
+    "mongodb_pool_connections", "Open connections in the MongoDB connection pool", ("address",)
+)
+mongo_pool_checked_out = registry.gauge(
+    "mongodb_pool_checked_out_connections", "Pool connections currently checked out by operations", ("address",)
+)
+mongo_pool_wait_queue = registry.gauge(
+    "mongodb_pool_wait_queue", "Operations waiting to check out a pool connection", ("address",)
+)
+mongo_pool_saturation = registry.gauge(
+    "mongodb_pool_saturation_ratio", "Checked-out connections as a fraction of maxPoolSize", ("address",)
+)
+mongo_pool_checkout_wait = registry.histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pool connection", ("address",)
+)
+mongo_pool_checkout_failures = registry.counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection checkouts by reason", ("address", "reason")
+)
+
+
+def route_template(scope) -> str:
+    """The matched route's path template, set by FastAPI once the request is routed"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency, status and response size per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            method = scope["method"]
+            route = route_template(scope)
+            http_request_duration.observe(time.perf_counter() - started, method, route)
+            http_response_size.observe(size, method, route)
+            http_requests.inc(method, route, str(status))
+
+
+def command_collection(event) -> str:
+    """Collection a command targets; commands like ping or explain report the database"""
+    value = event.command.get(event.command_name) if hasattr(event, "command") else None
+    return value if isinstance(value, str) else event.database_name
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._collections: Dict[Tuple, str] = {}
+
+    def _key(self, event) -> Tuple:
+        return (event.request_id, event.connection_id)
+
+    def started(self, event):
+        self._collections[self._key(event)] = command_collection(event)
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop(self._key(event), event.database_name)
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, collection, event.command_name)
+        mongo_commands.inc(collection, event.command_name, outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Pool size, checkout wait time and saturation per server address.
+
+    A checkout starts and completes on the same thread, so the wait is timed
+    with a thread-local start time.
+    """
+
+    def __init__(self, max_pool_size: int = 100):
+        self.max_pool_size = max_pool_size
+        self._local = threading.local()
+
+    def _address(self, event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _checkout_finished(self, address: str):
+        mongo_pool_wait_queue.dec(address)
+        started = getattr(self._local, "checkout_started", None)
+        if started is not None:
+            mongo_pool_checkout_wait.observe(time.perf_counter() - started, address)
+            self._local.checkout_started = None
+
+    def _update_saturation(self, address: str):
+        if self.max_pool_size:
+            mongo_pool_saturation.set(address, value=mongo_pool_checked_out.value(address) / self.max_pool_size)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        mongo_pool_connections.set(address, value=0)
+        mongo_pool_checked_out.set(address, value=0)
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc(self._address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec(self._address(event))
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+        mongo_pool_wait_queue.inc(self._address(event))
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        self._checkout_finished(address)
+        mongo_pool_checkout_failures.inc(address, str(event.reason))
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        self._checkout_finished(address)
+        mongo_pool_checked_out.inc(address)
+        self._update_saturation(address)
+
+    def connection_checked_in(self, event):
+        address = self._address(event)
+        mongo_pool_checked_out.dec(address)
+        self._update_saturation(address)
+
+
+def event_listeners() -> list:
+    return [MongoCommandMetrics(), MongoPoolMetrics()]
+
+
+def set_max_pool_size(listeners: list, max_pool_size: int):
+    for listener in listeners:
+        if isinstance(listener, MongoPoolMetrics):
+            listener.max_pool_size = max_pool_size
+
+
+def pool_stats() -> dict:
+    """Current pool gauges and checkout wait per server address"""
+    stats = {}
+    for (address,), connections in mongo_pool_connections._values.copy().items():
+        stats[address] = {
+            "connections": connections,
+            "checked_out": mongo_pool_checked_out.value(address),
+            "wait_queue": mongo_pool_wait_queue.value(address),
+            "saturation": round(mongo_pool_saturation.value(address), 3),
+            "checkouts": mongo_pool_checkout_wait.count(address),
+            "avg_checkout_wait_ms": round(mongo_pool_checkout_wait.average(address) * 1000, 3),
+        }
+    return stats
@@ -0,0 +1,101 @@
+"""
+Keyset pagination and NDJSON streaming for list endpoints.
+
+Pages are ordered by ``(sort_field, id)`` and continued with an opaque cursor
+that encodes the last document's key, so each request reads at most
+``limit + 1`` documents no matter how deep into the collection it is.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(sort_value: datetime, doc_id: str) -> str:
+    """Encode a (sort value, id) key as an opaque URL-safe cursor"""
+    payload = json.dumps({"t": sort_value.isoformat(), "id": doc_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by encode_cursor; raises ValueError if malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["t"]), str(payload["id"])
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def keyset_query(base_query: dict, sort_field: str, after: Optional[str]) -> dict:
+    """Restrict a query to documents that sort after the cursor"""
+    if not after:
+        return base_query
+    sort_value, doc_id = decode_cursor(after)
+    keyset = {
+        "$or": [
+            {sort_field: {"$gt": sort_value}},
+            {sort_field: sort_value, "id": {"$gt": doc_id}},
+        ]
+    }
+    return {"$and": [base_query, keyset]} if base_query else keyset
+
+
+def keyset_sort(sort_field: str) -> List[Tuple[str, int]]:
+    return [(sort_field, 1), ("id", 1)]
+
+
+async def fetch_page(
+    collection,
+    base_query: dict,
+    sort_field: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    projection: Optional[dict] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page of documents and the cursor for the next page, if any"""
+    query = keyset_query(base_query, sort_field, after)
+    documents = await collection.find(query, projection or {"_id": 0}).sort(
+        keyset_sort(sort_field)
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last[sort_field], last["id"])
+    return documents, next_cursor
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def stream_ndjson(
+    collection,
+    base_query: dict,
+    sort_field: str,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    projection: Optional[dict] = None,
+) -> AsyncIterator[bytes]:
+    """Yield documents as newline-delimited JSON straight from the cursor"""
+    query = keyset_query(base_query, sort_field, after)
+    cursor = collection.find(query, projection or {"_id": 0}).sort(
+        keyset_sort(sort_field)
+    ).batch_size(STREAM_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for document in cursor:
+        yield encode_ndjson_line(document)
+
+
+def encode_ndjson_line(document: dict) -> bytes:
+    return (json.dumps(document, default=_json_default) + "\n").encode()
@@ -0,0 +1,223 @@
+"""
+Token-bucket rate limiting for the anonymous write endpoints.
+
+Each route has a limit per client IP and, where the payload carries one, per
+session id (``RATE_LIMIT_<ROUTE>=<per ip>[,<per session>]``, e.g.
+``RATE_LIMIT_CONTACT=5/minute,3/minute``; ``off`` disables a route). A limit
+of N per period allows bursts of N and refills continuously at N per period.
+
+Buckets live in process memory by default. Behind several workers, either
+set ``RATE_LIMIT_WORKERS`` so each worker enforces its share of the limit, or
+use the ``mongo`` backend: every request still checks its local bucket first
+(a local rejection implies a global one, at no I/O cost), then takes a token
+from a bucket document shared by all workers with one atomic update. If
+MongoDB is unavailable, requests are allowed rather than failed.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_COLLECTION = "rate_limit_buckets"
+MAX_LOCAL_BUCKETS = 100000
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Route name -> (per IP, per session)
+DEFAULT_LIMITS = {
+    "status": ("30/minute", None),
+    "contact": ("10/minute", "3/minute"),
+    "track": ("600/minute", "120/minute"),
+    "track_batch": ("120/minute", "30/minute"),
+    "link_click": ("600/minute", "120/minute"),
+    "errors": ("120/minute", "30/minute"),
+    "performance": ("600/minute", "120/minute"),
+}
+
+
+@dataclass(frozen=True)
+class Limit:
+    burst: float
+    rate: float  # tokens per second
+
+    def scaled(self, share: float) -> "Limit":
+        return Limit(max(self.burst * share, 1.0), self.rate * share)
+
+
+def parse_limit(spec: Optional[str]) -> Optional[Limit]:
+    """'100/minute' -> Limit(burst=100, rate=100/60); empty, '0' or 'off' -> None"""
+    if spec is None or spec.strip().lower() in ("", "0", "off", "none"):
+        return None
+    count, _, period = spec.strip().partition("/")
+    seconds = PERIODS.get(period.strip().lower() or "second")
+    if seconds is None:
+        raise ValueError(f"Unknown rate limit period in {spec!r} (use {', '.join(PERIODS)})")
+    count = float(count)
+    return Limit(burst=count, rate=count / seconds)
+
+
+def load_limits(environ) -> Dict[str, Tuple[Optional[Limit], Optional[Limit]]]:
+    limits = {}
+    for route, (ip_default, session_default) in DEFAULT_LIMITS.items():
+        spec = environ.get(f"RATE_LIMIT_{route.upper()}")
+        if spec is not None:
+            ip_spec, _, session_spec = spec.partition(",")
+            limits[route] = (parse_limit(ip_spec), parse_limit(session_spec or None))
+        else:
+            limits[route] = (parse_limit(ip_default), parse_limit(session_default))
+    return limits
+
+
+def client_ip(request, proxy_hops: int = 0) -> Optional[str]:
+    """Client address, taken from X-Forwarded-For when behind ``proxy_hops`` trusted proxies.
+
+    Entries left of the ones our proxies appended are client-supplied, so the
+    address is read counting from the right.
+    """
+    if proxy_hops > 0:
+        forwarded = [part.strip() for part in request.headers.get("x-forwarded-for", "").split(",") if part.strip()]
+        if len(forwarded) >= proxy_hops:
+            return forwarded[-proxy_hops]
+    return request.client.host if request.client else None
+
+
+class LocalBuckets:
+    """In-process token buckets, dropping the least recently used past a bound"""
+
+    def __init__(self, max_buckets: int = MAX_LOCAL_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: Optional[float] = None) -> float:
+        """Take one token; returns 0 when allowed, else seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / limit.rate if limit.rate > 0 else math.inf
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class MongoBuckets:
+    """Token buckets shared by every worker, updated with one atomic pipeline update"""
+
+    def __init__(self, db=None):
+        self.db = db
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [limit.burst, {"$add": [{"$ifNull": ["$tokens", limit.burst]}, {"$multiply": [elapsed, limit.rate]}]}]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated_at": now}},
+            {"$set": {
+                "allowed": {"$gte": ["$tokens", 1]},
+                "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                # Full again by then, so the TTL index may remove it
+                "expires_at": now + timedelta(seconds=limit.burst / limit.rate if limit.rate > 0 else 86400),
+            }},
+        ]
+        for _ in range(2):
+            try:
+                bucket = await self.db[BUCKETS_COLLECTION].find_one_and_update(
+                    {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER,
+                    projection={"_id": 0, "allowed": 1, "tokens": 1},
+                )
+                break
+            except DuplicateKeyError:
+                # Two workers created the bucket at once; the retry updates it
+                continue
+        else:
+            return 0.0
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / limit.rate if limit.rate > 0 else math.inf
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[Optional[Limit], Optional[Limit]]],
+        backend: str = "memory",
+        workers: int = 1,
+        enabled: bool = True,
+    ):
+        self.limits = limits
+        self.backend = backend
+        self.enabled = enabled
+        self.local = LocalBuckets()
+        self.shared = MongoBuckets() if backend == "mongo" else None
+        # Without a shared backend each worker enforces its share of the limit
+        self.share = 1.0 if self.shared is not None else 1.0 / max(workers, 1)
+        self.rejected: Dict[str, int] = {}
+        self.shared_errors = 0
+
+    @property
+    def db(self):
+        return self.shared.db if self.shared is not None else None
+
+    @db.setter
+    def db(self, db):
+        if self.shared is not None:
+            self.shared.db = db
+
+    async def check(self, route: str, ip: Optional[str], session_id: Optional[str] = None) -> float:
+        """Take a token from every bucket that applies; returns 0 if allowed, else seconds to wait"""
+        if not self.enabled:
+            return 0.0
+        ip_limit, session_limit = self.limits.get(route, (None, None))
+        checks = []
+        if ip_limit is not None and ip:
+            checks.append((f"{route}:ip:{ip}", ip_limit.scaled(self.share)))
+        if session_limit is not None and session_id:
+            checks.append((f"{route}:session:{str(session_id)[:100]}", session_limit.scaled(self.share)))
+
+        for key, limit in checks:
+            wait = self.local.take(key, limit)
+            if wait == 0 and self.shared is not None and self.shared.db is not None:
+                try:
+                    wait = await self.shared.take(key, limit)
+                except Exception as e:
+                    self.shared_errors += 1
+                    logger.warning(f"Shared rate limit check failed, allowing request: {str(e)}")
+            if wait > 0:
+                self.rejected[route] = self.rejected.get(route, 0) + 1
+                return wait
+        return 0.0
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend,
+            "worker_share": self.share,
+            "local_buckets": len(self.local),
+            "shared_errors": self.shared_errors,
+            "rejected": dict(self.rejected),
+            "limits": {
+                route: {
+                    "per_ip": {"burst": ip.burst, "per_second": ip.rate} if ip else None,
+                    "per_session": {"burst": session.burst, "per_second": session.rate} if session else None,
+                }
+                for route, (ip, session) in self.limits.items()
+            },
+        }
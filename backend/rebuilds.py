@@ -0,0 +1,84 @@
+"""
+Rebuilds of derived collections that readers never see half-done.
+
+Rollups and sketches are maintained incrementally, but can be recomputed from
+the raw collections to bootstrap or repair them. A rebuild writes the fresh
+documents to ``<collection>_rebuild`` and renames that over the live
+collection once complete, so readers see the old documents until then. A lease
+per collection (in ``rebuild_state``) keeps workers and scripts from
+rebuilding the same collection at once.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from indexes import INDEXES
+from leases import acquire_lease, new_owner, release_lease
+
+logger = logging.getLogger(__name__)
+
+STATE_COLLECTION = "rebuild_state"
+LEASE_SECONDS = 600
+COPY_BATCH_SIZE = 1000
+
+# Called with the staging collection name and a coroutine that renews the lease
+Build = Callable[[str, Callable[[], Awaitable[None]]], Awaitable[Any]]
+
+
+def staging_name(collection_name: str) -> str:
+    return f"{collection_name}_rebuild"
+
+
+def first_complete_day(since: Optional[datetime]) -> Optional[datetime]:
+    """Start of the first day whose raw documents are all retained after ``since``"""
+    if since is None:
+        return None
+    day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day if day == since else day + timedelta(days=1)
+
+
+async def _copy(source, target, query: dict, renew):
+    batch = []
+    async for document in source.find(query):
+        batch.append(document)
+        if len(batch) >= COPY_BATCH_SIZE:
+            await target.insert_many(batch, ordered=False)
+            batch = []
+            await renew()
+    if batch:
+        await target.insert_many(batch, ordered=False)
+
+
+async def rebuild_collection(db, collection_name: str, build: Build, keep: Optional[dict] = None) -> Optional[Any]:
+    """Fill a staging copy of ``collection_name`` with ``build`` and swap it in.
+
+    Live documents matching ``keep`` are copied over first, for derived data
+    whose raw documents are gone. Returns what ``build`` returned, or None when
+    another process is already rebuilding the collection.
+    """
+    state = db[STATE_COLLECTION]
+    owner = new_owner()
+    if not await acquire_lease(state, collection_name, owner, LEASE_SECONDS):
+        logger.info(f"Rebuild of {collection_name} skipped: another process is rebuilding it")
+        return None
+
+    async def renew():
+        await acquire_lease(state, collection_name, owner, LEASE_SECONDS)
+
+    staging = staging_name(collection_name)
+    try:
+        # Leftovers of an interrupted rebuild
+        await db[staging].drop()
+        # Creating the collection up front lets the rename below work when nothing was built
+        if INDEXES.get(collection_name):
+            await db[staging].create_indexes(INDEXES[collection_name])
+        else:
+            await db.create_collection(staging)
+        if keep is not None:
+            await _copy(db[collection_name], db[staging], keep, renew)
+        result = await build(staging, renew)
+        await db[staging].rename(collection_name, dropTarget=True)
+        return result
+    finally:
+        await release_lease(state, collection_name, owner)
@@ -0,0 +1,289 @@
+"""
+Retention and cold-storage archival for the raw event collections.
+
+Each collection with a retention period gets a TTL index on ``timestamp`` so
+MongoDB expires old events by itself. Before that happens, ``RetentionArchiver``
+exports events that are about to expire to gzipped NDJSON files (one per
+collection and archived time range) under the archive directory, which must be
+on persistent storage: a Render service's own disk is wiped on every deploy.
+Aggregate counts are already kept in the analytics rollups, which are updated
+as events are written and are not subject to expiry.
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pymongo.errors import OperationFailure
+
+from leases import acquire_lease, new_owner, release_lease
+from pagination import encode_ndjson_line
+
+logger = logging.getLogger(__name__)
+
+RETENTION_FIELD = "timestamp"
+ARCHIVE_STATE_COLLECTION = "archive_state"
+ARCHIVE_BATCH_SIZE = 1000
+# Start of the first range archived for a collection
+ARCHIVE_EPOCH = datetime(1970, 1, 1)
+
+# Collections that may be expired, with the env var holding their retention in days
+RETENTION_SETTINGS = {
+    "analytics_events": "ANALYTICS_EVENTS_RETENTION_DAYS",
+    "link_interactions": "LINK_INTERACTIONS_RETENTION_DAYS",
+    "resource_downloads": "RESOURCE_DOWNLOADS_RETENTION_DAYS",
+    "client_errors": "CLIENT_ERRORS_RETENTION_DAYS",
+    "performance_metrics": "PERFORMANCE_METRICS_RETENTION_DAYS",
+}
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    collection: str
+    retention_days: int
+
+    @property
+    def expire_after_seconds(self) -> int:
+        return self.retention_days * 86400
+
+
+def load_policies(environ) -> List[RetentionPolicy]:
+    """Retention policies from the environment; 0 or unset keeps a collection forever"""
+    policies = []
+    for collection_name, variable in RETENTION_SETTINGS.items():
+        days = int(environ.get(variable, "0") or 0)
+        if days > 0:
+            policies.append(RetentionPolicy(collection_name, days))
+    return policies
+
+
+def retained_since(policies: List[RetentionPolicy], collections, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Time from which every one of ``collections`` still holds all its documents; None if none expire"""
+    now = now or datetime.utcnow()
+    cutoffs = [now - timedelta(days=policy.retention_days) for policy in policies if policy.collection in collections]
+    return max(cutoffs) if cutoffs else None
+
+
+def _is_retention_index(index: dict) -> bool:
+    return list(index["key"].keys()) == [RETENTION_FIELD]
+
+
+async def apply_ttl_indexes(db, policies: List[RetentionPolicy]) -> Dict[str, str]:
+    """Create or adjust the TTL index of every policy; returns what was done per collection"""
+    results = {}
+    for policy in policies:
+        collection = db[policy.collection]
+        existing = [index async for index in collection.list_indexes() if _is_retention_index(index)]
+        try:
+            if not existing:
+                await collection.create_index(RETENTION_FIELD, expireAfterSeconds=policy.expire_after_seconds)
+                results[policy.collection] = "created"
+                continue
+            index = existing[0]
+            if index.get("expireAfterSeconds") == policy.expire_after_seconds:
+                results[policy.collection] = "unchanged"
+                continue
+            # collMod turns an existing timestamp index into a TTL index (or changes its
+            # period) without rebuilding it
+            await db.command({
+                "collMod": policy.collection,
+                "index": {"name": index["name"], "expireAfterSeconds": policy.expire_after_seconds},
+            })
+            results[policy.collection] = "updated"
+        except OperationFailure as e:
+            results[policy.collection] = f"error: {str(e)}"
+            logger.error(f"Could not apply TTL index to {policy.collection}: {str(e)}")
+    return results
+
+
+def archive_path(archive_dir: Path, collection_name: str, start: datetime, end: datetime) -> Path:
+    return archive_dir / collection_name / f"{start:%Y%m%dT%H%M%S}-{end:%Y%m%dT%H%M%S}.ndjson.gz"
+
+
+def append_archive_batch(path: Path, documents: List[dict]):
+    """Append documents to a gzipped NDJSON file; gzip members concatenate cleanly"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "ab") as file:
+        file.writelines(encode_ndjson_line(document) for document in documents)
+
+
+class RetentionArchiver:
+    """Periodically exports events approaching expiry to the archive directory.
+
+    A watermark per collection (in ``archive_state``) records how far the
+    export has got, so each run only reads events it has not archived yet.
+    Events are exported ``lead_days`` before their TTL removes them; the job
+    must run at least that often for nothing to expire unarchived.
+
+    Every worker runs an archiver, so a collection is only archived under a
+    lease on its state document. The range is recorded as pending before its
+    file is written (to a temporary name, then renamed), and the watermark
+    only moves past it with a compare-and-set. A run interrupted at any point
+    is finished by the next one rewriting the same file, never appending twice.
+    """
+
+    def __init__(
+        self,
+        db,
+        policies: List[RetentionPolicy],
+        archive_dir: Path,
+        lead_days: int = 1,
+        interval: float = 3600.0,
+        lease_duration: float = 600.0,
+    ):
+        self.db = db
+        self.policies = policies
+        self.archive_dir = Path(archive_dir)
+        self.lead_days = lead_days
+        self.interval = interval
+        # Renewed after every batch, so it only needs to outlast one batch
+        self.lease_duration = lease_duration
+        self.owner = new_owner()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.last_run: Optional[dict] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def cutoff(self, policy: RetentionPolicy, now: Optional[datetime] = None) -> datetime:
+        """Events older than this are archived on the next run"""
+        now = (now or datetime.utcnow()).replace(microsecond=0)
+        return now - timedelta(days=max(policy.retention_days - self.lead_days, 0))
+
+    async def start(self):
+        if self.policies and self.interval > 0 and not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        """Archive every collection up to its cutoff; returns documents archived per collection"""
+        async with self._lock:
+            archived = {}
+            skipped = []
+            for policy in self.policies:
+                state = self.db[ARCHIVE_STATE_COLLECTION]
+                if not await acquire_lease(state, policy.collection, self.owner, self.lease_duration):
+                    # Another worker is archiving this collection
+                    archived[policy.collection] = 0
+                    skipped.append(policy.collection)
+                    continue
+                try:
+                    archived[policy.collection] = await self._archive_collection(policy, self.cutoff(policy, now))
+                except Exception as e:
+                    archived[policy.collection] = 0
+                    logger.error(f"Archiving {policy.collection} failed: {str(e)}")
+                finally:
+                    await release_lease(state, policy.collection, self.owner)
+            self.last_run = {"at": datetime.utcnow(), "archived": archived, "skipped": skipped}
+            return archived
+
+    async def _archive_collection(self, policy: RetentionPolicy, cutoff: datetime) -> int:
+        state = self.db[ARCHIVE_STATE_COLLECTION]
+        state_doc = await state.find_one({"_id": policy.collection}) or {}
+        watermark = state_doc.get("archived_until")
+        # A range left pending by an interrupted run is finished as it was, so its file is replaced
+        until = state_doc.get("pending_until")
+        if until is None:
+            if watermark is not None and watermark >= cutoff:
+                return 0
+            until = cutoff
+            claimed = await state.update_one(
+                {"_id": policy.collection, "archived_until": watermark, "pending_until": None},
+                {"$set": {"pending_until": until}},
+            )
+            if not claimed.matched_count:
+                return 0
+
+        count = await self._export_range(policy.collection, watermark, until)
+
+        # Only advance once the file is in place, so a failed run is retried from the same point
+        advanced = await state.update_one(
+            {"_id": policy.collection, "archived_until": watermark, "pending_until": until},
+            {
+                "$set": {"archived_until": until, "updated_at": datetime.utcnow()},
+                "$unset": {"pending_until": ""},
+                "$inc": {"documents": count},
+            },
+        )
+        if not advanced.matched_count:
+            logger.warning(f"Archive watermark of {policy.collection} moved during the run; not advancing it")
+            return 0
+        if count:
+            logger.info(f"Archived {count} {policy.collection} documents older than {until.isoformat()}")
+        return count
+
+    async def _export_range(self, collection_name: str, start: Optional[datetime], end: datetime) -> int:
+        """Write the events in [start, end) to the range's archive file; returns how many"""
+        query = {RETENTION_FIELD: {"$lt": end}}
+        if start is not None:
+            query[RETENTION_FIELD]["$gte"] = start
+        cursor = self.db[collection_name].find(query, {"_id": 0}).sort(RETENTION_FIELD, 1).batch_size(ARCHIVE_BATCH_SIZE)
+
+        path = archive_path(self.archive_dir, collection_name, start or ARCHIVE_EPOCH, end)
+        temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        count = 0
+        batch = []
+        try:
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= ARCHIVE_BATCH_SIZE:
+                    await asyncio.to_thread(append_archive_batch, temporary, batch)
+                    count += len(batch)
+                    batch = []
+                    if not await acquire_lease(
+                        self.db[ARCHIVE_STATE_COLLECTION], collection_name, self.owner, self.lease_duration
+                    ):
+                        raise RuntimeError("lost the archive lease")
+            if batch:
+                await asyncio.to_thread(append_archive_batch, temporary, batch)
+                count += len(batch)
+            if count:
+                await asyncio.to_thread(os.replace, temporary, path)
+        finally:
+            if temporary.exists():
+                temporary.unlink()
+        return count
+
+    async def status(self) -> dict:
+        state = {doc["_id"]: doc async for doc in self.db[ARCHIVE_STATE_COLLECTION].find({})}
+        return {
+            "running": self.running,
+            "archive_dir": str(self.archive_dir),
+            "lead_days": self.lead_days,
+            "last_run": self.last_run,
+            "collections": [
+                {
+                    "collection": policy.collection,
+                    "retention_days": policy.retention_days,
+                    "archived_until": state.get(policy.collection, {}).get("archived_until"),
+                    "pending_until": state.get(policy.collection, {}).get("pending_until"),
+                    "archived_documents": state.get(policy.collection, {}).get("documents", 0),
+                }
+                for policy in self.policies
+            ],
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                # A transient MongoDB error must not stop archiving until the next restart
+                logger.exception("Retention archiving failed")
+            await asyncio.sleep(self.interval)
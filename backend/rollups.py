@@ -0,0 +1,341 @@
+"""
+Incrementally maintained analytics rollups.
+
+Raw tracking documents are folded into pre-aggregated counters in the
+``analytics_rollups`` collection as they are written, so dashboard and stats
+endpoints read a handful of small documents instead of scanning the raw event
+collections.
+
+Rollup documents, keyed by ``_id``:
+
+- ``total:all`` — overall ``downloads``, ``interactions`` and ``events`` counts
+- ``link_category:<category>`` — ``interactions`` per link category
+- ``resource:<resource_id>`` — ``downloads`` and ``last_download_at`` per resource
+- ``download_category:<category>`` — ``downloads`` per ``resource_category``
+  stored on the download records
+- ``hour:<YYYY-MM-DDTHH>`` — per-hour counts with ``downloads_by_resource``,
+  ``downloads_by_category``, ``interactions_by_category`` and
+  ``events_by_type`` breakdowns; trends grouped by category read
+  ``downloads_by_category``, so they too follow the stored category
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from rebuilds import rebuild_collection
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "analytics_rollups"
+TOTALS_ID = "total:all"
+
+# Raw collection -> counter name used in the totals and hourly documents
+COUNTERS = {
+    "resource_downloads": "downloads",
+    "link_interactions": "interactions",
+    "analytics_events": "events",
+}
+
+REBUILD_BATCH_SIZE = 1000
+# Every field build_rollup_operations reads from a raw document
+REBUILD_PROJECTION = {"_id": 0, "timestamp": 1, "resource_id": 1, "resource_category": 1, "link_category": 1, "event_type": 1}
+
+TREND_GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+MAX_TREND_BUCKETS = 1000
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    """Truncate a timestamp to the start of its hour"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def truncate_timestamp(timestamp: datetime, granularity: str) -> datetime:
+    """Truncate a timestamp to the start of its hour, day or (Monday-based) week"""
+    truncated = hour_bucket(timestamp)
+    if granularity in ("day", "week"):
+        truncated = truncated.replace(hour=0)
+    if granularity == "week":
+        truncated -= timedelta(days=truncated.weekday())
+    return truncated
+
+
+def hour_rollup_id(bucket: datetime) -> str:
+    return f"hour:{bucket.strftime('%Y-%m-%dT%H')}"
+
+
+def field_key(value) -> str:
+    """Make a user-supplied value safe to use as a document field name"""
+    key = str(value) if value not in (None, "") else "unknown"
+    return key.replace(".", "_").replace("$", "_")
+
+
+class _Increments:
+    """Collects $inc/$max updates per rollup document for one batch"""
+
+    def __init__(self):
+        self.inc: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.set_on_insert: Dict[str, dict] = {}
+        self.max: Dict[str, Dict[str, datetime]] = defaultdict(dict)
+
+    def add(self, rollup_id: str, field: str, amount: int = 1, **identity):
+        self.inc[rollup_id][field] += amount
+        if identity and rollup_id not in self.set_on_insert:
+            self.set_on_insert[rollup_id] = identity
+
+    def latest(self, rollup_id: str, field: str, value: Optional[datetime]):
+        if value is None:
+            return
+        current = self.max[rollup_id].get(field)
+        if current is None or value > current:
+            self.max[rollup_id][field] = value
+
+    def operations(self) -> List[UpdateOne]:
+        ops = []
+        for rollup_id, fields in self.inc.items():
+            update = {"$inc": dict(fields)}
+            if rollup_id in self.set_on_insert:
+                update["$setOnInsert"] = self.set_on_insert[rollup_id]
+            if self.max.get(rollup_id):
+                update["$max"] = self.max[rollup_id]
+            ops.append(UpdateOne({"_id": rollup_id}, update, upsert=True))
+        return ops
+
+
+def build_rollup_operations(collection_name: str, documents: List[dict]) -> List[UpdateOne]:
+    """Fold a batch of raw documents into one upsert per affected rollup document"""
+    counter = COUNTERS.get(collection_name)
+    if counter is None or not documents:
+        return []
+
+    increments = _Increments()
+    increments.add(TOTALS_ID, counter, len(documents), kind="total")
+
+    for doc in documents:
+        timestamp = doc.get("timestamp") or datetime.utcnow()
+        bucket = hour_bucket(timestamp)
+        hour_id = hour_rollup_id(bucket)
+        increments.add(hour_id, counter, kind="hour", bucket=bucket)
+
+        if collection_name == "resource_downloads":
+            resource_id = doc.get("resource_id")
+            increments.add(f"resource:{resource_id}", "downloads", kind="resource", key=resource_id)
+            increments.latest(f"resource:{resource_id}", "last_download_at", timestamp)
+            increments.add(hour_id, f"downloads_by_resource.{field_key(resource_id)}")
+            category = doc.get("resource_category")
+            # The category the resource had when it was downloaded, not its current one
+            increments.add(hour_id, f"downloads_by_category.{field_key(category or 'unknown')}")
+            if category:
+                increments.add(f"download_category:{category}", "downloads", kind="download_category", key=category)
+        elif collection_name == "link_interactions":
+            category = doc.get("link_category") or "unknown"
+            increments.add(f"link_category:{category}", "interactions", kind="link_category", key=category)
+            increments.add(hour_id, f"interactions_by_category.{field_key(category)}")
+        elif collection_name == "analytics_events":
+            increments.add(hour_id, f"events_by_type.{field_key(doc.get('event_type'))}")
+
+    return increments.operations()
+
+
+async def apply_rollups(db, collection_name: str, documents: List[dict], target: str = ROLLUP_COLLECTION):
+    """Update the rollup counters for documents that were just written"""
+    operations = build_rollup_operations(collection_name, documents)
+    if operations:
+        await db[target].bulk_write(operations, ordered=False)
+
+
+async def get_totals(db) -> dict:
+    """Overall download, interaction and event counts"""
+    totals = await db[ROLLUP_COLLECTION].find_one({"_id": TOTALS_ID}, {counter: 1 for counter in COUNTERS.values()}) or {}
+    return {counter: totals.get(counter, 0) for counter in COUNTERS.values()}
+
+
+async def get_interaction_categories(db, limit: int = 10) -> List[dict]:
+    """Interaction counts per link category, in the shape of a $group result"""
+    rollups = await db[ROLLUP_COLLECTION].find(
+        {"kind": "link_category"}, {"key": 1, "interactions": 1}
+    ).sort("interactions", -1).limit(limit).to_list(limit)
+    return [{"_id": rollup["key"], "count": rollup.get("interactions", 0)} for rollup in rollups]
+
+
+async def get_download_categories(db, limit: int = 10) -> List[dict]:
+    """Download counts per resource category, in the shape of a $group result"""
+    rollups = await db[ROLLUP_COLLECTION].find(
+        {"kind": "download_category"}, {"key": 1, "downloads": 1}
+    ).sort("downloads", -1).limit(limit).to_list(limit)
+    return [{"_id": rollup["key"], "count": rollup.get("downloads", 0)} for rollup in rollups]
+
+
+async def get_resource_download_total(db, resource_id: str) -> int:
+    """Total tracked downloads for a single resource"""
+    rollup = await db[ROLLUP_COLLECTION].find_one({"_id": f"resource:{resource_id}"}, {"downloads": 1})
+    return rollup.get("downloads", 0) if rollup else 0
+
+
+async def rebuild_rollups(db) -> Optional[dict]:
+    """Recompute every rollup document from the raw event collections.
+
+    The rollups are built in a staging collection and swapped in when complete
+    (see rebuilds.py), so readers see the old counts until then. Returns None
+    when another process is already rebuilding.
+
+    Meant for bootstrapping existing data or repairing drift; writes that land
+    while the rebuild runs may be counted twice or missed. Events already
+    removed by retention TTLs are no longer counted after a rebuild.
+    """
+    async def build(target: str, renew) -> dict:
+        processed = {}
+        for collection_name in COUNTERS:
+            count = 0
+            batch = []
+            async for doc in db[collection_name].find({}, REBUILD_PROJECTION):
+                batch.append(doc)
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    await apply_rollups(db, collection_name, batch, target=target)
+                    count += len(batch)
+                    batch = []
+                    await renew()
+            if batch:
+                await apply_rollups(db, collection_name, batch, target=target)
+                count += len(batch)
+            processed[collection_name] = count
+            logger.info(f"Rebuilt rollups from {count} {collection_name} documents")
+        return processed
+
+    return await rebuild_collection(db, ROLLUP_COLLECTION, build)
+
+
+async def bootstrap_rollups(db) -> Optional[dict]:
+    """Build the rollups from existing events when the rollup collection is empty.
+
+    Rollups are otherwise only maintained for documents written after the
+    feature was deployed; returns None when there was nothing to build.
+    """
+    if await db[ROLLUP_COLLECTION].find_one({}, {"_id": 1}) is not None:
+        return None
+    for collection_name in COUNTERS:
+        if await db[collection_name].find_one({}, {"_id": 1}) is not None:
+            break
+    else:
+        return None
+    logger.info("Analytics rollups are empty; building them from the raw event collections")
+    return await rebuild_rollups(db)
+
+
+class RollupBootstrap:
+    """Runs ``bootstrap_rollups`` once in the background, so startup does not wait for the scan.
+
+    Every worker starts one; the rebuild lease lets only the first build the
+    rollups, and the others find them being built or already there.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+        self.result: Optional[dict] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        try:
+            self.result = await bootstrap_rollups(self.db)
+            if self.result:
+                logger.info(f"Bootstrapped analytics rollups: {self.result}")
+        except Exception:
+            logger.exception("Error bootstrapping analytics rollups")
+
+
+def trend_buckets(start: datetime, end: datetime, granularity: str) -> List[datetime]:
+    """Bucket start times covering [start, end) at the given granularity"""
+    step = TREND_GRANULARITIES[granularity]
+    current = truncate_timestamp(start, granularity)
+    buckets = []
+    while current < end:
+        buckets.append(current)
+        if len(buckets) > MAX_TREND_BUCKETS:
+            raise ValueError(f"Requested range spans more than {MAX_TREND_BUCKETS} {granularity} buckets")
+        current += step
+    return buckets
+
+
+async def get_download_trend(
+    db,
+    start: datetime,
+    end: datetime,
+    granularity: str = "day",
+    group_by: Optional[str] = None,
+    resource_id: Optional[str] = None,
+) -> List[dict]:
+    """Download counts per time bucket, built from the hourly rollups.
+
+    ``group_by`` may be ``"resource"`` or ``"category"``; categories are the
+    ``resource_category`` stored on each download, so recategorizing a resource
+    does not move its past downloads. The hourly rollups keep no per-resource
+    category breakdown, so a category grouping cannot be filtered by resource.
+    The result has one entry per bucket in the range, including empty ones, so
+    its size depends only on the range and granularity.
+    """
+    if group_by == "category" and resource_id:
+        raise ValueError("group_by=category cannot be combined with resource_id")
+    buckets = trend_buckets(start, end, granularity)
+    counts = {bucket: 0 for bucket in buckets}
+    groups: Dict[datetime, Dict[str, int]] = {bucket: defaultdict(int) for bucket in buckets}
+
+    projection = {"_id": 0, "bucket": 1, "downloads": 1}
+    if group_by == "category":
+        projection["downloads_by_category"] = 1
+    if group_by == "resource" or resource_id:
+        projection["downloads_by_resource"] = 1
+
+    cursor = db[ROLLUP_COLLECTION].find(
+        {"kind": "hour", "bucket": {"$gte": buckets[0] if buckets else start, "$lt": end}},
+        projection,
+    )
+    async for hour in cursor:
+        bucket = truncate_timestamp(hour["bucket"], granularity)
+        if bucket not in counts:
+            continue
+        by_resource = hour.get("downloads_by_resource", {})
+        if resource_id:
+            counts[bucket] += by_resource.get(field_key(resource_id), 0)
+        else:
+            counts[bucket] += hour.get("downloads", 0)
+        if group_by == "category":
+            for category_key, count in hour.get("downloads_by_category", {}).items():
+                groups[bucket][category_key] += count
+        elif group_by:
+            for resource_key, count in by_resource.items():
+                if resource_id and resource_key != field_key(resource_id):
+                    continue
+                groups[bucket][resource_key] += count
+
+    trend = []
+    for bucket in buckets:
+        entry = {"bucket": bucket, "count": counts[bucket]}
+        if group_by:
+            entry["groups"] = dict(groups[bucket])
+        trend.append(entry)
+    return trend
@@ -0,0 +1,52 @@
+"""
+Fast JSON rendering for API responses.
+
+``ORJSONResponse`` renders with orjson, which serializes datetimes natively
+and is several times faster than the stdlib encoder. ``trusted_response``
+returns documents read from our own collections as they are, skipping the
+per-document model construction and FastAPI's second validation pass against
+``response_model`` (which still documents the schema). Callers strip ``_id``
+and internal fields with projections before the documents get here;
+``projection`` derives one from a response model so the two cannot drift.
+"""
+
+from typing import Any, Iterable, List, Optional, Type
+
+import orjson
+from bson import ObjectId
+from pydantic import BaseModel
+from starlette.responses import JSONResponse, Response
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def trusted_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> ORJSONResponse:
+    """Serialize database output directly, keeping headers already set on the endpoint's response"""
+    headers = dict(response.headers) if response is not None else None
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
+
+
+def projection(model: Type[BaseModel]) -> dict:
+    """MongoDB projection returning exactly the model's fields"""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+
+def project(documents: Iterable[dict], model: Type[BaseModel]) -> List[dict]:
+    """Trim already-loaded documents (e.g. from an in-process cache) to the model's fields"""
+    fields = list(model.model_fields)
+    return [{field: document[field] for field in fields if field in document} for document in documents]
@@ -1,36 +1,298 @@
-from fastapi import FastAPI, APIRouter
-from dotenv import load_dotenv
-from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+import time
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
-import uuid
-from datetime import datetime
-from fastapi import HTTPException, Response, Request
-from fastapi.responses import FileResponse
+import math
 import os
 from pathlib import Path
-import json
+from typing import Any, List, Literal, Optional
+import uuid
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import BaseModel, Field, ValidationError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from starlette.background import BackgroundTask
+from starlette.middleware.cors import CORSMiddleware
+
+from catalog_cache import ResourceCatalogCache
+import client_telemetry
+import download_counters
+import file_manifest
+import file_responses
+import http_cache
+import indexes
+import metrics
+import pagination
+import rate_limits
+import retention
+import serialization
+import sessionization
+import slow_queries
+import rollups
+import unique_visitors
+import web_vitals
+from write_buffer import WriteBehindBuffer
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-# Support either MONGO_URL or MONGODB_URI and provide a safe default for DB_NAME
-mongo_url = os.getenv('MONGO_URL') or os.getenv('MONGODB_URI')
-if not mongo_url:
-    raise RuntimeError("Missing MongoDB connection string. Set MONGO_URL or MONGODB_URI.")
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def load_mongo_client_options(environ) -> dict:
+    """Connection pool, timeout and read preference settings for the Motor client.
+
+    Unset variables leave the driver default (or the connection string's value)
+    in place. Each gunicorn worker has its own pool, so the deployment holds up
+    to workers x maxPoolSize connections. Server selection gives up after 5s
+    rather than the driver's 30s, so requests fail fast when the cluster is
+    unreachable instead of hanging.
+    """
+    options = {"serverSelectionTimeoutMS": int(environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))}
+    settings = {
+        "maxPoolSize": 'MONGO_MAX_POOL_SIZE',
+        "minPoolSize": 'MONGO_MIN_POOL_SIZE',
+        "maxIdleTimeMS": 'MONGO_MAX_IDLE_TIME_MS',
+        "waitQueueTimeoutMS": 'MONGO_WAIT_QUEUE_TIMEOUT_MS',
+        "connectTimeoutMS": 'MONGO_CONNECT_TIMEOUT_MS',
+        "socketTimeoutMS": 'MONGO_SOCKET_TIMEOUT_MS',
+    }
+    for option, variable in settings.items():
+        if environ.get(variable):
+            options[option] = int(environ[variable])
+    if environ.get('MONGO_READ_PREFERENCE'):
+        options["readPreference"] = environ['MONGO_READ_PREFERENCE']
+    return options
+
+# Prometheus metrics: request latency per route, Mongo command latency and pool usage
+metrics_enabled = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+# Per query-shape timings and a slow-query log
+query_profiler_enabled = os.getenv('QUERY_PROFILER_ENABLED', 'true').lower() != 'false'
+query_profiler = slow_queries.QueryProfiler(slow_threshold_ms=float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100')))
+
+# MongoDB connection, created on startup by connect_database() so that importing
+# the app needs neither a connection string nor a client
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+# Write-behind buffer for tracking documents (analytics events, link interactions, downloads)
+write_buffer_enabled = os.getenv('ANALYTICS_BUFFER_ENABLED', 'true').lower() != 'false'
+# The background services below are bound to the database by connect_database()
+write_buffer = WriteBehindBuffer(
+    None,
+    max_batch_size=int(os.getenv('ANALYTICS_BUFFER_BATCH_SIZE', '500')),
+    flush_interval=float(os.getenv('ANALYTICS_BUFFER_FLUSH_INTERVAL', '1.0')),
+    max_queue_size=int(os.getenv('ANALYTICS_BUFFER_MAX_QUEUE', '10000')),
+)
+
+# In-process resource catalog cache, invalidated by writes, change streams or TTL
+resource_cache_enabled = os.getenv('RESOURCE_CACHE_ENABLED', 'true').lower() != 'false'
+resource_cache = ResourceCatalogCache(
+    None,
+    ttl=float(os.getenv('RESOURCE_CACHE_TTL', '300')),
+    use_change_stream=os.getenv('RESOURCE_CACHE_CHANGE_STREAM', 'true').lower() != 'false',
+)
+
+# Manifest of downloadable files (size, mtime, sha256, content type), built at startup
+file_manifest_enabled = os.getenv('FILE_MANIFEST_ENABLED', 'true').lower() != 'false'
+resource_files = file_manifest.FileManifest(
+    ROOT_DIR / "public" / "resources",
+    refresh_interval=float(os.getenv('FILE_MANIFEST_REFRESH_INTERVAL', '60')),
+)
+
+# Retention: TTL indexes on the raw event collections, with archival to gzipped NDJSON before expiry
+retention_policies = retention.load_policies(os.environ)
+retention_archiver = retention.RetentionArchiver(
+    None,
+    retention_policies,
+    Path(os.getenv('ARCHIVE_DIR', str(ROOT_DIR / 'archive'))),
+    lead_days=int(os.getenv('ARCHIVE_LEAD_DAYS', '1')),
+    interval=float(os.getenv('ARCHIVE_INTERVAL', '3600')),
+)
+
+# Rollups for events written before they existed, built in the background when the collection is empty
+rollup_bootstrap = rollups.RollupBootstrap(None)
+
+# Session summaries rebuilt incrementally from events and link interactions, for funnels
+sessionization_enabled = os.getenv('SESSIONIZATION_ENABLED', 'true').lower() != 'false'
+sessionizer = sessionization.Sessionizer(
+    None,
+    inactivity_timeout=float(os.getenv('SESSION_INACTIVITY_TIMEOUT', '1800')),
+    interval=float(os.getenv('SESSIONIZATION_INTERVAL', '300')),
+    settle_lag=float(os.getenv('SESSIONIZATION_SETTLE_LAG', '120')),
+)
+
+# Token-bucket rate limits per client IP and session on the anonymous write endpoints.
+# With the in-memory backend, set RATE_LIMIT_WORKERS to the worker count so each
+# enforces its share; the mongo backend shares the buckets between workers
+rate_limiter = rate_limits.RateLimiter(
+    rate_limits.load_limits(os.environ),
+    backend=os.getenv('RATE_LIMIT_BACKEND', 'memory'),
+    workers=int(os.getenv('RATE_LIMIT_WORKERS', '1')),
+    enabled=os.getenv('RATE_LIMIT_ENABLED', 'true').lower() != 'false',
+)
+# Proxies in front of the app that append to X-Forwarded-For (1 on Render)
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', '0'))
+
+# Browser error reports and performance beacons: session sampling, per-session
+# deduplication of error fingerprints and per-minute caps (0 disables a cap)
+client_error_gate = client_telemetry.TelemetryGate(
+    sample_rate=float(os.getenv('CLIENT_ERRORS_SAMPLE_RATE', '1.0')),
+    session_limit=int(os.getenv('CLIENT_ERRORS_PER_SESSION_PER_MINUTE', '30')),
+    global_limit=int(os.getenv('CLIENT_ERRORS_PER_MINUTE', '3000')),
+    dedup_window=float(os.getenv('CLIENT_ERRORS_DEDUP_WINDOW', '300')),
+)
+performance_gate = client_telemetry.TelemetryGate(
+    sample_rate=float(os.getenv('PERFORMANCE_SAMPLE_RATE', '0.25')),
+    session_limit=int(os.getenv('PERFORMANCE_PER_SESSION_PER_MINUTE', '60')),
+    global_limit=int(os.getenv('PERFORMANCE_PER_MINUTE', '6000')),
+)
+
+# Resources as returned by the API: no ObjectId, no counter bookkeeping
+RESOURCE_PROJECTION = {"_id": 0, download_counters.APPLIED_KEYS_FIELD: 0}
+
+# Cache-Control for catalog responses; clients revalidate with ETag / Last-Modified
+RESOURCE_CACHE_CONTROL = os.getenv('RESOURCE_CACHE_CONTROL', 'public, max-age=60, must-revalidate')
+
+# Downloads may be stored but must be revalidated, so every fetch is seen (and 304'd)
+DOWNLOAD_CACHE_CONTROL = os.getenv('DOWNLOAD_CACHE_CONTROL', 'no-cache')
+
+async def update_rollups(collection_name: str, documents: List[dict]):
+    """Fold freshly written tracking documents into the analytics rollups"""
+    try:
+        await rollups.apply_rollups(db, collection_name, documents)
+    except Exception as e:
+        logger.error(f"Error updating analytics rollups for {collection_name}: {str(e)}")
+
+async def update_download_counters(downloads: List[dict]):
+    """Apply idempotent download_count increments for freshly written download records"""
+    try:
+        applied = await download_counters.apply_download_counters(db, downloads)
+    except Exception as e:
+        logger.error(f"Error updating download counters: {str(e)}")
+        resource_cache.invalidate()
+        return
+    if applied == len(downloads):
+        for download in downloads:
+            resource_cache.record_download(download["resource_id"])
+    else:
+        # Some increments were retries or hit missing resources; reload the real counts
+        resource_cache.invalidate()
+
+async def update_web_vitals(documents: List[dict]):
+    """Fold freshly written performance beacons into the percentile sketches"""
+    try:
+        await web_vitals.apply_sketches(db, documents)
+    except Exception as e:
+        logger.error(f"Error updating web vitals sketches: {str(e)}")
+
+async def update_unique_counts(collection_name: str, documents: List[dict]):
+    """Merge the sessions and visitors of freshly written tracking documents into the daily HyperLogLogs"""
+    try:
+        await unique_visitors.apply_unique_counts(db, collection_name, documents)
+    except Exception as e:
+        logger.error(f"Error updating unique counts for {collection_name}: {str(e)}")
+
+async def after_tracking_write(collection_name: str, documents: List[dict]):
+    """Derived bookkeeping for tracking documents that were just written"""
+    await update_rollups(collection_name, documents)
+    if collection_name in unique_visitors.TRACKED_COLLECTIONS:
+        await update_unique_counts(collection_name, documents)
+    if collection_name == "resource_downloads":
+        await update_download_counters(documents)
+    elif collection_name == client_telemetry.PERFORMANCE_COLLECTION:
+        await update_web_vitals(documents)
+
+write_buffer.add_flush_hook(after_tracking_write)
+
+# Apply the index registry at startup (idempotent; only missing indexes are built)
+index_management_enabled = os.getenv('INDEX_MANAGEMENT_ENABLED', 'true').lower() != 'false'
+
+def connect_database():
+    """Create the Motor client and bind the background services to the database.
+
+    Idempotent, so scripts can connect before entering the lifespan.
+    """
+    global client, db
+    if client is not None:
+        return db
+    # Support either MONGO_URL or MONGODB_URI and provide a safe default for DB_NAME
+    mongo_url = os.getenv('MONGO_URL') or os.getenv('MONGODB_URI')
+    if not mongo_url:
+        raise RuntimeError("Missing MongoDB connection string. Set MONGO_URL or MONGODB_URI.")
+    event_listeners = metrics.event_listeners() if metrics_enabled else []
+    if query_profiler_enabled:
+        event_listeners.append(query_profiler)
+    client = AsyncIOMotorClient(mongo_url, event_listeners=event_listeners, **load_mongo_client_options(os.environ))
+    # The effective pool size may come from the connection string
+    metrics.set_max_pool_size(event_listeners, client.options.pool_options.max_pool_size)
+    db = client[os.getenv('DB_NAME', 'trustml_db')]
+    for service in (write_buffer, resource_cache, retention_archiver, sessionizer, rate_limiter, rollup_bootstrap):
+        service.db = db
+    return db
 
-client = AsyncIOMotorClient(mongo_url)
-db_name = os.getenv('DB_NAME', 'trustml_db')
-db = client[db_name]
+def close_database():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
 
-# Create the main app without a prefix
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    connect_database()
+    if index_management_enabled:
+        try:
+            report = await indexes.ensure_indexes(db)
+            if report["errors"]:
+                logger.error(f"Some indexes could not be created: {report['errors']}")
+        except Exception as e:
+            logger.error(f"Error applying index registry: {str(e)}")
+    await rollup_bootstrap.start()
+    if retention_policies:
+        try:
+            ttl_results = await retention.apply_ttl_indexes(db, retention_policies)
+            logger.info(f"Retention TTL indexes: {ttl_results}")
+        except Exception as e:
+            logger.error(f"Error applying retention TTL indexes: {str(e)}")
+        await retention_archiver.start()
+    if write_buffer_enabled:
+        await write_buffer.start()
+    if sessionization_enabled:
+        await sessionizer.start()
+    if file_manifest_enabled:
+        await resource_files.start()
+        try:
+            synced = await file_manifest.sync_resource_file_sizes(db, resource_files)
+            if synced:
+                logger.info(f"Corrected file_size for {synced} resources from the file manifest")
+        except Exception as e:
+            logger.error(f"Error syncing resource file sizes: {str(e)}")
+    if resource_cache_enabled:
+        await resource_cache.start()
+    startup_seconds = time.perf_counter() - started
+    metrics.app_startup.set("lifespan", value=startup_seconds)
+    logger.info(f"Startup completed in {startup_seconds * 1000:.0f} ms (module import took {import_seconds * 1000:.0f} ms)")
+    yield
+    await resource_cache.stop()
+    await resource_files.stop()
+    # Flush queued tracking documents before the client goes away
+    await write_buffer.stop()
+    await sessionizer.stop()
+    await retention_archiver.stop()
+    await rollup_bootstrap.stop()
+    close_database()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -68,6 +330,8 @@ class ContactFormCreate(BaseModel):
     service_type: str = ""
     urgency: str = "normal"
     message: str
+    # Analytics session of the submitter, so the submission shows up in funnels
+    session_id: Optional[str] = None
 
 # Resource Management Models
 class Resource(BaseModel):
@@ -82,6 +346,7 @@ class Resource(BaseModel):
     featured: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    last_downloaded_at: Optional[datetime] = None
     metadata: dict = Field(default_factory=dict)
 
 class ResourceCreate(BaseModel):
@@ -97,6 +362,9 @@ class ResourceCreate(BaseModel):
 class ResourceDownload(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     resource_id: str
+    # Denormalized from the resource at download time so analytics need no join
+    resource_category: Optional[str] = None
+    resource_title: Optional[str] = None
     session_id: Optional[str] = None
     ip_address: Optional[str] = None
     user_agent: Optional[str] = None
@@ -126,6 +394,153 @@ class AnalyticsEvent(BaseModel):
     metadata: dict = Field(default_factory=dict)
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+# Lean models for summary endpoints; their fields double as the query projections
+class ResourceSummary(BaseModel):
+    id: str
+    title: str
+    category: str
+    type: str
+    download_count: int = 0
+
+class RecentDownload(BaseModel):
+    id: str
+    resource_id: str
+    resource_title: Optional[str] = None
+    resource_category: Optional[str] = None
+    session_id: Optional[str] = None
+    timestamp: datetime
+
+class RecentInteraction(BaseModel):
+    id: str
+    link_id: str
+    link_category: str
+    action_type: str
+    session_id: Optional[str] = None
+    timestamp: datetime
+
+class ResourceStats(BaseModel):
+    resource_id: str
+    total_downloads: int
+    resource_download_count: int
+    recent_downloads: List[RecentDownload]
+
+class DashboardSummary(BaseModel):
+    total_downloads: int
+    total_interactions: int
+    # Approximate (HyperLogLog), over the last 30 days
+    unique_sessions: int
+    unique_visitors: int
+    popular_resources: List[ResourceSummary]
+
+class RecentActivity(BaseModel):
+    downloads: List[RecentDownload]
+    interactions: List[RecentInteraction]
+
+class AnalyticsDashboard(BaseModel):
+    summary: DashboardSummary
+    interaction_categories: List[dict]
+    recent_activity: RecentActivity
+
+RESOURCE_SUMMARY_PROJECTION = serialization.projection(ResourceSummary)
+RECENT_DOWNLOAD_PROJECTION = serialization.projection(RecentDownload)
+RECENT_INTERACTION_PROJECTION = serialization.projection(RecentInteraction)
+# Only what the download path reads
+DOWNLOAD_PROJECTION = {"_id": 0, "id": 1, "title": 1, "category": 1, "file_path": 1}
+
+async def enforce_rate_limit(route: str, request: Request, session_id: Optional[str] = None):
+    """Reject the request with 429 and Retry-After when the client is over the route's limit"""
+    wait = await rate_limiter.check(route, rate_limits.client_ip(request, RATE_LIMIT_PROXY_HOPS), session_id)
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please retry later",
+            headers={"Retry-After": str(max(math.ceil(wait), 1))},
+        )
+
+async def record_event(collection_name: str, document: dict):
+    """Queue a tracking document on the write-behind buffer, or insert it directly when the buffer is not running"""
+    if write_buffer.running:
+        await write_buffer.put(collection_name, document)
+    else:
+        try:
+            await db[collection_name].insert_one(document)
+        except DuplicateKeyError:
+            # Already recorded under this idempotency key
+            return
+        await after_tracking_write(collection_name, [document])
+
+async def record_events(collection_name: str, documents: List[dict]):
+    """Queue tracking documents on the write-behind buffer, or bulk insert them when the buffer is not running"""
+    if not documents:
+        return
+    if write_buffer.running:
+        await write_buffer.put_many(collection_name, documents)
+        return
+    try:
+        await db[collection_name].insert_many(documents, ordered=False)
+    except Exception as e:
+        logger.error(f"Error writing {len(documents)} documents to {collection_name}: {str(e)}")
+        return
+    await after_tracking_write(collection_name, documents)
+
+async def find_resource(resource_id: str, projection: dict = RESOURCE_PROJECTION) -> Optional[dict]:
+    """Look up a resource in the catalog cache, or in MongoDB (fetching only ``projection``) when the cache is off"""
+    if resource_cache.active:
+        return await resource_cache.get(resource_id)
+    return await db.resources.find_one({"id": resource_id}, projection)
+
+async def resolve_resource_file(relative_path: str) -> Optional[file_manifest.ManifestEntry]:
+    """Look up a resource file in the manifest, or stat it directly when the manifest is off"""
+    if resource_files.active:
+        return resource_files.get(relative_path) or await resource_files.load(relative_path)
+    return file_manifest.load_entry(Path(ROOT_DIR) / "public" / "resources", relative_path, hash_contents=False)
+
+async def find_most_downloaded(limit: int) -> List[dict]:
+    """Most downloaded resources as summaries, from the catalog cache when it is on"""
+    if resource_cache.active:
+        return serialization.project(await resource_cache.most_downloaded(limit), ResourceSummary)
+    return await db.resources.find({}, RESOURCE_SUMMARY_PROJECTION).sort("download_count", -1).limit(limit).to_list(limit)
+
+async def list_documents(
+    collection,
+    query: dict,
+    sort_field: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int],
+    after: Optional[str],
+    format: str,
+    projection: Optional[dict] = None
+):
+    """Fetch one keyset page of documents, or stream every match as NDJSON.
+
+    The cursor for the next page is returned in the X-Next-Cursor header and as
+    a rel="next" Link header; the body stays a plain JSON array.
+    """
+    try:
+        if format == "ndjson":
+            if after:
+                pagination.decode_cursor(after)
+            return StreamingResponse(
+                pagination.stream_ndjson(collection, query, sort_field, after=after, limit=limit, projection=projection),
+                media_type="application/x-ndjson"
+            )
+        documents, next_cursor = await pagination.fetch_page(
+            collection, query, sort_field, limit=limit or pagination.DEFAULT_PAGE_SIZE, after=after,
+            projection=projection
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    set_next_page_headers(request, response, next_cursor)
+    return documents
+
+def set_next_page_headers(request: Request, response: Response, next_cursor: Optional[str]):
+    """Advertise the next keyset page cursor"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(after=next_cursor)}>; rel="next"'
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
@@ -147,19 +562,29 @@ async def health_check():
         raise HTTPException(status_code=503, detail="Service unavailable")
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, request: Request):
+    await enforce_rate_limit("status", request)
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
+    status_checks = await list_documents(db.status_checks, {}, "timestamp", request, response, limit, after, format)
+    if format == "ndjson":
+        return status_checks
+    return serialization.trusted_response(status_checks, response)
 
 @api_router.post("/contact", response_model=ContactForm)
 async def submit_contact_form(form_data: ContactFormCreate, request: Request):
+    await enforce_rate_limit("contact", request, form_data.session_id)
     try:
         # Enhanced validation
         if not form_data.first_name.strip() or not form_data.last_name.strip():
@@ -189,6 +614,7 @@ async def submit_contact_form(form_data: ContactFormCreate, request: Request):
         analytics_event = AnalyticsEvent(
             event_type="contact_form_submission",
             element_id="contact-form",
+            session_id=form_data.session_id,
             ip_address=client_ip,
             user_agent=user_agent,
             metadata={
@@ -200,7 +626,7 @@ async def submit_contact_form(form_data: ContactFormCreate, request: Request):
                 "message_length": len(form_data.message.strip())
             }
         )
-        await db.analytics_events.insert_one(analytics_event.dict())
+        await record_event("analytics_events", analytics_event.dict())
         
         # TODO: Send email notification to admin
         # TODO: Send confirmation email to user
@@ -216,13 +642,29 @@ async def submit_contact_form(form_data: ContactFormCreate, request: Request):
         raise HTTPException(status_code=500, detail="Internal server error. Please try again later.")
 
 @api_router.get("/contact", response_model=List[ContactForm])
-async def get_contact_forms():
-    contact_forms = await db.contact_forms.find().to_list(1000)
-    return [ContactForm(**form) for form in contact_forms]
+async def get_contact_forms(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
+    contact_forms = await list_documents(db.contact_forms, {}, "timestamp", request, response, limit, after, format)
+    if format == "ndjson":
+        return contact_forms
+    return serialization.trusted_response(contact_forms, response)
 
 # Resource Management Endpoints
 @api_router.get("/resources", response_model=List[Resource])
-async def get_resources(category: Optional[str] = None, featured: Optional[bool] = None):
+async def get_resources(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    featured: Optional[bool] = None,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
     """Get all resources with optional filtering by category and featured status"""
     filter_query = {}
     if category:
@@ -230,16 +672,47 @@ async def get_resources(category: Optional[str] = None, featured: Optional[bool]
     if featured is not None:
         filter_query["featured"] = featured
     
-    resources = await db.resources.find(filter_query).to_list(1000)
-    return [Resource(**resource) for resource in resources]
+    if not resource_cache.active:
+        resources = await list_documents(
+            db.resources, filter_query, "created_at", request, response, limit, after, format,
+            projection=RESOURCE_PROJECTION
+        )
+        if format == "ndjson":
+            return resources
+        not_modified = http_cache.conditional_response(request, response, resources, RESOURCE_CACHE_CONTROL, variant=request.url.query)
+        if not_modified:
+            return not_modified
+        return serialization.trusted_response(resources, response)
+    
+    # Serve from the catalog cache without a database round-trip
+    if format == "json":
+        limit = limit or pagination.DEFAULT_PAGE_SIZE
+    try:
+        resources, next_cursor = await resource_cache.page(category, featured, limit=limit, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            (pagination.encode_ndjson_line(resource) for resource in resources),
+            media_type="application/x-ndjson"
+        )
+    set_next_page_headers(request, response, next_cursor)
+    not_modified = http_cache.conditional_response(request, response, resources, RESOURCE_CACHE_CONTROL, variant=request.url.query)
+    if not_modified:
+        return not_modified
+    return serialization.trusted_response(resources, response)
 
 @api_router.get("/resources/{resource_id}", response_model=Resource)
-async def get_resource(resource_id: str):
+async def get_resource(resource_id: str, request: Request, response: Response):
     """Get a specific resource by ID"""
-    resource = await db.resources.find_one({"id": resource_id})
+    resource = await find_resource(resource_id)
     if not resource:
         raise HTTPException(status_code=404, detail="Resource not found")
-    return Resource(**resource)
+    not_modified = http_cache.conditional_response(request, response, [resource], RESOURCE_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    return serialization.trusted_response(resource, response)
 
 @api_router.post("/resources", response_model=Resource)
 async def create_resource(resource_data: ResourceCreate):
@@ -247,22 +720,50 @@ async def create_resource(resource_data: ResourceCreate):
     resource_dict = resource_data.dict()
     resource_obj = Resource(**resource_dict)
     await db.resources.insert_one(resource_obj.dict())
+    resource_cache.invalidate()
     return resource_obj
 
 @api_router.get("/resources/{resource_id}/download")
 async def download_resource(resource_id: str, request: Request, session_id: Optional[str] = None):
     """Download a resource and track the download"""
     # Get resource from database
-    resource = await db.resources.find_one({"id": resource_id})
+    resource = await find_resource(resource_id, DOWNLOAD_PROJECTION)
     if not resource:
         raise HTTPException(status_code=404, detail="Resource not found")
     
-    # Construct file path
-    file_path = Path(ROOT_DIR) / "public" / "resources" / resource["file_path"]
-    
-    if not file_path.exists():
+    # Resolve the file from the manifest
+    file_entry = await resolve_resource_file(resource["file_path"])
+    if file_entry is None:
         raise HTTPException(status_code=404, detail="File not found")
     
+    # Conditional GET: the client's copy is current, nothing to send or count
+    etag = file_entry.etag
+    last_modified = file_entry.mtime
+    file_headers = {"Cache-Control": DOWNLOAD_CACHE_CONTROL}
+    if http_cache.is_not_modified(request, etag, last_modified):
+        return Response(
+            status_code=304,
+            headers={**http_cache.validator_headers(etag, last_modified, DOWNLOAD_CACHE_CONTROL), "Accept-Ranges": "bytes"}
+        )
+    
+    response = file_responses.RangedFileResponse(
+        path=file_entry.path,
+        stat_result=file_entry.stat_result,
+        etag=etag,
+        headers=file_headers,
+        filename=file_entry.path.name,
+        media_type=file_entry.content_type
+    )
+    
+    # Resuming an interrupted transfer is not a new download
+    if file_responses.is_resumed_download(request.headers.get("range")):
+        return response
+    
+    # The download id doubles as the idempotency key for all bookkeeping writes
+    download_id = request.headers.get("idempotency-key") or str(uuid.uuid4())
+    if len(download_id) > 128:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 128 characters")
+    
     # Extract request information for tracking
     client_ip = request.client.host if request.client else None
     user_agent = request.headers.get("user-agent")
@@ -270,16 +771,19 @@ async def download_resource(resource_id: str, request: Request, session_id: Opti
     
     # Track download
     download_record = ResourceDownload(
+        id=download_id,
         resource_id=resource_id,
+        resource_category=resource.get("category"),
+        resource_title=resource.get("title"),
         session_id=session_id,
         ip_address=client_ip,
         user_agent=user_agent,
         referrer=referrer
     )
-    await db.resource_downloads.insert_one(download_record.dict())
     
     # Track as link interaction
     interaction_record = LinkInteraction(
+        id=download_id,
         session_id=session_id,
         link_id=f"download-{resource_id}",
         link_category="download",
@@ -290,52 +794,55 @@ async def download_resource(resource_id: str, request: Request, session_id: Opti
         metadata={
             "resource_title": resource["title"],
             "resource_category": resource["category"],
-            "file_size": resource.get("file_size", 0)
+            "file_size": file_entry.size
         }
     )
-    await db.link_interactions.insert_one(interaction_record.dict())
     
-    # Increment download counter
-    await db.resources.update_one(
-        {"id": resource_id},
-        {"$inc": {"download_count": 1}, "$set": {"updated_at": datetime.utcnow()}}
-    )
+    # Bookkeeping stays off the critical path: queued on the write-behind buffer
+    # (download_count is incremented when the record is flushed), or run after the
+    # response when the buffer is off
+    if write_buffer.running:
+        await record_download(download_record, interaction_record)
+    else:
+        response.background = BackgroundTask(record_download, download_record, interaction_record)
     
     # Return file
-    return FileResponse(
-        path=file_path,
-        filename=file_path.name,
-        media_type='application/octet-stream'
-    )
+    return response
+
+async def record_download(download_record: ResourceDownload, interaction_record: LinkInteraction):
+    """Record a download, its link interaction and (via after_tracking_write) its counter increment"""
+    try:
+        await record_event("resource_downloads", download_record.dict())
+        await record_event("link_interactions", interaction_record.dict())
+    except Exception as e:
+        logger.error(f"Error tracking download {download_record.id}: {str(e)}")
 
-@api_router.get("/resources/{resource_id}/stats")
+@api_router.get("/resources/{resource_id}/stats", response_model=ResourceStats)
 async def get_resource_stats(resource_id: str):
     """Get download statistics for a resource"""
-    resource = await db.resources.find_one({"id": resource_id})
+    resource = await find_resource(resource_id, {"_id": 0, "download_count": 1})
     if not resource:
         raise HTTPException(status_code=404, detail="Resource not found")
     
-    # Get download count and recent downloads
-    total_downloads = await db.resource_downloads.count_documents({"resource_id": resource_id})
+    # Get download count from the rollups and recent downloads
+    total_downloads = await rollups.get_resource_download_total(db, resource_id)
     recent_downloads = await db.resource_downloads.find(
-        {"resource_id": resource_id}
+        {"resource_id": resource_id}, RECENT_DOWNLOAD_PROJECTION
     ).sort("timestamp", -1).limit(10).to_list(10)
     
-    return {
+    return serialization.trusted_response({
         "resource_id": resource_id,
         "total_downloads": total_downloads,
         "resource_download_count": resource.get("download_count", 0),
         "recent_downloads": recent_downloads
-    }
+    })
 
 # Analytics and Tracking Endpoints
-@api_router.post("/analytics/track")
-async def track_event(request: Request, event_data: dict):
-    """Track a general analytics event"""
-    client_ip = request.client.host if request.client else None
-    user_agent = request.headers.get("user-agent")
-    
-    event = AnalyticsEvent(
+MAX_TRACK_BATCH_SIZE = 500
+
+def build_analytics_event(event_data: dict, client_ip: Optional[str], user_agent: Optional[str]) -> AnalyticsEvent:
+    """Build an AnalyticsEvent from a tracking payload"""
+    return AnalyticsEvent(
         event_type=event_data.get("event_type", "unknown"),
         element_id=event_data.get("element_id", ""),
         session_id=event_data.get("session_id"),
@@ -344,58 +851,320 @@ async def track_event(request: Request, event_data: dict):
         user_agent=user_agent,
         metadata=event_data.get("metadata", {})
     )
-    
-    await db.analytics_events.insert_one(event.dict())
-    
-    # Log scheduling events for monitoring
+
+def build_link_interaction(link_data: dict, client_ip: Optional[str], user_agent: Optional[str], referrer: Optional[str]) -> LinkInteraction:
+    """Build a LinkInteraction from a link-click payload"""
+    return LinkInteraction(
+        session_id=link_data.get("session_id"),
+        link_id=link_data.get("link_id", ""),
+        link_category=link_data.get("link_category", "unknown"),
+        action_type="click",
+        ip_address=client_ip,
+        user_agent=user_agent,
+        referrer=referrer,
+        metadata=link_data.get("metadata", {})
+    )
+
+def log_scheduling_click(event_data: dict, client_ip: Optional[str]):
+    """Log scheduling events for monitoring"""
     if event_data.get("event_type") == "scheduling_click":
         logger.info(f"Scheduling click tracked: {event_data.get('metadata', {}).get('service_type', 'unknown')} from {client_ip}")
+
+@api_router.post("/analytics/track")
+async def track_event(request: Request, event_data: dict):
+    """Track a general analytics event"""
+    await enforce_rate_limit("track", request, event_data.get("session_id"))
+    client_ip = request.client.host if request.client else None
+    user_agent = request.headers.get("user-agent")
+    
+    event = build_analytics_event(event_data, client_ip, user_agent)
+    
+    await record_event("analytics_events", event.dict())
+    
+    log_scheduling_click(event_data, client_ip)
     
     return {"status": "tracked", "event_id": event.id}
 
+@api_router.post("/analytics/track/batch")
+async def track_event_batch(request: Request, items: List[Any]):
+    """Track a batch of analytics events and link clicks with unordered bulk inserts.
+
+    Each item is an event payload as accepted by /analytics/track, or a link-click
+    payload as accepted by /analytics/link-click when it carries "kind": "link_click".
+    """
+    if len(items) > MAX_TRACK_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch size exceeds maximum of {MAX_TRACK_BATCH_SIZE} items")
+    first_session = next((item.get("session_id") for item in items if isinstance(item, dict) and item.get("session_id")), None)
+    await enforce_rate_limit("track_batch", request, first_session)
+    
+    client_ip = request.client.host if request.client else None
+    user_agent = request.headers.get("user-agent")
+    referrer = request.headers.get("referer")
+    
+    results: List[dict] = []
+    # collection name -> list of (result index, document)
+    pending = {"analytics_events": [], "link_interactions": []}
+    
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"index": index, "status": "rejected", "detail": "Item must be a JSON object"})
+            continue
+        
+        kind = item.get("kind", "event")
+        try:
+            if kind == "event":
+                record = build_analytics_event(item, client_ip, user_agent)
+                results.append({"index": index, "status": "tracked", "kind": kind, "event_id": record.id})
+                pending["analytics_events"].append((index, record.dict()))
+                log_scheduling_click(item, client_ip)
+            elif kind == "link_click":
+                record = build_link_interaction(item, client_ip, user_agent, referrer)
+                results.append({"index": index, "status": "tracked", "kind": kind, "interaction_id": record.id})
+                pending["link_interactions"].append((index, record.dict()))
+            else:
+                results.append({"index": index, "status": "rejected", "detail": f"Unknown item kind: {kind}"})
+        except ValidationError as e:
+            # One malformed item must not cost the rest of the batch
+            detail = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+            results.append({"index": index, "status": "rejected", "kind": kind, "detail": detail})
+    
+    for collection_name, entries in pending.items():
+        if not entries:
+            continue
+        if write_buffer.running:
+            await write_buffer.put_many(collection_name, [doc for _, doc in entries])
+            continue
+        documents = [doc for _, doc in entries]
+        try:
+            await db[collection_name].insert_many(documents, ordered=False)
+            await after_tracking_write(collection_name, documents)
+        except BulkWriteError as e:
+            # Unordered inserts keep going past failures; mark only the documents that failed
+            failed_positions = set()
+            for write_error in e.details.get("writeErrors", []):
+                failed_positions.add(write_error["index"])
+                index = entries[write_error["index"]][0]
+                results[index] = {"index": index, "status": "failed", "detail": write_error.get("errmsg", "Write failed")}
+            await after_tracking_write(collection_name, [doc for position, doc in enumerate(documents) if position not in failed_positions])
+        except Exception as e:
+            logger.error(f"Error writing analytics batch to {collection_name}: {str(e)}")
+            for index, _ in entries:
+                results[index] = {"index": index, "status": "failed", "detail": "Write failed"}
+    
+    tracked = sum(1 for result in results if result["status"] == "tracked")
+    return {
+        "status": "processed",
+        "received": len(items),
+        "tracked": tracked,
+        "failed": len(items) - tracked,
+        "results": results
+    }
+
+MAX_ERROR_BATCH_SIZE = 100
+MAX_PERFORMANCE_BATCH_SIZE = 100
+
+async def read_beacon(request: Request) -> Any:
+    """JSON body of a fetch() or sendBeacon() request (the latter arrives as text/plain)"""
+    try:
+        return client_telemetry.parse_beacon(await client_telemetry.read_beacon_body(request))
+    except client_telemetry.BeaconError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@api_router.post("/errors/batch")
+async def ingest_client_errors(request: Request):
+    """Store a batch of browser error reports, sampled, deduplicated and rate-capped"""
+    payload = await read_beacon(request)
+    if isinstance(payload, list):
+        payload = {"errors": payload}
+    if not isinstance(payload, dict) or not isinstance(payload.get("errors"), list):
+        raise HTTPException(status_code=400, detail="Expected an object with an errors list")
+    errors = [error for error in payload["errors"] if isinstance(error, dict)]
+    if len(errors) > MAX_ERROR_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch size exceeds maximum of {MAX_ERROR_BATCH_SIZE} errors")
+    await enforce_rate_limit("errors", request, payload.get("session_id"))
+    
+    client_ip = request.client.host if request.client else None
+    user_agent = request.headers.get("user-agent")
+    documents = [client_telemetry.build_error_document(error, payload, client_ip, user_agent) for error in errors]
+    admitted, outcome = client_error_gate.admit(documents, dedupe=True)
+    await record_events(client_telemetry.ERRORS_COLLECTION, admitted)
+    
+    return {"status": "accepted", **outcome}
+
+@api_router.post("/analytics/performance")
+async def ingest_performance_metrics(request: Request):
+    """Store performance beacons (one object or a list), sampled per session and rate-capped"""
+    payload = await read_beacon(request)
+    beacons = payload if isinstance(payload, list) else [payload]
+    beacons = [beacon for beacon in beacons if isinstance(beacon, dict)]
+    if not beacons:
+        raise HTTPException(status_code=400, detail="Expected a performance beacon object")
+    if len(beacons) > MAX_PERFORMANCE_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch size exceeds maximum of {MAX_PERFORMANCE_BATCH_SIZE} beacons")
+    await enforce_rate_limit("performance", request, beacons[0].get("session_id"))
+    
+    client_ip = request.client.host if request.client else None
+    user_agent = request.headers.get("user-agent")
+    documents = [client_telemetry.build_performance_document(beacon, client_ip, user_agent) for beacon in beacons]
+    admitted, outcome = performance_gate.admit(documents)
+    await record_events(client_telemetry.PERFORMANCE_COLLECTION, admitted)
+    
+    return {"status": "accepted", **outcome}
+
 @api_router.post("/analytics/link-click")
 async def track_link_click(request: Request, link_data: dict):
     """Track a link click interaction"""
+    await enforce_rate_limit("link_click", request, link_data.get("session_id"))
     client_ip = request.client.host if request.client else None
     user_agent = request.headers.get("user-agent")
     referrer = request.headers.get("referer")
     
-    interaction = LinkInteraction(
-        session_id=link_data.get("session_id"),
-        link_id=link_data.get("link_id", ""),
-        link_category=link_data.get("link_category", "unknown"),
-        action_type="click",
-        ip_address=client_ip,
-        user_agent=user_agent,
-        referrer=referrer,
-        metadata=link_data.get("metadata", {})
-    )
+    interaction = build_link_interaction(link_data, client_ip, user_agent, referrer)
     
-    await db.link_interactions.insert_one(interaction.dict())
+    await record_event("link_interactions", interaction.dict())
     return {"status": "tracked", "interaction_id": interaction.id}
 
-@api_router.get("/analytics/dashboard")
+@api_router.get("/admin/write-buffer")
+async def get_write_buffer_metrics():
+    """Get write-behind buffer queue depth and flush latency"""
+    return write_buffer.metrics()
+
+@api_router.get("/admin/sessions")
+async def get_sessionization_status():
+    """Get the sessionization watermark and last run"""
+    return await sessionizer.status()
+
+@api_router.post("/admin/sessions/run")
+async def run_sessionization():
+    """Sessionize all settled events past the watermark now"""
+    return await sessionizer.run_once()
+
+@api_router.get("/admin/rate-limits")
+async def get_rate_limit_status():
+    """Get the configured rate limits and rejections per route"""
+    return rate_limiter.status()
+
+@api_router.get("/admin/client-telemetry")
+async def get_client_telemetry_status():
+    """Get sampling, deduplication and rate-cap counters for error and performance ingestion"""
+    return {
+        "errors": client_error_gate.status(),
+        "performance": performance_gate.status(),
+    }
+
+@api_router.get("/admin/resource-cache")
+async def get_resource_cache_metrics():
+    """Get resource catalog cache hit/miss metrics"""
+    return resource_cache.metrics()
+
+@api_router.get("/admin/files")
+async def get_file_manifest():
+    """Get the manifest of downloadable files"""
+    return {
+        "active": resource_files.active,
+        "built_at": resource_files.built_at,
+        "files": [entry.to_dict() for entry in resource_files.entries()]
+    }
+
+@api_router.get("/admin/indexes")
+async def get_index_report():
+    """Get current indexes and explain() results for every query shape the server issues"""
+    return await indexes.index_report(db)
+
+@api_router.get("/admin/retention")
+async def get_retention_status():
+    """Get retention policies and archival progress per collection"""
+    return await retention_archiver.status()
+
+@api_router.post("/admin/retention/archive")
+async def run_retention_archive():
+    """Archive events approaching expiry now instead of waiting for the next scheduled run"""
+    archived = await retention_archiver.run_once()
+    return {"status": "archived", "archived": archived}
+
+@api_router.get("/admin/mongo-pool")
+async def get_mongo_pool_stats():
+    """Get the connection pool settings and current usage of this worker"""
+    if client is None:
+        raise HTTPException(status_code=503, detail="Database client is not started")
+    return {
+        "options": {
+            "max_pool_size": client.options.pool_options.max_pool_size,
+            "min_pool_size": client.options.pool_options.min_pool_size,
+            "max_idle_time_seconds": client.options.pool_options.max_idle_time_seconds,
+            "wait_queue_timeout": client.options.pool_options.wait_queue_timeout,
+            "connect_timeout": client.options.pool_options.connect_timeout,
+            "socket_timeout": client.options.pool_options.socket_timeout,
+            "server_selection_timeout": client.options.server_selection_timeout,
+            "read_preference": client.read_preference.mongos_mode
+        },
+        "pools": metrics.pool_stats() if metrics_enabled else {}
+    }
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=slow_queries.MAX_SHAPES),
+    sort: Literal["total_ms", "max_ms", "avg_ms", "count", "documents_returned"] = "total_ms"
+):
+    """Get the top query shapes by time spent, plus the most recent slow queries"""
+    if not query_profiler_enabled:
+        raise HTTPException(status_code=404, detail="Query profiler is disabled")
+    return {
+        "slow_threshold_ms": query_profiler.slow_threshold_ms,
+        "dropped_shapes": query_profiler.dropped_shapes,
+        "top_shapes": query_profiler.top_shapes(limit, sort),
+        "recent_slow": query_profiler.recent_slow()
+    }
+
+@api_router.post("/admin/slow-queries/reset")
+async def reset_slow_queries():
+    """Clear the accumulated query-shape statistics"""
+    query_profiler.reset()
+    return {"status": "reset"}
+
+@api_router.post("/admin/rollups/rebuild")
+async def rebuild_analytics_rollups():
+    """Recompute the analytics rollups from the raw event collections"""
+    processed = await rollups.rebuild_rollups(db)
+    if processed is None:
+        raise HTTPException(status_code=409, detail="A rollup rebuild is already running")
+    # Sketches of days whose raw documents have started to expire are kept as they are
+    processed[web_vitals.SKETCH_COLLECTION] = await web_vitals.rebuild_sketches(
+        db, client_telemetry.PERFORMANCE_COLLECTION,
+        retained_since=retention.retained_since(retention_policies, [client_telemetry.PERFORMANCE_COLLECTION])
+    )
+    processed[unique_visitors.UNIQUE_COLLECTION] = await unique_visitors.rebuild_unique_counts(
+        db, retained_since=retention.retained_since(retention_policies, unique_visitors.TRACKED_COLLECTIONS)
+    )
+    skipped = [name for name, count in processed.items() if count is None]
+    return {"status": "partial" if skipped else "rebuilt", "processed": processed, "already_running": skipped}
+
+@api_router.get("/analytics/dashboard", response_model=AnalyticsDashboard)
 async def get_analytics_dashboard():
     """Get analytics dashboard data"""
-    # Resource download stats
-    total_downloads = await db.resource_downloads.count_documents({})
-    popular_resources = await db.resources.find().sort("download_count", -1).limit(5).to_list(5)
+    # Download and interaction totals from the rollups
+    totals = await rollups.get_totals(db)
+    total_downloads = totals["downloads"]
+    total_interactions = totals["interactions"]
+    popular_resources = await find_most_downloaded(5)
+    
+    # Unique sessions and visitors over the last 30 days, from the daily sketches
+    now = datetime.utcnow()
+    unique_counts = await unique_visitors.get_unique_counts(db, now - timedelta(days=30), now)
     
     # Link interaction stats
-    total_interactions = await db.link_interactions.count_documents({})
-    interaction_categories = await db.link_interactions.aggregate([
-        {"$group": {"_id": "$link_category", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]).to_list(10)
+    interaction_categories = await rollups.get_interaction_categories(db, limit=10)
     
     # Recent activity
-    recent_downloads = await db.resource_downloads.find().sort("timestamp", -1).limit(10).to_list(10)
-    recent_interactions = await db.link_interactions.find().sort("timestamp", -1).limit(10).to_list(10)
+    recent_downloads = await db.resource_downloads.find({}, RECENT_DOWNLOAD_PROJECTION).sort("timestamp", -1).limit(10).to_list(10)
+    recent_interactions = await db.link_interactions.find({}, RECENT_INTERACTION_PROJECTION).sort("timestamp", -1).limit(10).to_list(10)
     
-    return {
+    return serialization.trusted_response({
         "summary": {
             "total_downloads": total_downloads,
             "total_interactions": total_interactions,
+            "unique_sessions": unique_counts["sessions"],
+            "unique_visitors": unique_counts["visitors"],
             "popular_resources": popular_resources
         },
         "interaction_categories": interaction_categories,
@@ -403,66 +1172,193 @@ async def get_analytics_dashboard():
             "downloads": recent_downloads,
             "interactions": recent_interactions
         }
-    }
+    })
 
 @api_router.get("/analytics/resources")
 async def get_resource_analytics():
     """Get detailed resource analytics"""
-    # Downloads by category
-    downloads_by_category = await db.resource_downloads.aggregate([
-        {
-            "$lookup": {
-                "from": "resources",
-                "localField": "resource_id",
-                "foreignField": "id",
-                "as": "resource"
-            }
-        },
-        {"$unwind": "$resource"},
-        {"$group": {"_id": "$resource.category", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]).to_list(10)
+    # Downloads by category, from the rollups (downloads carry their resource's category)
+    downloads_by_category = await rollups.get_download_categories(db, limit=10)
     
     # Most downloaded resources
-    most_downloaded = await db.resources.find().sort("download_count", -1).limit(10).to_list(10)
+    most_downloaded = await find_most_downloaded(10)
     
-    # Download trends (last 30 days)
-    from datetime import timedelta
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_downloads = await db.resource_downloads.find(
-        {"timestamp": {"$gte": thirty_days_ago}}
-    ).sort("timestamp", 1).to_list(1000)
+    # Download trends (last 30 days), bucketed per day from the rollups
+    end = datetime.utcnow()
+    download_trend = await rollups.get_download_trend(db, end - timedelta(days=30), end, granularity="day")
     
     return {
         "downloads_by_category": downloads_by_category,
         "most_downloaded": most_downloaded,
-        "recent_downloads_count": len(recent_downloads),
-        "download_trend": recent_downloads
+        "recent_downloads_count": sum(bucket["count"] for bucket in download_trend),
+        "download_trend": download_trend
     }
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.get("/analytics/downloads/trend")
+async def get_download_trend(
+    granularity: Literal["hour", "day", "week"] = "day",
+    days: int = Query(30, ge=1, le=3660),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: Optional[Literal["category", "resource"]] = None,
+    resource_id: Optional[str] = None
+):
+    """Get download counts per hour, day or week, optionally grouped by category or resource"""
+    # Rollup buckets are stored as naive UTC datetimes
+    if end and end.tzinfo:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    if start and start.tzinfo:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=days)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    try:
+        trend = await rollups.get_download_trend(
+            db, start, end,
+            granularity=granularity,
+            group_by=group_by,
+            resource_id=resource_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "group_by": group_by,
+        "total": sum(bucket["count"] for bucket in trend),
+        "buckets": trend
+    }
 
-# Configure CORS for production
-cors_origins = os.environ.get('CORS_ORIGINS', '*')
-if cors_origins != '*':
-    cors_origins = [origin.strip() for origin in cors_origins.split(',')]
+@api_router.get("/analytics/unique-visitors")
+async def get_unique_visitors(
+    days: int = Query(30, ge=1, le=unique_visitors.MAX_RANGE_DAYS),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resource_id: Optional[str] = None,
+    link_category: Optional[str] = None
+):
+    """Get approximate unique sessions and visitors, overall or for one resource or link category"""
+    if resource_id and link_category:
+        raise HTTPException(status_code=400, detail="Filter by resource_id or link_category, not both")
+    # Sketch buckets are stored as naive UTC datetimes
+    if end and end.tzinfo:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    if start and start.tzinfo:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    end = end or datetime.utcnow()
+    if not start:
+        # The last ``days`` whole day sketches, the current day included
+        last_day = rollups.truncate_timestamp(end, "day")
+        start = (last_day if last_day == end else last_day + timedelta(days=1)) - timedelta(days=days)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    scope = "all"
+    if resource_id:
+        scope = f"resource:{rollups.field_key(resource_id)}"
+    elif link_category:
+        scope = f"link_category:{rollups.field_key(link_category)}"
+    try:
+        counts = await unique_visitors.get_unique_counts(db, start, end, scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "start": start,
+        "end": end,
+        "scope": scope,
+        "unique_sessions": counts["sessions"],
+        "unique_visitors": counts["visitors"],
+        "standard_error": round(unique_visitors.STANDARD_ERROR, 4)
+    }
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=cors_origins,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+MAX_FUNNEL_STEPS = 10
+# Event types the frontend's analyticsService sends, ending with the event POST /contact records
+DEFAULT_FUNNEL_STEPS = ["page_load", "scheduling_interaction", "contact_form_submission"]
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+@api_router.get("/analytics/funnel")
+async def get_funnel(
+    step: List[str] = Query(default=DEFAULT_FUNNEL_STEPS),
+    days: int = Query(30, ge=1, le=366),
+    within_minutes: Optional[int] = Query(None, ge=1)
+):
+    """Get per-step conversion through an ordered funnel, from the session summaries.
+
+    Steps are event types, or link_click:<link_id> for link interactions.
+    Sessions are counted when they started in the last days; with
+    within_minutes, later steps must follow the first one within that time.
+    """
+    if not 2 <= len(step) <= MAX_FUNNEL_STEPS:
+        raise HTTPException(status_code=400, detail=f"A funnel needs between 2 and {MAX_FUNNEL_STEPS} steps")
+    
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    within = timedelta(minutes=within_minutes) if within_minutes else None
+    result = await sessionization.funnel(db, step, start, end, within=within)
+    return {"start": start, "end": end, "within_minutes": within_minutes, **result}
+
+@api_router.get("/analytics/web-vitals")
+async def get_web_vitals(
+    metric: List[str] = Query(default=["lcp", "cls", "inp", "api"]),
+    page: Optional[str] = None,
+    days: int = Query(7, ge=1, le=366),
+    quantile: List[float] = Query(default=[0.75, 0.95]),
+    group_by: Optional[Literal["page", "day"]] = None
+):
+    """Get Core Web Vitals and API timing percentiles over the last days, from the merged daily sketches"""
+    unknown = [name for name in metric if name not in web_vitals.METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)} (choose from {', '.join(web_vitals.METRICS)})")
+    if any(not 0 <= q <= 1 for q in quantile):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+    
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    results = await web_vitals.query_percentiles(db, metric, start, end, quantile, page=page, group_by=group_by)
+    return {
+        "start": start,
+        "end": end,
+        "page": web_vitals.normalize_page(page) if page is not None else None,
+        "group_by": group_by,
+        "relative_accuracy": web_vitals.RELATIVE_ACCURACY,
+        "metrics": results
+    }
+
+async def get_metrics():
+    """Prometheus text exposition of the request, MongoDB and pool metrics"""
+    if not metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def create_app() -> FastAPI:
+    """Build the ASGI app; the database client, caches and workers are started by its lifespan"""
+    app = FastAPI(lifespan=lifespan, default_response_class=serialization.ORJSONResponse)
+    app.include_router(api_router)
+    app.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+    
+    if metrics_enabled:
+        app.add_middleware(metrics.MetricsMiddleware)
+    
+    # Configure CORS for production
+    cors_origins = os.environ.get('CORS_ORIGINS', '*')
+    if cors_origins != '*':
+        cors_origins = [origin.strip() for origin in cors_origins.split(',')]
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "Link", "ETag", "Last-Modified", "Content-Range", "Content-Disposition"],
+    )
+    return app
+
+app = create_app()
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+import_seconds = time.perf_counter() - _import_started
+metrics.app_startup.set("import", value=import_seconds)
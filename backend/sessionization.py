@@ -0,0 +1,300 @@
+"""
+Session reconstruction and funnel analysis.
+
+``Sessionizer`` periodically reads the analytics events and link interactions
+written since its watermark, groups them by ``session_id`` and splits a
+session id into separate sessions after ``inactivity_timeout`` without
+activity. Each session is stored in ``sessions`` as a compact summary: start
+and end time, event count, and the ordered steps it went through (event types,
+or ``link_click:<link_id>`` for link interactions, with consecutive repeats
+collapsed). New events extend the open session of their id or start a new one.
+
+Events are only read once they are ``settle_lag`` old, so documents still in
+the write-behind buffer are not skipped past. ``funnel`` computes per-step
+conversion from the summaries alone, never from the raw events.
+
+Every worker runs a sessionizer, so a run only proceeds under a lease on the
+state document and advances the watermark with a compare-and-set. Each
+summary also records the end of the last window folded into it, and events
+before that are skipped, so a window replayed after a crash (between writing
+the summaries and moving the watermark) changes nothing.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+
+from leases import acquire_lease, new_owner, release_lease
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_COLLECTION = "sessions"
+STATE_COLLECTION = "sessionization_state"
+STATE_ID = "sessionizer"
+# Steps kept per session summary; later steps still count towards event_count
+MAX_STEPS = 200
+SOURCE_PROJECTIONS = {
+    "analytics_events": {"_id": 0, "session_id": 1, "timestamp": 1, "event_type": 1},
+    "link_interactions": {"_id": 0, "session_id": 1, "timestamp": 1, "link_id": 1},
+}
+
+
+def step_name(collection_name: str, document: dict) -> str:
+    if collection_name == "link_interactions":
+        return f"link_click:{document.get('link_id') or 'unknown'}"
+    return document.get("event_type") or "unknown"
+
+
+def new_session(session_id: str, timestamp: datetime) -> dict:
+    return {
+        "_id": f"{session_id}|{timestamp.isoformat()}",
+        "session_id": session_id,
+        "started_at": timestamp,
+        "last_seen_at": timestamp,
+        "event_count": 0,
+        "steps": [],
+        "step_names": [],
+    }
+
+
+def extend_session(session: dict, step: str, timestamp: datetime):
+    session["event_count"] += 1
+    session["last_seen_at"] = max(session["last_seen_at"], timestamp)
+    steps = session["steps"]
+    if (not steps or steps[-1]["step"] != step) and len(steps) < MAX_STEPS:
+        steps.append({"step": step, "at": timestamp})
+        if step not in session["step_names"]:
+            session["step_names"].append(step)
+
+
+def sessionize(
+    events: List[dict],
+    open_sessions: Dict[str, dict],
+    inactivity_timeout: timedelta,
+    processed_until: Optional[datetime] = None,
+) -> List[dict]:
+    """Fold time-ordered ``{"session_id", "timestamp", "step"}`` events into session summaries.
+
+    ``open_sessions`` holds the latest stored summary per session id; it is
+    updated in place. Events before a summary's ``processed_until`` are
+    already part of it and are skipped; touched summaries get the new
+    ``processed_until``. Returns every summary created or changed.
+    """
+    touched: Dict[str, dict] = {}
+    for event in events:
+        session = open_sessions.get(event["session_id"])
+        if session is not None and session.get("processed_until") and event["timestamp"] < session["processed_until"]:
+            continue
+        if session is None or event["timestamp"] - session["last_seen_at"] > inactivity_timeout:
+            session = new_session(event["session_id"], event["timestamp"])
+            open_sessions[event["session_id"]] = session
+        extend_session(session, event["step"], event["timestamp"])
+        touched[session["_id"]] = session
+    for session in touched.values():
+        session["processed_until"] = processed_until
+    return list(touched.values())
+
+
+def reached_steps(steps: List[dict], funnel_steps: List[str], within: Optional[timedelta]) -> int:
+    """How many funnel steps a session completed, in order (within ``within`` of the first)"""
+    reached = 0
+    started_at = None
+    for entry in steps:
+        if reached == len(funnel_steps):
+            break
+        if entry["step"] != funnel_steps[reached]:
+            continue
+        if started_at is None:
+            started_at = entry["at"]
+        elif within is not None and entry["at"] - started_at > within:
+            break
+        reached += 1
+    return reached
+
+
+async def funnel(
+    db,
+    funnel_steps: List[str],
+    start: datetime,
+    end: datetime,
+    within: Optional[timedelta] = None,
+) -> dict:
+    """Sessions reaching each step in order, among sessions started in [start, end)"""
+    started = {"started_at": {"$gte": start, "$lt": end}}
+    total = await db[SESSIONS_COLLECTION].count_documents(started)
+    counts = [0] * len(funnel_steps)
+    # Only sessions that reached the first step can contribute
+    cursor = db[SESSIONS_COLLECTION].find({**started, "step_names": funnel_steps[0]}, {"_id": 0, "steps": 1})
+    async for session in cursor:
+        for index in range(reached_steps(session.get("steps", []), funnel_steps, within)):
+            counts[index] += 1
+
+    results = []
+    for index, step in enumerate(funnel_steps):
+        previous = counts[index - 1] if index else total
+        results.append({
+            "step": step,
+            "sessions": counts[index],
+            "conversion_from_previous": round(counts[index] / previous, 4) if previous else 0.0,
+            "conversion_from_start": round(counts[index] / counts[0], 4) if counts[0] else 0.0,
+        })
+    return {"sessions": total, "steps": results}
+
+
+class Sessionizer:
+    """Incrementally rebuilds session summaries from the raw tracking collections"""
+
+    def __init__(
+        self,
+        db,
+        inactivity_timeout: float = 1800.0,
+        interval: float = 300.0,
+        settle_lag: float = 120.0,
+        window: float = 3600.0,
+        lease_duration: float = 600.0,
+    ):
+        self.db = db
+        self.inactivity_timeout = timedelta(seconds=inactivity_timeout)
+        self.interval = interval
+        self.settle_lag = timedelta(seconds=settle_lag)
+        # Events are processed in time windows of this size, bounding memory per step
+        self.window = timedelta(seconds=window)
+        # Renewed every window, so it only needs to outlast one window
+        self.lease_duration = lease_duration
+        self.owner = new_owner()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.last_run: Optional[dict] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.interval > 0 and not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Sessionization failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def _earliest(self, since: Optional[datetime]) -> Optional[datetime]:
+        """Timestamp of the first event at or after ``since`` in any source collection"""
+        query = {"timestamp": {"$gte": since}} if since else {}
+        earliest = None
+        for collection_name in SOURCE_PROJECTIONS:
+            document = await self.db[collection_name].find_one(query, {"_id": 0, "timestamp": 1}, sort=[("timestamp", 1)])
+            if document and (earliest is None or document["timestamp"] < earliest):
+                earliest = document["timestamp"]
+        return earliest
+
+    async def _read_events(self, start: datetime, end: datetime) -> List[dict]:
+        events = []
+        for collection_name, projection in SOURCE_PROJECTIONS.items():
+            cursor = self.db[collection_name].find(
+                {"timestamp": {"$gte": start, "$lt": end}, "session_id": {"$nin": [None, ""]}}, projection
+            )
+            async for document in cursor:
+                events.append({
+                    "session_id": document["session_id"],
+                    "timestamp": document["timestamp"],
+                    "step": step_name(collection_name, document),
+                })
+        events.sort(key=lambda event: event["timestamp"])
+        return events
+
+    async def _open_sessions(self, session_ids: List[str], start: datetime) -> Dict[str, dict]:
+        """Latest stored summary per session id that events from ``start`` on could extend"""
+        open_sessions: Dict[str, dict] = {}
+        cursor = self.db[SESSIONS_COLLECTION].find({
+            "session_id": {"$in": session_ids},
+            "last_seen_at": {"$gte": start - self.inactivity_timeout},
+        })
+        async for session in cursor:
+            current = open_sessions.get(session["session_id"])
+            if current is None or session["started_at"] > current["started_at"]:
+                open_sessions[session["session_id"]] = session
+        return open_sessions
+
+    async def _process_window(self, start: datetime, end: datetime) -> int:
+        events = await self._read_events(start, end)
+        if not events:
+            return 0
+        by_session = defaultdict(list)
+        for event in events:
+            by_session[event["session_id"]].append(event)
+        open_sessions = await self._open_sessions(list(by_session), start)
+        summaries = sessionize(events, open_sessions, self.inactivity_timeout, processed_until=end)
+        await self.db[SESSIONS_COLLECTION].bulk_write(
+            [ReplaceOne({"_id": summary["_id"]}, summary, upsert=True) for summary in summaries], ordered=False
+        )
+        return len(events)
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        """Process every settled event past the watermark; returns events and windows processed"""
+        async with self._lock:
+            state = self.db[STATE_COLLECTION]
+            if not await acquire_lease(state, STATE_ID, self.owner, self.lease_duration):
+                # Another worker is sessionizing
+                self.last_run = {"at": datetime.utcnow(), "events": 0, "windows": 0, "skipped": True}
+                return self.last_run
+            try:
+                processed, windows = await self._advance((now or datetime.utcnow()) - self.settle_lag)
+            finally:
+                await release_lease(state, STATE_ID, self.owner)
+            self.last_run = {"at": datetime.utcnow(), "events": processed, "windows": windows}
+            if processed:
+                logger.info(f"Sessionized {processed} events in {windows} windows")
+            return self.last_run
+
+    async def _advance(self, until: datetime) -> Tuple[int, int]:
+        state = self.db[STATE_COLLECTION]
+        state_doc = await state.find_one({"_id": STATE_ID}) or {}
+        watermark = state_doc.get("processed_until")
+        processed = windows = 0
+        while True:
+            # Jump over stretches without events instead of walking them window by window
+            earliest = await self._earliest(watermark)
+            if earliest is None or earliest >= until:
+                break
+            start = max(watermark or earliest, earliest)
+            end = min(start + self.window, until)
+            processed += await self._process_window(start, end)
+            windows += 1
+            advanced = await state.update_one(
+                {"_id": STATE_ID, "processed_until": watermark, "lease_owner": self.owner},
+                {"$set": {"processed_until": end, "updated_at": datetime.utcnow()}},
+            )
+            if not advanced.matched_count:
+                logger.warning("Sessionization watermark moved during the run; stopping")
+                break
+            watermark = end
+            if not await acquire_lease(state, STATE_ID, self.owner, self.lease_duration):
+                break
+        return processed, windows
+
+    async def status(self) -> dict:
+        state_doc = await self.db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        return {
+            "running": self.running,
+            "inactivity_timeout_seconds": self.inactivity_timeout.total_seconds(),
+            "processed_until": state_doc["processed_until"] if state_doc else None,
+            "last_run": self.last_run,
+        }
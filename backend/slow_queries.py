@@ -0,0 +1,221 @@
+"""
+Query-shape profiling and slow-query log from driver command monitoring.
+
+``QueryProfiler`` is a PyMongo CommandListener that fingerprints each command
+by its redacted shape (field names, field paths and operators kept, values
+replaced), then accumulates count, total and max duration and documents
+returned per shape.
+Documents fetched by later ``getMore`` batches are credited to the command
+that opened the cursor. Commands slower than the threshold are logged and
+kept in a short recent-slow list.
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import command_collection
+
+logger = logging.getLogger(__name__)
+
+# Handshake, auth and session housekeeping, not application queries
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "saslStart", "saslContinue",
+    "authenticate", "endSessions", "killCursors",
+}
+# Parts of a command that describe the query; everything else (batch sizes, session ids,
+# documents being inserted) is left out of the fingerprint
+SHAPE_FIELDS = ("filter", "query", "pipeline", "sort", "projection", "updates", "deletes", "q", "u")
+MAX_SHAPES = 1000
+MAX_OPEN_CURSORS = 10000
+RECENT_SLOW_QUERIES = 100
+
+
+# Keys whose string values name collections or fields rather than carry data
+NAME_KEYS = {"from", "localField", "foreignField", "as", "path", "includeArrayIndex", "$count", "$out"}
+
+
+def _is_field_path(value) -> bool:
+    # "$field" and "$$variable" references in aggregation expressions
+    return isinstance(value, str) and value.startswith("$")
+
+
+def redact(value, key: Optional[str] = None, expressions: bool = False):
+    """Replace literal values with '?' while keeping field names and operators.
+
+    With ``expressions`` (aggregation stages), "$field" and "$$variable" paths
+    and the names of collections and output fields are kept too; in query
+    filters a string starting with "$" is just a value.
+    """
+    if isinstance(value, dict):
+        return {
+            item_key: redact(item, item_key, (expressions and item_key != "$match") or item_key == "$expr")
+            for item_key, item in value.items()
+        }
+    if isinstance(value, list):
+        # Pipelines, update lists and expression arguments keep their structure;
+        # $in-style lists of literals collapse
+        if any(isinstance(item, (dict, list)) or (expressions and _is_field_path(item)) for item in value):
+            return [redact(item, expressions=expressions) for item in value]
+        return ["?"] if value else []
+    if expressions and (_is_field_path(value) or (key in NAME_KEYS and isinstance(value, str))):
+        return value
+    return "?"
+
+
+def query_shape(command: dict) -> dict:
+    shape = {}
+    for field in SHAPE_FIELDS:
+        if field in command:
+            shape[field] = redact(command[field], expressions=field == "pipeline")
+    # Sort directions matter for index selection, so they are kept verbatim
+    if isinstance(command.get("sort"), dict):
+        shape["sort"] = dict(command["sort"])
+    return shape
+
+
+def fingerprint(command_name: str, collection: str, command: dict) -> str:
+    return f"{command_name} {collection} {json.dumps(query_shape(command), sort_keys=True, default=str)}"
+
+
+def documents_returned(command_name: str, reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if command_name in ("count", "insert", "update", "delete"):
+        return int(reply.get("n", 0))
+    return 0
+
+
+class _ShapeStats:
+    __slots__ = ("command", "collection", "shape", "count", "total_ms", "max_ms", "documents", "slow", "last_seen")
+
+    def __init__(self, command: str, collection: str, shape: str):
+        self.command = command
+        self.collection = collection
+        self.shape = shape
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.documents = 0
+        self.slow = 0
+        self.last_seen: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "command": self.command,
+            "collection": self.collection,
+            "shape": self.shape,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "documents_returned": self.documents,
+            "slow_count": self.slow,
+            "last_seen": self.last_seen,
+        }
+
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, slow_threshold_ms: float = 100.0, max_shapes: int = MAX_SHAPES):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple, Tuple[str, Optional[int]]] = {}
+        self._cursors: Dict[int, str] = {}
+        self._shapes: Dict[str, _ShapeStats] = {}
+        self._recent_slow = deque(maxlen=RECENT_SLOW_QUERIES)
+        self.dropped_shapes = 0
+
+    def _key(self, event) -> Tuple:
+        return (event.request_id, event.connection_id)
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        cursor_id = None
+        if event.command_name == "getMore":
+            cursor_id = event.command.get("getMore")
+            key = self._cursors.get(cursor_id)
+        else:
+            key = fingerprint(event.command_name, command_collection(event), event.command)
+            with self._lock:
+                if key not in self._shapes:
+                    if len(self._shapes) >= self.max_shapes:
+                        self.dropped_shapes += 1
+                        return
+                    self._shapes[key] = _ShapeStats(event.command_name, command_collection(event), key)
+        if key is not None:
+            self._pending[self._key(event)] = (key, cursor_id)
+
+    def succeeded(self, event):
+        pending = self._pending.pop(self._key(event), None)
+        if pending is None:
+            return
+        key, cursor_id = pending
+        reply = event.reply or {}
+        cursor = reply.get("cursor")
+        if isinstance(cursor, dict):
+            if cursor.get("id"):
+                self._remember_cursor(cursor["id"], key)
+            elif cursor_id is not None:
+                # Cursor exhausted
+                self._cursors.pop(cursor_id, None)
+        self._record(key, event, documents_returned(event.command_name, reply))
+
+    def failed(self, event):
+        pending = self._pending.pop(self._key(event), None)
+        if pending is not None:
+            self._record(pending[0], event, 0)
+
+    def _remember_cursor(self, cursor_id: int, key: str):
+        # Cursors closed early (killCursors) are never seen exhausted; forget the oldest
+        if len(self._cursors) >= MAX_OPEN_CURSORS:
+            self._cursors.pop(next(iter(self._cursors)), None)
+        self._cursors[cursor_id] = key
+
+    def _record(self, key: str, event, documents: int):
+        duration_ms = event.duration_micros / 1000
+        slow = duration_ms >= self.slow_threshold_ms
+        with self._lock:
+            stats = self._shapes.get(key)
+            if stats is None:
+                # Statistics were reset while the command was in flight
+                return
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.documents += documents
+            stats.last_seen = datetime.utcnow()
+            if slow:
+                stats.slow += 1
+                self._recent_slow.append({
+                    "at": stats.last_seen,
+                    "command": event.command_name,
+                    "collection": stats.collection,
+                    "shape": key,
+                    "duration_ms": round(duration_ms, 3),
+                    "documents_returned": documents,
+                })
+        if slow:
+            logger.warning(f"Slow query ({duration_ms:.1f} ms, {documents} docs): {key}")
+
+    def top_shapes(self, limit: int = 20, sort: str = "total_ms") -> List[dict]:
+        with self._lock:
+            shapes = [stats.to_dict() for stats in self._shapes.values()]
+        return sorted(shapes, key=lambda shape: shape[sort], reverse=True)[:limit]
+
+    def recent_slow(self) -> List[dict]:
+        with self._lock:
+            return list(reversed(self._recent_slow))
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._recent_slow.clear()
+            self.dropped_shapes = 0
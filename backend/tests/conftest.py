@@ -0,0 +1,16 @@
+"""
+Shared test fixtures
+"""
+
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import server
+
+
+@pytest.fixture(autouse=True)
+def rate_limits_off(monkeypatch):
+    """Every TestClient request comes from the same address, so limits are off unless a test installs its own limiter"""
+    monkeypatch.setattr(server.rate_limiter, "enabled", False)
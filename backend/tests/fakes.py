@@ -0,0 +1,322 @@
+"""
+In-memory stand-ins for the Motor collections used by the background jobs.
+
+They implement only the query and update operators this codebase sends, which
+is enough to run the jobs end to end without a MongoDB server.
+"""
+
+from copy import deepcopy
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class AsyncIterator:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.items:
+            raise StopAsyncIteration
+        return self.items.pop(0)
+
+
+class Cursor(AsyncIterator):
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.items.sort(key=lambda document: document.get(field), reverse=order < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def limit(self, count):
+        if count:
+            self.items = self.items[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.items[:length] if length else list(self.items)
+
+
+# Recorders for pymongo's bulk operation classes; see record_operations
+@dataclass
+class InsertOne:
+    document: dict
+
+
+@dataclass
+class UpdateOne:
+    filter: dict
+    update: dict
+    upsert: bool = False
+
+
+@dataclass
+class ReplaceOne:
+    filter: dict
+    replacement: dict
+    upsert: bool = False
+
+
+OPERATIONS = {"InsertOne": InsertOne, "UpdateOne": UpdateOne, "ReplaceOne": ReplaceOne}
+
+
+def record_operations(monkeypatch, *modules):
+    """Build bulk operations in ``modules`` with the recorders above, whose arguments tests can read"""
+    for module in modules:
+        for name, recorder in OPERATIONS.items():
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, recorder)
+
+
+def _compare(value, condition) -> bool:
+    if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            if operator == "$exists" and (value is not None) != operand:
+                return False
+            if operator == "$ne" and _compare(value, operand):
+                return False
+            if operator == "$in" and not any(_compare(value, candidate) for candidate in operand):
+                return False
+            if operator == "$nin" and any(_compare(value, candidate) for candidate in operand):
+                return False
+            if operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if operator == "$gt" and not value > operand:
+                    return False
+                if operator == "$gte" and not value >= operand:
+                    return False
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$lte" and not value <= operand:
+                    return False
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches(document: dict, query: Optional[dict]) -> bool:
+    for field, condition in (query or {}).items():
+        if field == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif field == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif not _compare(document.get(field), condition):
+            return False
+    return True
+
+
+def project(document: dict, projection: Optional[dict]) -> dict:
+    document = deepcopy(document)
+    if not projection:
+        return document
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        document = {field: document[field] for field in ["_id", *included] if field in document}
+    if not projection.get("_id", 1):
+        document.pop("_id", None)
+    for field, flag in projection.items():
+        if not flag:
+            document.pop(field, None)
+    return document
+
+
+def _parent(document: dict, path: str):
+    *parents, field = path.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    return document, field
+
+
+def apply_update(document: dict, update: dict, inserting: bool = False):
+    for path, value in update.get("$set", {}).items():
+        parent, field = _parent(document, path)
+        parent[field] = deepcopy(value)
+    for path in update.get("$unset", {}):
+        parent, field = _parent(document, path)
+        parent.pop(field, None)
+    for path, amount in update.get("$inc", {}).items():
+        parent, field = _parent(document, path)
+        parent[field] = parent.get(field, 0) + amount
+    for path, value in update.get("$min", {}).items():
+        parent, field = _parent(document, path)
+        parent[field] = value if parent.get(field) is None else min(parent[field], value)
+    for path, value in update.get("$max", {}).items():
+        parent, field = _parent(document, path)
+        parent[field] = value if parent.get(field) is None else max(parent[field], value)
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            parent, field = _parent(document, path)
+            parent[field] = deepcopy(value)
+
+
+def _equality_fields(query: dict) -> dict:
+    return {
+        field: value for field, value in query.items()
+        if not field.startswith("$") and not (isinstance(value, dict) and any(key.startswith("$") for key in value))
+    }
+
+
+class FakeCollection:
+    """A list of documents behind the subset of the Motor collection API the jobs use"""
+
+    def __init__(self, documents=None, name: str = "", database=None):
+        self.documents = [deepcopy(document) for document in documents or []]
+        self.name = name
+        self.database = database
+        self.indexes = []
+
+    def _matching(self, query):
+        return [document for document in self.documents if matches(document, query)]
+
+    def _has_id(self, document_id) -> bool:
+        return document_id is not None and any(document.get("_id") == document_id for document in self.documents)
+
+    def _cursor(self, query, projection, sort) -> Cursor:
+        cursor = Cursor(project(document, projection) for document in self._matching(query))
+        return cursor.sort(sort) if sort else cursor
+
+    def find(self, query=None, projection=None, sort=None):
+        return self._cursor(query, projection, sort)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        found = await self._cursor(query, projection, sort).to_list(1)
+        return found[0] if found else None
+
+    async def count_documents(self, query):
+        return len(self._matching(query))
+
+    async def insert_one(self, document):
+        if self._has_id(document.get("_id")):
+            raise DuplicateKeyError("duplicate key", DUPLICATE_KEY_ERROR)
+        self.documents.append(deepcopy(document))
+        return SimpleNamespace(inserted_id=document.get("_id"))
+
+    async def insert_many(self, documents, ordered=True):
+        for document in documents:
+            await self.insert_one(document)
+        return SimpleNamespace(inserted_ids=[document.get("_id") for document in documents])
+
+    async def update_one(self, query, update, upsert=False):
+        found = self._matching(query)
+        if found:
+            apply_update(found[0], update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        document = deepcopy(_equality_fields(query))
+        apply_update(document, update, inserting=True)
+        await self.insert_one(document)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=document.get("_id"))
+
+    async def replace_one(self, query, replacement, upsert=False):
+        found = self._matching(query)
+        if found:
+            self.documents[self.documents.index(found[0])] = deepcopy(replacement)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            await self.insert_one(replacement)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=replacement.get("_id") if upsert else None)
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=ReturnDocument.BEFORE,
+                                  projection=None):
+        found = self._matching(query)
+        if found:
+            before = deepcopy(found[0])
+            apply_update(found[0], update)
+            return project(found[0] if return_document == ReturnDocument.AFTER else before, projection)
+        if not upsert:
+            return None
+        document = deepcopy(_equality_fields(query))
+        apply_update(document, update, inserting=True)
+        await self.insert_one(document)
+        return project(document, projection) if return_document == ReturnDocument.AFTER else None
+
+    async def create_index(self, keys, **options):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = "_".join(f"{field}_{direction}" for field, direction in keys)
+        self.indexes.append({"name": name, "key": dict(keys), **options})
+        return name
+
+    async def create_indexes(self, models):
+        return [await self.create_index(list(model.document["key"].items()), **{
+            option: value for option, value in model.document.items() if option not in ("key", "name")
+        }) for model in models]
+
+    def list_indexes(self):
+        return AsyncIterator([{"name": "_id_", "key": {"_id": 1}}, *self.indexes])
+
+    async def delete_many(self, query):
+        remaining = [document for document in self.documents if not matches(document, query)]
+        deleted = len(self.documents) - len(remaining)
+        self.documents = remaining
+        return SimpleNamespace(deleted_count=deleted)
+
+    async def drop(self):
+        self.documents = []
+        self.indexes = []
+
+    async def rename(self, new_name, dropTarget=False):
+        if new_name in self.database and not dropTarget:
+            raise OperationFailure("target namespace exists", 48)
+        renamed = FakeCollection(name=new_name, database=self.database)
+        renamed.documents, renamed.indexes = self.documents, self.indexes
+        self.database[new_name] = renamed
+        self.documents, self.indexes = [], []
+
+    async def bulk_write(self, operations, ordered=True):
+        result = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "upserted_count": 0}
+        write_errors = []
+        for index, operation in enumerate(operations):
+            try:
+                if isinstance(operation, InsertOne):
+                    await self.insert_one(operation.document)
+                    result["inserted_count"] += 1
+                    continue
+                if isinstance(operation, UpdateOne):
+                    outcome = await self.update_one(operation.filter, operation.update, upsert=operation.upsert)
+                else:
+                    outcome = await self.replace_one(operation.filter, operation.replacement, upsert=operation.upsert)
+                result["matched_count"] += outcome.matched_count
+                result["modified_count"] += outcome.modified_count
+                result["upserted_count"] += outcome.upserted_id is not None
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": DUPLICATE_KEY_ERROR, "errmsg": str(e)})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, **{f"n{key}": value for key, value in result.items()}})
+        return SimpleNamespace(**result)
+
+
+class FakeDB(dict):
+    """Collections by name, created on first use, reachable as items or attributes"""
+
+    def __missing__(self, name):
+        self[name] = FakeCollection(name=name, database=self)
+        return self[name]
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def create_collection(self, name):
+        return self[name]
+
+    async def list_collection_names(self):
+        return [name for name, collection in self.items() if collection.documents]
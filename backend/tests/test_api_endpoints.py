@@ -6,18 +6,28 @@ import pytest
 import asyncio
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch, MagicMock
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorClient
 
 # Import the app
 import sys
 sys.path.append(str(Path(__file__).parent.parent))
-from server import app
+from server import app, load_mongo_client_options
+import download_counters
+from tests.fakes import record_operations
 
 client = TestClient(app)
 
+
+def route_collections(mock_db):
+    """Make db[name] resolve to the same mock as db.name, with rollup writes accepted"""
+    mock_db.__getitem__.side_effect = lambda name: getattr(mock_db, name)
+    mock_db.analytics_rollups.bulk_write = AsyncMock()
+    return mock_db
+
 class TestContactEndpoints:
     """Test contact form endpoints"""
     
@@ -30,10 +40,12 @@ class TestContactEndpoints:
             "company": "Test Corp",
             "interested_in": "Risk Strategy",
             "service_type": "risk-strategy",
-            "message": "I am interested in your services."
+            "message": "I am interested in your services.",
+            "session_id": "session-1"
         }
         
         with patch('server.db') as mock_db:
+            route_collections(mock_db)
             mock_db.contact_forms.insert_one = AsyncMock(return_value=MagicMock(inserted_id="123"))
             mock_db.analytics_events.insert_one = AsyncMock()
             
@@ -45,6 +57,8 @@ class TestContactEndpoints:
             assert data["email"] == "john@example.com"
             assert "id" in data
             assert "timestamp" in data
+            # The submission event joins the visitor's session for funnels
+            assert mock_db.analytics_events.insert_one.call_args.args[0]["session_id"] == "session-1"
 
     def test_submit_contact_form_validation_errors(self):
         """Test contact form validation errors"""
@@ -109,7 +123,7 @@ class TestContactEndpoints:
         ]
         
         with patch('server.db') as mock_db:
-            mock_db.contact_forms.find.return_value.to_list = AsyncMock(return_value=mock_forms)
+            mock_db.contact_forms.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_forms)
             
             response = client.get("/api/contact")
             
@@ -141,7 +155,7 @@ class TestResourceEndpoints:
         ]
         
         with patch('server.db') as mock_db:
-            mock_db.resources.find.return_value.to_list = AsyncMock(return_value=mock_resources)
+            mock_db.resources.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_resources)
             
             response = client.get("/api/resources")
             
@@ -169,7 +183,7 @@ class TestResourceEndpoints:
         ]
         
         with patch('server.db') as mock_db:
-            mock_db.resources.find.return_value.to_list = AsyncMock(return_value=mock_resources)
+            mock_db.resources.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_resources)
             
             response = client.get("/api/resources?category=white-paper")
             
@@ -197,7 +211,7 @@ class TestResourceEndpoints:
         ]
         
         with patch('server.db') as mock_db:
-            mock_db.resources.find.return_value.to_list = AsyncMock(return_value=mock_resources)
+            mock_db.resources.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_resources)
             
             response = client.get("/api/resources?featured=true")
             
@@ -232,6 +246,78 @@ class TestResourceEndpoints:
             assert data["id"] == "resource-1"
             assert data["title"] == "Test Resource"
 
+    def test_get_resource_sets_validators(self):
+        """Test ETag, Last-Modified and Cache-Control on resource responses"""
+        mock_resource = {
+            "id": "resource-1",
+            "title": "Test Resource",
+            "description": "Test description",
+            "type": "pdf",
+            "category": "white-paper",
+            "file_path": "test.pdf",
+            "download_count": 5,
+            "created_at": datetime(2024, 5, 1, 12, 0, 0),
+            "updated_at": datetime(2024, 5, 2, 12, 0, 0),
+            "metadata": {}
+        }
+        
+        with patch('server.db') as mock_db:
+            mock_db.resources.find_one = AsyncMock(return_value=mock_resource)
+            
+            response = client.get("/api/resources/resource-1")
+            
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+            assert etag.startswith('"')
+            assert response.headers["Last-Modified"] == "Thu, 02 May 2024 12:00:00 GMT"
+            assert "max-age" in response.headers["Cache-Control"]
+            
+            response = client.get("/api/resources/resource-1", headers={"If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.headers["ETag"] == etag
+            assert response.content == b""
+            
+            response = client.get("/api/resources/resource-1", headers={"If-Modified-Since": "Thu, 02 May 2024 12:00:00 GMT"})
+            assert response.status_code == 304
+            
+            response = client.get("/api/resources/resource-1", headers={"If-Modified-Since": "Wed, 01 May 2024 12:00:00 GMT"})
+            assert response.status_code == 200
+            
+            # The ETag changes with the download count
+            mock_resource["download_count"] = 6
+            response = client.get("/api/resources/resource-1", headers={"If-None-Match": etag})
+            assert response.status_code == 200
+            
+            # So does Last-Modified, which a download moves without touching updated_at
+            mock_resource["last_downloaded_at"] = datetime(2024, 5, 3, 8, 0, 0)
+            response = client.get("/api/resources/resource-1", headers={"If-Modified-Since": "Thu, 02 May 2024 12:00:00 GMT"})
+            assert response.status_code == 200
+            assert response.headers["Last-Modified"] == "Fri, 03 May 2024 08:00:00 GMT"
+
+    def test_get_resources_not_modified(self):
+        """Test conditional GET on the resource list is scoped to the query"""
+        mock_resources = [
+            {
+                "id": "resource-1",
+                "title": "Test Resource",
+                "description": "Test description",
+                "type": "pdf",
+                "category": "white-paper",
+                "file_path": "test.pdf",
+                "created_at": datetime(2024, 5, 1),
+                "updated_at": datetime(2024, 5, 1),
+                "metadata": {}
+            }
+        ]
+        
+        with patch('server.db') as mock_db:
+            mock_db.resources.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_resources)
+            
+            etag = client.get("/api/resources").headers["ETag"]
+            
+            assert client.get("/api/resources", headers={"If-None-Match": etag}).status_code == 304
+            assert client.get("/api/resources?featured=false", headers={"If-None-Match": etag}).status_code == 200
+
     def test_get_resource_not_found(self):
         """Test getting non-existent resource"""
         with patch('server.db') as mock_db:
@@ -264,9 +350,9 @@ class TestResourceEndpoints:
             assert "id" in data
             assert "created_at" in data
 
-    @patch('server.Path')
-    def test_download_resource_success(self, mock_path):
+    def test_download_resource_success(self, tmp_path, monkeypatch):
         """Test successful resource download"""
+        record_operations(monkeypatch, download_counters)
         mock_resource = {
             "id": "resource-1",
             "title": "Test Resource",
@@ -275,24 +361,113 @@ class TestResourceEndpoints:
             "download_count": 5
         }
         
-        # Mock file exists
-        mock_file_path = MagicMock()
-        mock_file_path.exists.return_value = True
-        mock_path.return_value = mock_file_path
+        # Real file under a temporary public/resources directory
+        resources_dir = tmp_path / "public" / "resources"
+        resources_dir.mkdir(parents=True)
+        (resources_dir / "test.pdf").write_bytes(b"%PDF-1.4 test content")
+        
+        with patch('server.db') as mock_db, \
+             patch('server.ROOT_DIR', tmp_path):
+            route_collections(mock_db)
+            mock_db.resources.find_one = AsyncMock(return_value=mock_resource)
+            mock_db.resource_downloads.insert_one = AsyncMock()
+            mock_db.link_interactions.insert_one = AsyncMock()
+            mock_db.resources.bulk_write = AsyncMock(return_value=MagicMock(modified_count=1))
+            
+            response = client.get("/api/resources/resource-1/download", headers={"Idempotency-Key": "download-key-1"})
+            
+            assert response.status_code == 200
+            assert response.content == b"%PDF-1.4 test content"
+            assert response.headers["content-type"] == "application/pdf"
+            assert response.headers["accept-ranges"] == "bytes"
+            assert "etag" in response.headers
+            download = mock_db.resource_downloads.insert_one.call_args.args[0]
+            interaction = mock_db.link_interactions.insert_one.call_args.args[0]
+            assert download["id"] == interaction["id"] == "download-key-1"
+            assert download["resource_category"] == "white-paper"
+            assert download["resource_title"] == "Test Resource"
+            # Only the fields the download path reads are fetched
+            assert mock_db.resources.find_one.call_args.args[1] == {"_id": 0, "id": 1, "title": 1, "category": 1, "file_path": 1}
+            
+            # The counter increment is guarded by the idempotency key
+            operation = mock_db.resources.bulk_write.call_args.args[0][0]
+            assert operation.filter == {"id": "resource-1", "_applied_downloads": {"$ne": "download-key-1"}}
+            assert operation.update["$inc"] == {"download_count": 1}
+
+    def test_download_resource_retry_with_same_key_is_not_counted(self, tmp_path):
+        """Test that a retried download with an already recorded key skips the bookkeeping"""
+        from pymongo.errors import DuplicateKeyError
+        
+        mock_resource = {
+            "id": "resource-1",
+            "title": "Test Resource",
+            "file_path": "test.pdf",
+            "category": "white-paper"
+        }
+        resources_dir = tmp_path / "public" / "resources"
+        resources_dir.mkdir(parents=True)
+        (resources_dir / "test.pdf").write_bytes(b"%PDF-1.4")
         
         with patch('server.db') as mock_db, \
-             patch('server.FileResponse') as mock_file_response:
+             patch('server.ROOT_DIR', tmp_path):
+            route_collections(mock_db)
+            mock_db.resources.find_one = AsyncMock(return_value=mock_resource)
+            mock_db.resource_downloads.insert_one = AsyncMock(side_effect=DuplicateKeyError("duplicate key"))
+            mock_db.link_interactions.insert_one = AsyncMock(side_effect=DuplicateKeyError("duplicate key"))
+            mock_db.resources.bulk_write = AsyncMock()
             
+            response = client.get("/api/resources/resource-1/download", headers={"Idempotency-Key": "download-key-1"})
+            
+            assert response.status_code == 200
+            mock_db.resources.bulk_write.assert_not_called()
+            mock_db.analytics_rollups.bulk_write.assert_not_called()
+
+    def test_download_resource_range_and_conditional(self, tmp_path):
+        """Test partial content, If-Range and 304 handling for downloads"""
+        mock_resource = {
+            "id": "resource-1",
+            "title": "Test Resource",
+            "file_path": "test.pdf",
+            "category": "white-paper"
+        }
+        resources_dir = tmp_path / "public" / "resources"
+        resources_dir.mkdir(parents=True)
+        (resources_dir / "test.pdf").write_bytes(b"0123456789")
+        
+        with patch('server.db') as mock_db, \
+             patch('server.ROOT_DIR', tmp_path):
+            route_collections(mock_db)
             mock_db.resources.find_one = AsyncMock(return_value=mock_resource)
             mock_db.resource_downloads.insert_one = AsyncMock()
             mock_db.link_interactions.insert_one = AsyncMock()
-            mock_db.resources.update_one = AsyncMock()
+            mock_db.resources.bulk_write = AsyncMock(return_value=MagicMock(modified_count=1))
             
-            mock_file_response.return_value = "file_response"
+            full = client.get("/api/resources/resource-1/download")
+            etag = full.headers["etag"]
             
-            response = client.get("/api/resources/resource-1/download")
+            # Resuming from byte 4 returns the tail and is not counted again
+            response = client.get("/api/resources/resource-1/download", headers={"Range": "bytes=4-", "If-Range": etag})
+            assert response.status_code == 206
+            assert response.content == b"456789"
+            assert response.headers["content-range"] == "bytes 4-9/10"
+            assert mock_db.resource_downloads.insert_one.call_count == 1
+            
+            response = client.get("/api/resources/resource-1/download", headers={"Range": "bytes=-3"})
+            assert response.status_code == 206
+            assert response.content == b"789"
             
+            # A stale If-Range validator gets the whole file
+            response = client.get("/api/resources/resource-1/download", headers={"Range": "bytes=4-", "If-Range": '"stale"'})
             assert response.status_code == 200
+            assert response.content == b"0123456789"
+            
+            response = client.get("/api/resources/resource-1/download", headers={"Range": "bytes=20-"})
+            assert response.status_code == 416
+            assert response.headers["content-range"] == "bytes */10"
+            
+            response = client.get("/api/resources/resource-1/download", headers={"If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.content == b""
 
     def test_download_resource_not_found(self):
         """Test downloading non-existent resource"""
@@ -304,8 +479,7 @@ class TestResourceEndpoints:
             assert response.status_code == 404
             assert "Resource not found" in response.json()["detail"]
 
-    @patch('server.Path')
-    def test_download_resource_file_not_found(self, mock_path):
+    def test_download_resource_file_not_found(self, tmp_path):
         """Test downloading resource when file doesn't exist"""
         mock_resource = {
             "id": "resource-1",
@@ -314,12 +488,8 @@ class TestResourceEndpoints:
             "category": "white-paper"
         }
         
-        # Mock file doesn't exist
-        mock_file_path = MagicMock()
-        mock_file_path.exists.return_value = False
-        mock_path.return_value = mock_file_path
-        
-        with patch('server.db') as mock_db:
+        with patch('server.db') as mock_db, \
+             patch('server.ROOT_DIR', tmp_path):
             mock_db.resources.find_one = AsyncMock(return_value=mock_resource)
             
             response = client.get("/api/resources/resource-1/download")
@@ -341,8 +511,9 @@ class TestResourceEndpoints:
         ]
         
         with patch('server.db') as mock_db:
+            route_collections(mock_db)
             mock_db.resources.find_one = AsyncMock(return_value=mock_resource)
-            mock_db.resource_downloads.count_documents = AsyncMock(return_value=15)
+            mock_db.analytics_rollups.find_one = AsyncMock(return_value={"_id": "resource:resource-1", "downloads": 15})
             mock_db.resource_downloads.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_downloads)
             
             response = client.get("/api/resources/resource-1/stats")
@@ -353,6 +524,9 @@ class TestResourceEndpoints:
             assert data["total_downloads"] == 15
             assert data["resource_download_count"] == 10
             assert len(data["recent_downloads"]) == 2
+            assert mock_db.resources.find_one.call_args.args[1] == {"_id": 0, "download_count": 1}
+            projection = mock_db.resource_downloads.find.call_args.args[1]
+            assert projection["_id"] == 0 and "ip_address" not in projection and "user_agent" not in projection
 
 
 class TestAnalyticsEndpoints:
@@ -371,6 +545,7 @@ class TestAnalyticsEndpoints:
         }
         
         with patch('server.db') as mock_db:
+            route_collections(mock_db)
             mock_db.analytics_events.insert_one = AsyncMock()
             
             response = client.post("/api/analytics/track", json=event_data)
@@ -380,6 +555,22 @@ class TestAnalyticsEndpoints:
             assert data["status"] == "tracked"
             assert "event_id" in data
 
+    def test_track_event_uses_write_buffer_when_running(self):
+        """Test that tracking is queued instead of written inline when the buffer runs"""
+        with patch('server.db') as mock_db, \
+             patch('server.write_buffer') as mock_buffer:
+            mock_buffer.running = True
+            mock_buffer.put = AsyncMock()
+            mock_db.analytics_events.insert_one = AsyncMock()
+            
+            response = client.post("/api/analytics/track", json={"event_type": "page_view", "element_id": "home"})
+            
+            assert response.status_code == 200
+            collection_name, document = mock_buffer.put.call_args.args
+            assert collection_name == "analytics_events"
+            assert document["id"] == response.json()["event_id"]
+            mock_db.analytics_events.insert_one.assert_not_called()
+
     def test_track_link_click(self):
         """Test tracking link click"""
         link_data = {
@@ -393,6 +584,7 @@ class TestAnalyticsEndpoints:
         }
         
         with patch('server.db') as mock_db:
+            route_collections(mock_db)
             mock_db.link_interactions.insert_one = AsyncMock()
             
             response = client.post("/api/analytics/link-click", json=link_data)
@@ -402,6 +594,92 @@ class TestAnalyticsEndpoints:
             assert data["status"] == "tracked"
             assert "interaction_id" in data
 
+    def test_track_event_batch(self):
+        """Test tracking a mixed batch of events and link clicks"""
+        batch = [
+            {"event_type": "page_view", "element_id": "homepage", "session_id": "session-123"},
+            {"kind": "link_click", "link_id": "nav-services", "link_category": "navigation", "session_id": "session-123"},
+            {"event_type": "scheduling_click", "element_id": "schedule-btn", "metadata": {"service_type": "general"}},
+            {"kind": "unsupported"},
+            "not-an-object"
+        ]
+        
+        with patch('server.db') as mock_db:
+            route_collections(mock_db)
+            mock_db.analytics_events.insert_many = AsyncMock()
+            mock_db.link_interactions.insert_many = AsyncMock()
+            
+            response = client.post("/api/analytics/track/batch", json=batch)
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["received"] == 5
+            assert data["tracked"] == 3
+            assert data["failed"] == 2
+            assert [r["status"] for r in data["results"]] == ["tracked", "tracked", "tracked", "rejected", "rejected"]
+            assert "event_id" in data["results"][0]
+            assert "interaction_id" in data["results"][1]
+            
+            events_args = mock_db.analytics_events.insert_many.call_args
+            assert len(events_args.args[0]) == 2
+            assert events_args.kwargs["ordered"] is False
+            assert len(mock_db.link_interactions.insert_many.call_args.args[0]) == 1
+
+    def test_track_event_batch_rejects_invalid_items_and_keeps_the_rest(self):
+        """Test that items failing model validation are rejected individually"""
+        batch = [
+            {"event_type": "page_view", "element_id": "homepage"},
+            {"event_type": "page_view", "element_id": "hero", "metadata": "oops"},
+            {"event_type": "page_view", "element_id": None},
+            {"kind": "link_click", "link_id": None},
+            {"kind": "link_click", "link_id": "nav-services"}
+        ]
+        
+        with patch('server.db') as mock_db:
+            route_collections(mock_db)
+            mock_db.analytics_events.insert_many = AsyncMock()
+            mock_db.link_interactions.insert_many = AsyncMock()
+            
+            response = client.post("/api/analytics/track/batch", json=batch)
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert [r["status"] for r in data["results"]] == ["tracked", "rejected", "rejected", "rejected", "tracked"]
+            assert "metadata" in data["results"][1]["detail"]
+            assert "link_id" in data["results"][3]["detail"]
+            assert len(mock_db.analytics_events.insert_many.call_args.args[0]) == 1
+            assert len(mock_db.link_interactions.insert_many.call_args.args[0]) == 1
+
+    def test_track_event_batch_partial_write_failure(self):
+        """Test per-item results when part of an unordered bulk insert fails"""
+        from pymongo.errors import BulkWriteError
+        
+        batch = [
+            {"event_type": "page_view", "element_id": "a"},
+            {"event_type": "page_view", "element_id": "b"}
+        ]
+        error = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "duplicate key"}]})
+        
+        with patch('server.db') as mock_db:
+            route_collections(mock_db)
+            mock_db.analytics_events.insert_many = AsyncMock(side_effect=error)
+            
+            response = client.post("/api/analytics/track/batch", json=batch)
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["tracked"] == 1
+            assert data["results"][0]["status"] == "tracked"
+            assert data["results"][1]["status"] == "failed"
+
+    def test_track_event_batch_too_large(self):
+        """Test batch size limit"""
+        batch = [{"event_type": "page_view"}] * 501
+        
+        response = client.post("/api/analytics/track/batch", json=batch)
+        
+        assert response.status_code == 413
+
     def test_get_analytics_dashboard(self):
         """Test getting analytics dashboard data"""
         mock_resources = [
@@ -409,16 +687,16 @@ class TestAnalyticsEndpoints:
             {"title": "Resource 2", "download_count": 5}
         ]
         
-        mock_interaction_categories = [
-            {"_id": "download", "count": 50},
-            {"_id": "external", "count": 30}
+        mock_category_rollups = [
+            {"_id": "link_category:download", "key": "download", "interactions": 50},
+            {"_id": "link_category:external", "key": "external", "interactions": 30}
         ]
         
         with patch('server.db') as mock_db:
-            mock_db.resource_downloads.count_documents = AsyncMock(return_value=100)
+            route_collections(mock_db)
+            mock_db.analytics_rollups.find_one = AsyncMock(return_value={"_id": "total:all", "downloads": 100, "interactions": 200})
+            mock_db.analytics_rollups.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_category_rollups)
             mock_db.resources.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_resources)
-            mock_db.link_interactions.count_documents = AsyncMock(return_value=200)
-            mock_db.link_interactions.aggregate.return_value.to_list = AsyncMock(return_value=mock_interaction_categories)
             mock_db.resource_downloads.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[])
             mock_db.link_interactions.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[])
             
@@ -429,31 +707,87 @@ class TestAnalyticsEndpoints:
             assert "summary" in data
             assert data["summary"]["total_downloads"] == 100
             assert data["summary"]["total_interactions"] == 200
+            assert data["summary"]["unique_sessions"] == 0
+            assert data["interaction_categories"][0] == {"_id": "download", "count": 50}
             assert len(data["interaction_categories"]) == 2
+            # Recent activity and popular resources fetch only the summary fields
+            assert mock_db.link_interactions.find.call_args.args[1] == {
+                "_id": 0, "id": 1, "link_id": 1, "link_category": 1, "action_type": 1, "session_id": 1, "timestamp": 1
+            }
+            assert "file_path" not in mock_db.resources.find.call_args.args[1]
 
     def test_get_resource_analytics(self):
         """Test getting detailed resource analytics"""
-        mock_downloads_by_category = [
-            {"_id": "white-paper", "count": 30},
-            {"_id": "case-study", "count": 20}
+        mock_category_rollups = [
+            {"_id": "download_category:white-paper", "key": "white-paper", "downloads": 30},
+            {"_id": "download_category:case-study", "key": "case-study", "downloads": 20}
         ]
         
         mock_most_downloaded = [
             {"title": "Popular Resource", "download_count": 50}
         ]
         
+        today = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        mock_hours = [
+            {"bucket": today, "downloads": 3},
+            {"bucket": today - timedelta(days=2), "downloads": 4}
+        ]
+        
         with patch('server.db') as mock_db:
-            mock_db.resource_downloads.aggregate.return_value.to_list = AsyncMock(return_value=mock_downloads_by_category)
+            route_collections(mock_db)
+            mock_db.analytics_rollups.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(
+                return_value=mock_category_rollups
+            )
             mock_db.resources.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_most_downloaded)
-            mock_db.resource_downloads.find.return_value.sort.return_value.to_list = AsyncMock(return_value=[])
+            mock_db.analytics_rollups.find.return_value.__aiter__.return_value = mock_hours
             
             response = client.get("/api/analytics/resources")
             
             assert response.status_code == 200
             data = response.json()
+            assert data["downloads_by_category"][0] == {"_id": "white-paper", "count": 30}
             assert len(data["downloads_by_category"]) == 2
+            mock_db.resource_downloads.aggregate.assert_not_called()
             assert len(data["most_downloaded"]) == 1
-            assert "recent_downloads_count" in data
+            assert data["recent_downloads_count"] == 7
+            # One zero-filled bucket per day instead of raw download documents
+            assert len(data["download_trend"]) in (30, 31)
+            assert data["download_trend"][-1]["count"] == 3
+
+    def test_get_download_trend_grouped_by_category(self):
+        """Test bucketed download trend grouped by resource category"""
+        mock_hours = [
+            {"bucket": datetime(2024, 5, 1, 9), "downloads": 3, "downloads_by_category": {"case-studies": 2, "guides": 1}},
+            {"bucket": datetime(2024, 5, 1, 17), "downloads": 1, "downloads_by_category": {"case-studies": 1}},
+            {"bucket": datetime(2024, 5, 2, 8), "downloads": 1, "downloads_by_category": {"guides": 1}}
+        ]
+        
+        with patch('server.db') as mock_db:
+            route_collections(mock_db)
+            mock_db.analytics_rollups.find.return_value.__aiter__.return_value = mock_hours
+            
+            response = client.get(
+                "/api/analytics/downloads/trend",
+                params={"start": "2024-05-01T00:00:00", "end": "2024-05-03T00:00:00", "group_by": "category"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["total"] == 5
+            assert [bucket["count"] for bucket in data["buckets"]] == [4, 1]
+            assert data["buckets"][0]["groups"] == {"case-studies": 3, "guides": 1}
+            assert data["buckets"][1]["groups"] == {"guides": 1}
+            # Categories come from the downloads themselves, not the current catalog
+            mock_db.resources.find.assert_not_called()
+
+    def test_get_download_trend_rejects_too_many_buckets(self):
+        """Test that very fine-grained ranges are rejected"""
+        with patch('server.db') as mock_db:
+            route_collections(mock_db)
+            
+            response = client.get("/api/analytics/downloads/trend", params={"granularity": "hour", "days": 365})
+            
+            assert response.status_code == 400
 
 
 class TestStatusEndpoints:
@@ -495,7 +829,7 @@ class TestStatusEndpoints:
         ]
         
         with patch('server.db') as mock_db:
-            mock_db.status_checks.find.return_value.to_list = AsyncMock(return_value=mock_status_checks)
+            mock_db.status_checks.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_status_checks)
             
             response = client.get("/api/status")
             
@@ -505,6 +839,58 @@ class TestStatusEndpoints:
             assert data[0]["client_name"] == "test-client"
 
 
+    def test_get_status_checks_next_page_cursor(self):
+        """Test keyset pagination returns a cursor when more documents exist"""
+        timestamp = datetime(2024, 5, 1, 12, 0, 0)
+        mock_status_checks = [
+            {"id": f"status-{i}", "client_name": "test-client", "timestamp": timestamp}
+            for i in range(3)
+        ]
+        
+        with patch('server.db') as mock_db:
+            mock_find = mock_db.status_checks.find
+            mock_find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=mock_status_checks)
+            
+            response = client.get("/api/status?limit=2")
+            
+            assert response.status_code == 200
+            assert len(response.json()) == 2
+            cursor = response.headers["X-Next-Cursor"]
+            assert 'rel="next"' in response.headers["Link"]
+            mock_find.return_value.sort.return_value.limit.assert_called_with(3)
+            
+            response = client.get(f"/api/status?limit=2&after={cursor}")
+            
+            assert response.status_code == 200
+            query = mock_find.call_args.args[0]
+            assert query["$or"][1] == {"timestamp": timestamp, "id": {"$gt": "status-1"}}
+
+    def test_get_status_checks_invalid_cursor(self):
+        """Test malformed pagination cursors are rejected"""
+        with patch('server.db'):
+            response = client.get("/api/status?after=not-a-cursor")
+            
+            assert response.status_code == 400
+            assert "Invalid pagination cursor" in response.json()["detail"]
+
+    def test_export_contact_forms_ndjson(self):
+        """Test streaming contact forms as NDJSON"""
+        mock_forms = [
+            {"id": "1", "first_name": "John", "timestamp": datetime(2024, 5, 1)},
+            {"id": "2", "first_name": "Jane", "timestamp": datetime(2024, 5, 2)}
+        ]
+        
+        with patch('server.db') as mock_db:
+            mock_db.contact_forms.find.return_value.sort.return_value.batch_size.return_value.__aiter__.return_value = mock_forms
+            
+            response = client.get("/api/contact?format=ndjson")
+            
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            lines = [json.loads(line) for line in response.text.splitlines()]
+            assert [line["first_name"] for line in lines] == ["John", "Jane"]
+            assert lines[0]["timestamp"] == "2024-05-01T00:00:00"
+
 class TestErrorHandling:
     """Test API error handling"""
     
@@ -587,6 +973,7 @@ class TestRequestValidation:
         }
         
         with patch('server.db') as mock_db:
+            route_collections(mock_db)
             mock_db.contact_forms.insert_one = AsyncMock()
             mock_db.analytics_events.insert_one = AsyncMock()
             
@@ -611,5 +998,45 @@ class TestRequestValidation:
         assert "Message must be at least 10 characters long" in response.json()["detail"]
 
 
+class TestMongoClientOptions:
+    """Test connection pool configuration from the environment"""
+
+    def test_defaults_only_bound_server_selection(self):
+        assert load_mongo_client_options({}) == {"serverSelectionTimeoutMS": 5000}
+
+    def test_pool_settings_from_environment(self):
+        options = load_mongo_client_options({
+            "MONGO_MAX_POOL_SIZE": "20",
+            "MONGO_MIN_POOL_SIZE": "2",
+            "MONGO_MAX_IDLE_TIME_MS": "60000",
+            "MONGO_WAIT_QUEUE_TIMEOUT_MS": "2000",
+            "MONGO_SERVER_SELECTION_TIMEOUT_MS": "3000",
+            "MONGO_READ_PREFERENCE": "secondaryPreferred",
+        })
+
+        assert options == {
+            "serverSelectionTimeoutMS": 3000,
+            "maxPoolSize": 20,
+            "minPoolSize": 2,
+            "maxIdleTimeMS": 60000,
+            "waitQueueTimeoutMS": 2000,
+            "readPreference": "secondaryPreferred",
+        }
+
+    def test_pool_stats_endpoint(self):
+        # The client is created by the lifespan, which the test client does not run
+        assert client.get("/api/admin/mongo-pool").status_code == 503
+
+        mongo_client = AsyncIOMotorClient("mongodb://localhost:27017", serverSelectionTimeoutMS=5000)
+        with patch('server.client', mongo_client):
+            response = client.get("/api/admin/mongo-pool")
+        mongo_client.close()
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["options"]["server_selection_timeout"] == 5
+        assert "pools" in data
+
+
 if __name__ == "__main__":
-    pytest.main([__file__])
\ No newline at end of file
+    pytest.main([__file__])
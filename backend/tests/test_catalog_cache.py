@@ -0,0 +1,135 @@
+"""
+Tests for the resource catalog cache
+"""
+
+import asyncio
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from catalog_cache import ResourceCatalogCache
+from tests.fakes import FakeCollection, FakeDB
+
+
+def make_resources():
+    return [
+        {"_id": "oid-2", "id": "b", "category": "guides", "featured": False, "download_count": 7,
+         "created_at": datetime(2024, 1, 2)},
+        {"_id": "oid-1", "id": "a", "category": "case-studies", "featured": True, "download_count": 3,
+         "created_at": datetime(2024, 1, 1)},
+        {"_id": "oid-3", "id": "c", "category": "case-studies", "featured": False, "download_count": 1,
+         "created_at": datetime(2024, 1, 3)},
+    ]
+
+
+def make_db():
+    db = FakeDB(resources=FakeCollection(make_resources()))
+    db.resources.find = MagicMock(wraps=db.resources.find)
+    return db
+
+
+class TestResourceCatalogCache:
+    """Test indexing, invalidation and metrics"""
+
+    def test_serves_reads_from_memory_after_load(self):
+        db = make_db()
+
+        async def scenario():
+            cache = ResourceCatalogCache(db, use_change_stream=False)
+            await cache.start()
+            resource = await cache.get("a")
+            missing = await cache.get("zzz")
+            by_category = await cache.list(category="case-studies")
+            featured = await cache.list(featured=True)
+            not_featured = await cache.list(category="case-studies", featured=False)
+            return cache, resource, missing, by_category, featured, not_featured
+
+        cache, resource, missing, by_category, featured, not_featured = asyncio.run(scenario())
+
+        assert resource["id"] == "a"
+        assert "_id" not in resource
+        assert missing is None
+        assert [r["id"] for r in by_category] == ["a", "c"]
+        assert [r["id"] for r in featured] == ["a"]
+        assert [r["id"] for r in not_featured] == ["c"]
+        assert db.resources.find.call_count == 1
+        assert cache.metrics()["hits"] == 5
+        assert cache.metrics()["misses"] == 0
+
+    def test_invalidate_forces_single_reload(self):
+        db = make_db()
+
+        async def scenario():
+            cache = ResourceCatalogCache(db, use_change_stream=False)
+            await cache.start()
+            cache.invalidate()
+            await asyncio.gather(*(cache.get("a") for _ in range(5)))
+            return cache.metrics()
+
+        metrics = asyncio.run(scenario())
+
+        assert db.resources.find.call_count == 2
+        assert metrics["misses"] == 1
+        assert metrics["reloads"] == 2
+
+    def test_ttl_expiry_reloads(self):
+        db = make_db()
+
+        async def scenario():
+            cache = ResourceCatalogCache(db, ttl=0, use_change_stream=False)
+            await cache.start()
+            await cache.get("a")
+            return cache.metrics()
+
+        assert asyncio.run(scenario())["misses"] == 1
+
+    def test_keyset_page_and_most_downloaded(self):
+        db = make_db()
+
+        async def scenario():
+            cache = ResourceCatalogCache(db, use_change_stream=False)
+            await cache.start()
+            first, cursor = await cache.page(limit=2)
+            second, last_cursor = await cache.page(limit=2, after=cursor)
+            top = await cache.most_downloaded(2)
+            return first, second, cursor, last_cursor, top
+
+        first, second, cursor, last_cursor, top = asyncio.run(scenario())
+
+        assert [r["id"] for r in first] == ["a", "b"]
+        assert [r["id"] for r in second] == ["c"]
+        assert cursor is not None and last_cursor is None
+        assert [r["id"] for r in top] == ["b", "a"]
+
+    def test_change_stream_counter_updates_apply_in_place(self):
+        db = make_db()
+
+        async def scenario():
+            cache = ResourceCatalogCache(db, use_change_stream=False)
+            await cache.start()
+            cache._apply_change({
+                "operationType": "update",
+                "documentKey": {"_id": "oid-1"},
+                "updateDescription": {
+                    "updatedFields": {"download_count": 4, "last_downloaded_at": "now", "_applied_downloads.3": "key"},
+                    "removedFields": [],
+                },
+            })
+            counted = (await cache.get("a"))["download_count"]
+            downloaded_at = (await cache.get("a")).get("last_downloaded_at")
+            stale_after_counter = cache.metrics()["invalidations"]
+            cache._apply_change({
+                "operationType": "update",
+                "documentKey": {"_id": "oid-1"},
+                "updateDescription": {"updatedFields": {"title": "Renamed"}, "removedFields": []},
+            })
+            return counted, downloaded_at, stale_after_counter, cache.metrics()["invalidations"]
+
+        counted, downloaded_at, stale_after_counter, invalidations = asyncio.run(scenario())
+
+        assert counted == 4
+        assert downloaded_at == "now"
+        assert stale_after_counter == 0
+        assert invalidations == 1
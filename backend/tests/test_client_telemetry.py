@@ -0,0 +1,155 @@
+"""
+Tests for browser error and performance beacon ingestion
+"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import client_telemetry
+from client_telemetry import TelemetryGate, error_fingerprint, session_sampled
+from server import app
+
+client = TestClient(app)
+
+
+def error(session_id="s1", message="Request failed: 502 Bad Gateway", severity="medium", **extra):
+    return {"type": "failed_request", "message": message, "url": "/api/resources", "severity": severity,
+            "session_id": session_id, "fingerprint": error_fingerprint({"type": "failed_request", "message": message,
+                                                                        "url": "/api/resources"}),
+            "occurrences": 1, **extra}
+
+
+class TestTelemetryGate:
+    """Test sampling, deduplication and rate caps"""
+
+    def test_fingerprint_ignores_numbers_and_query_strings(self):
+        first = {"type": "slow_request", "message": "Slow request: 5123ms", "url": "/api/x?a=1"}
+        second = {"type": "slow_request", "message": "Slow request: 6001ms", "url": "/api/x?a=2"}
+
+        assert error_fingerprint(first) == error_fingerprint(second)
+        assert error_fingerprint(first) != error_fingerprint({**first, "type": "network_error"})
+
+    def test_repeats_are_folded_within_a_batch_and_dropped_within_the_window(self):
+        gate = TelemetryGate(dedup_window=60)
+
+        admitted, outcome = gate.admit([error(), error(message="Request failed: 504 Bad Gateway"), error("s2")], dedupe=True)
+        assert len(admitted) == 2
+        assert admitted[0]["occurrences"] == 2
+        assert outcome["duplicates"] == 1
+
+        admitted, outcome = gate.admit([error()], dedupe=True)
+        assert admitted == []
+        assert outcome["duplicates"] == 1
+
+    def test_sampling_keeps_whole_sessions_and_high_severity_errors(self):
+        gate = TelemetryGate(sample_rate=0.0)
+
+        admitted, outcome = gate.admit([error(), error(severity="high", message="boom")], dedupe=True)
+
+        assert [document["severity"] for document in admitted] == ["high"]
+        assert outcome["sampled_out"] == 1
+        sessions = [f"session-{i}" for i in range(2000)]
+        kept = sum(session_sampled(session_id, 0.25) for session_id in sessions)
+        assert 400 < kept < 600
+        assert all(session_sampled(session_id, 0.25) == session_sampled(session_id, 0.25) for session_id in sessions[:50])
+
+    def test_session_and_global_caps(self):
+        gate = TelemetryGate(session_limit=2, global_limit=3)
+
+        admitted, outcome = gate.admit([{"session_id": "a"} for _ in range(5)])
+        assert len(admitted) == 2
+        assert outcome["rate_limited"] == 3
+
+        admitted, outcome = gate.admit([{"session_id": "b"}, {"session_id": "c"}])
+        assert len(admitted) == 1
+        assert gate.status()["rate_limited"] == 4
+
+
+class TestTelemetryEndpoints:
+    """Test the ingestion endpoints the frontend monitors post to"""
+
+    def test_error_batch_accepts_send_beacon_text_plain(self):
+        payload = {
+            "errors": [
+                {"type": "javascript_error", "message": "x is undefined", "filename": "main.js", "lineno": 10,
+                 "severity": "high", "timestamp": 1714567890123, "session_id": "beacon-session"},
+                {"type": "javascript_error", "message": "x is undefined", "filename": "main.js", "lineno": 10,
+                 "severity": "high", "timestamp": 1714567890456, "session_id": "beacon-session"},
+            ],
+            "session_id": "beacon-session",
+            "page_url": "https://trustml.example/",
+            "user_agent": "Mozilla/5.0",
+        }
+
+        with patch('server.db') as mock_db, \
+             patch('server.client_error_gate', TelemetryGate(dedup_window=60)):
+            mock_db.__getitem__.side_effect = lambda name: getattr(mock_db, name)
+            mock_db.client_errors.insert_many = AsyncMock()
+
+            response = client.post("/api/errors/batch", content=orjson.dumps(payload),
+                                   headers={"Content-Type": "text/plain;charset=UTF-8"})
+
+            assert response.status_code == 200
+            assert response.json()["stored"] == 1
+            assert response.json()["duplicates"] == 1
+            stored = mock_db.client_errors.insert_many.call_args.args[0]
+            assert stored[0]["occurrences"] == 2
+            assert stored[0]["details"] == {"filename": "main.js", "lineno": 10}
+            assert stored[0]["client_timestamp"].year == 2024
+
+    def test_performance_beacon_is_sampled_and_stored(self):
+        beacon = {"type": "navigation_timing", "data": {"dns_time": 12}, "timestamp": 1714567890123,
+                  "url": "https://trustml.example/", "session_id": "perf-session"}
+
+        with patch('server.db') as mock_db, \
+             patch('server.performance_gate', TelemetryGate(sample_rate=1.0)):
+            mock_db.__getitem__.side_effect = lambda name: getattr(mock_db, name)
+            mock_db.performance_metrics.insert_many = AsyncMock()
+
+            response = client.post("/api/analytics/performance", content=orjson.dumps(beacon),
+                                   headers={"Content-Type": "text/plain"})
+
+            assert response.status_code == 200
+            stored = mock_db.performance_metrics.insert_many.call_args.args[0]
+            assert stored[0]["type"] == "navigation_timing"
+            assert stored[0]["data"] == {"dns_time": 12}
+
+    def test_rejects_malformed_and_oversized_beacons(self):
+        response = client.post("/api/analytics/performance", content=b"not json", headers={"Content-Type": "text/plain"})
+        assert response.status_code == 400
+
+        oversized = b"[" + b"0," * client_telemetry.MAX_BEACON_BYTES + b"0]"
+        response = client.post("/api/errors/batch", content=oversized, headers={"Content-Type": "text/plain"})
+        assert response.status_code == 413
+
+    def test_stops_reading_a_chunked_body_at_the_limit(self):
+        chunks_read = []
+
+        async def stream():
+            for index in range(100):
+                chunks_read.append(index)
+                yield b" " * 4096
+
+        # A chunked body has no Content-Length to check up front
+        request = SimpleNamespace(headers={}, stream=stream)
+        with pytest.raises(client_telemetry.BeaconTooLarge):
+            asyncio.run(client_telemetry.read_beacon_body(request))
+
+        assert len(chunks_read) == client_telemetry.MAX_BEACON_BYTES // 4096 + 1
+
+    def test_rejects_a_declared_length_over_the_limit_before_reading(self):
+        with patch('client_telemetry.parse_beacon') as parse:
+            response = client.post("/api/analytics/performance", content=b"{}", headers={
+                "Content-Type": "text/plain", "Content-Length": str(client_telemetry.MAX_BEACON_BYTES + 1),
+            })
+
+        assert response.status_code == 413
+        parse.assert_not_called()
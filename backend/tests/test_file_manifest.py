@@ -0,0 +1,85 @@
+"""
+Tests for the downloadable file manifest
+"""
+
+import asyncio
+import hashlib
+import os
+from unittest.mock import AsyncMock, MagicMock
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from file_manifest import FileManifest, load_entry, sync_resource_file_sizes
+
+
+def write_file(root, relative_path, content):
+    path = root / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+class TestFileManifest:
+    """Test manifest building, refresh and size sync"""
+
+    def test_scan_records_size_hash_and_content_type(self, tmp_path):
+        write_file(tmp_path, "guides/playbook.pdf", b"%PDF-1.4 playbook")
+        write_file(tmp_path, "data/blob", b"%PDF-1.7 no extension")
+
+        manifest = FileManifest(tmp_path)
+        result = manifest.scan()
+
+        assert result == {"files": 2, "added": 2, "changed": 0, "removed": 0}
+        entry = manifest.get("guides/playbook.pdf")
+        assert entry.size == len(b"%PDF-1.4 playbook")
+        assert entry.sha256 == hashlib.sha256(b"%PDF-1.4 playbook").hexdigest()
+        assert entry.content_type == "application/pdf"
+        assert entry.etag == f'"{entry.sha256[:32]}"'
+        # Sniffed from the magic bytes
+        assert manifest.get("data/blob").content_type == "application/pdf"
+
+    def test_rescan_detects_changes_and_removals(self, tmp_path):
+        path = write_file(tmp_path, "a.pdf", b"one")
+        write_file(tmp_path, "b.pdf", b"two")
+        manifest = FileManifest(tmp_path)
+        manifest.scan()
+
+        path.write_bytes(b"changed content")
+        os.utime(path, ns=(1, 1))
+        (tmp_path / "b.pdf").unlink()
+        write_file(tmp_path, "c.pdf", b"three")
+
+        result = manifest.scan()
+
+        assert result == {"files": 2, "added": 1, "changed": 1, "removed": 1}
+        assert manifest.get("a.pdf").size == len(b"changed content")
+        assert manifest.get("b.pdf") is None
+
+    def test_load_entry_rejects_paths_outside_root(self, tmp_path):
+        root = tmp_path / "resources"
+        root.mkdir()
+        write_file(tmp_path, "secret.txt", b"secret")
+
+        assert load_entry(root, "../secret.txt") is None
+        assert load_entry(root, "missing.pdf") is None
+
+    def test_sync_resource_file_sizes(self, tmp_path):
+        write_file(tmp_path, "guides/playbook.pdf", b"12345")
+        manifest = FileManifest(tmp_path)
+        manifest.scan()
+
+        db = MagicMock()
+        db.resources.find.return_value.to_list = AsyncMock(return_value=[
+            {"id": "r1", "file_path": "guides/playbook.pdf", "file_size": 2560000},
+            {"id": "r2", "file_path": "guides/playbook.pdf", "file_size": 5},
+            {"id": "r3", "file_path": "missing.pdf", "file_size": 100},
+        ])
+        db.resources.update_one = AsyncMock()
+
+        updated = asyncio.run(sync_resource_file_sizes(db, manifest))
+
+        assert updated == 1
+        query, update = db.resources.update_one.call_args.args
+        assert query == {"id": "r1"}
+        assert update["$set"]["file_size"] == 5
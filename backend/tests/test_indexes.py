@@ -0,0 +1,88 @@
+"""
+Tests for the index registry and query-shape report
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from pymongo.errors import OperationFailure
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import indexes
+from tests.fakes import FakeDB
+
+
+class TestEnsureIndexes:
+    """Test idempotent application of the registry"""
+
+    def test_creates_registry_indexes_for_every_collection(self):
+        db = FakeDB()
+
+        report = asyncio.run(indexes.ensure_indexes(db))
+
+        assert set(report["created"]) == set(indexes.INDEXES)
+        assert report["errors"] == {}
+        keys = [list(index["key"].items()) for index in db["link_interactions"].indexes]
+        assert [("link_category", 1), ("timestamp", -1)] in keys
+
+    def test_conflicting_index_does_not_block_the_rest(self):
+        db = FakeDB()
+
+        def create(models):
+            if len(models) > 1 or models[0].document.get("unique"):
+                raise OperationFailure("E11000 duplicate key")
+            return ["ok"]
+
+        db["contact_forms"].create_indexes = AsyncMock(side_effect=create)
+
+        report = asyncio.run(indexes.ensure_indexes(db))
+
+        assert report["created"]["contact_forms"] == ["ok"]
+        assert len(report["errors"]["contact_forms"]) == 1
+
+
+class TestQueryShapeReport:
+    """Test collection-scan detection from explain output"""
+
+    def test_flags_collection_scans_and_blocking_sorts(self):
+        plans = {
+            "resource_by_id": {"queryPlanner": {
+                "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                "rejectedPlans": [{"stage": "COLLSCAN"}],
+            }},
+            "recent_interactions": {"queryPlanner": {
+                "winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+            }},
+        }
+
+        async def command(cmd):
+            explained = cmd["explain"]
+            for shape in indexes.QUERY_SHAPES:
+                if shape["collection"] == explained.get("find", explained.get("aggregate")) and (
+                    explained.get("filter") == shape.get("filter") or "pipeline" in shape
+                ):
+                    return plans.get(shape["name"], {"queryPlanner": {"winningPlan": {"stage": "IXSCAN"}}})
+            return {"queryPlanner": {"winningPlan": {"stage": "IXSCAN"}}}
+
+        db = MagicMock()
+        db.command = AsyncMock(side_effect=command)
+
+        results = {result["name"]: result for result in asyncio.run(indexes.explain_query_shapes(db))}
+
+        assert results["resource_by_id"]["collection_scan"] is False
+        assert results["recent_interactions"]["collection_scan"] is True
+        assert results["recent_interactions"]["in_memory_sort"] is True
+        assert len(results) == len(indexes.QUERY_SHAPES)
+
+    def test_every_query_shape_leads_with_an_indexed_field(self):
+        for shape in indexes.QUERY_SHAPES:
+            if "pipeline" in shape:
+                continue
+            leading_keys = {"_id"} | {
+                next(iter(model.document["key"])) for model in indexes.INDEXES.get(shape["collection"], [])
+            }
+            queried = [field for field in shape["filter"] if not field.startswith("$")] + list(shape.get("sort", {}))
+
+            assert leading_keys & set(queried), f"{shape['name']} has no index on {queried}"
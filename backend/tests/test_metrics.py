@@ -0,0 +1,94 @@
+"""
+Tests for the Prometheus metrics registry and instrumentation
+"""
+
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import metrics
+from metrics import Histogram, MetricsRegistry, MongoCommandMetrics, MongoPoolMetrics
+from server import app
+
+client = TestClient(app)
+
+
+class TestExposition:
+    """Test rendering in the Prometheus text format"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("op_seconds", "Op latency", ("op",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, "find")
+
+        lines = histogram.render()
+
+        assert 'op_seconds_bucket{op="find",le="0.1"} 1' in lines
+        assert 'op_seconds_bucket{op="find",le="1.0"} 3' in lines
+        assert 'op_seconds_bucket{op="find",le="+Inf"} 4' in lines
+        assert 'op_seconds_count{op="find"} 4' in lines
+        assert 'op_seconds_sum{op="find"} 4.05' in lines
+
+    def test_label_values_are_escaped(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("errors_total", "Errors", ("message",))
+        counter.inc('bad "quote"\n')
+
+        assert 'errors_total{message="bad \\"quote\\"\\n"} 1' in registry.render()
+
+
+class TestInstrumentation:
+    """Test request and MongoDB instrumentation"""
+
+    def test_requests_are_recorded_per_route_template(self):
+        before = metrics.http_requests.value("GET", "/api/", "200")
+
+        client.get("/api/")
+        client.get("/api/no-such-route")
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert metrics.http_requests.value("GET", "/api/", "200") == before + 1
+        assert metrics.http_requests.value("GET", metrics.UNMATCHED_ROUTE, "404") >= 1
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/api/",le="+Inf"}' in response.text
+
+    def test_mongo_commands_are_timed_per_collection(self):
+        listener = MongoCommandMetrics()
+        started = SimpleNamespace(
+            command_name="find", command={"find": "resources", "filter": {}},
+            request_id=1, connection_id=("localhost", 27017), database_name="trustml_db",
+        )
+        succeeded = SimpleNamespace(
+            command_name="find", request_id=1, connection_id=("localhost", 27017),
+            database_name="trustml_db", duration_micros=2500,
+        )
+        before = metrics.mongo_command_duration.count("resources", "find")
+
+        listener.started(started)
+        listener.succeeded(succeeded)
+
+        assert metrics.mongo_command_duration.count("resources", "find") == before + 1
+        assert metrics.mongo_commands.value("resources", "find", "success") >= 1
+
+    def test_pool_checkout_wait_and_saturation(self):
+        listener = MongoPoolMetrics(max_pool_size=4)
+        event = SimpleNamespace(address=("pool-test", 27017), connection_id=1)
+
+        listener.connection_created(event)
+        listener.connection_check_out_started(event)
+        assert metrics.mongo_pool_wait_queue.value("pool-test:27017") == 1
+        listener.connection_checked_out(event)
+
+        stats = metrics.pool_stats()["pool-test:27017"]
+        assert stats["connections"] == 1
+        assert stats["checked_out"] == 1
+        assert stats["wait_queue"] == 0
+        assert stats["saturation"] == 0.25
+        assert stats["checkouts"] == 1
+
+        listener.connection_checked_in(event)
+        assert metrics.pool_stats()["pool-test:27017"]["saturation"] == 0
@@ -0,0 +1,102 @@
+"""
+Tests for token-bucket rate limiting
+"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from rate_limits import Limit, LocalBuckets, RateLimiter, client_ip, load_limits, parse_limit
+from server import app
+
+client = TestClient(app)
+
+
+class TestLimits:
+    """Test limit parsing and client identification"""
+
+    def test_parse_and_override_limits(self):
+        assert parse_limit("120/minute") == Limit(burst=120, rate=2.0)
+        assert parse_limit("off") is None
+
+        limits = load_limits({"RATE_LIMIT_CONTACT": "4/hour", "RATE_LIMIT_TRACK": "off,10/second"})
+
+        assert limits["contact"] == (Limit(burst=4, rate=4 / 3600), None)
+        assert limits["track"] == (None, Limit(burst=10, rate=10))
+        assert limits["status"][0] == Limit(burst=30, rate=0.5)
+
+    def test_client_ip_counts_trusted_proxies_from_the_right(self):
+        request = SimpleNamespace(
+            headers={"x-forwarded-for": "1.1.1.1, 203.0.113.7"}, client=SimpleNamespace(host="10.0.0.2")
+        )
+
+        assert client_ip(request) == "10.0.0.2"
+        assert client_ip(request, proxy_hops=1) == "203.0.113.7"
+
+
+class TestTokenBuckets:
+    """Test bursts, refill and per-worker shares"""
+
+    def test_bucket_allows_burst_then_refills(self):
+        buckets = LocalBuckets()
+        limit = Limit(burst=2, rate=1.0)
+
+        assert buckets.take("k", limit, now=0.0) == 0
+        assert buckets.take("k", limit, now=0.0) == 0
+        assert buckets.take("k", limit, now=0.0) == 1.0
+        assert buckets.take("k", limit, now=0.5) == 0.5
+        assert buckets.take("k", limit, now=1.0) == 0
+
+    def test_ip_and_session_buckets_with_worker_share(self):
+        limiter = RateLimiter({"contact": (Limit(burst=10, rate=0.1), Limit(burst=2, rate=0.01))}, workers=2)
+
+        async def scenario():
+            return [await limiter.check("contact", "1.2.3.4", "s1") for _ in range(2)] + [
+                await limiter.check("contact", "1.2.3.4", "s2"),
+            ]
+
+        first, second, other_session = asyncio.run(scenario())
+
+        # Half of a burst of 2 per worker
+        assert first == 0 and second > 0
+        assert other_session == 0
+        assert limiter.status()["rejected"] == {"contact": 1}
+
+    def test_shared_backend_rejects_and_fails_open(self):
+        limiter = RateLimiter({"track": (Limit(burst=5, rate=1.0), None)}, backend="mongo")
+        collection = MagicMock()
+        collection.find_one_and_update = AsyncMock(return_value={"allowed": False, "tokens": 0.25})
+        limiter.db = MagicMock()
+        limiter.db.__getitem__.return_value = collection
+
+        assert asyncio.run(limiter.check("track", "1.2.3.4")) == 0.75
+
+        collection.find_one_and_update = AsyncMock(side_effect=Exception("no primary"))
+        assert asyncio.run(limiter.check("track", "1.2.3.4")) == 0
+        assert limiter.shared_errors == 1
+
+
+class TestRateLimitedEndpoints:
+    """Test 429 responses on the write endpoints"""
+
+    def test_link_click_returns_429_with_retry_after(self):
+        limiter = RateLimiter(load_limits({"RATE_LIMIT_LINK_CLICK": "100/minute,1/minute"}))
+
+        with patch('server.db') as mock_db, \
+             patch('server.rate_limiter', limiter):
+            mock_db.__getitem__.side_effect = lambda name: getattr(mock_db, name)
+            mock_db.link_interactions.insert_one = AsyncMock()
+            mock_db.analytics_rollups.bulk_write = AsyncMock()
+            payload = {"session_id": "bot", "link_id": "x", "link_category": "navigation"}
+
+            assert client.post("/api/analytics/link-click", json=payload).status_code == 200
+            response = client.post("/api/analytics/link-click", json=payload)
+
+            assert response.status_code == 429
+            assert response.headers["retry-after"] == "60"
+            assert mock_db.link_interactions.insert_one.await_count == 1
@@ -0,0 +1,168 @@
+"""
+Tests for retention TTL indexes and event archival
+"""
+
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import retention
+from leases import acquire_lease
+from retention import RetentionArchiver, RetentionPolicy
+from tests.fakes import FakeCollection, FakeDB
+
+
+def read_archive(path):
+    with gzip.open(path, "rt") as file:
+        return [json.loads(line) for line in file]
+
+
+class TestPolicies:
+    """Test retention configuration"""
+
+    def test_unset_or_zero_retention_keeps_collection_forever(self):
+        policies = retention.load_policies({
+            "ANALYTICS_EVENTS_RETENTION_DAYS": "90",
+            "LINK_INTERACTIONS_RETENTION_DAYS": "0",
+        })
+
+        assert policies == [RetentionPolicy("analytics_events", 90)]
+        assert policies[0].expire_after_seconds == 90 * 86400
+
+    def test_retained_since_is_the_latest_cutoff_of_the_collections(self):
+        policies = [RetentionPolicy("analytics_events", 90), RetentionPolicy("resource_downloads", 30)]
+        now = datetime(2024, 6, 1)
+
+        assert retention.retained_since(policies, ["analytics_events", "resource_downloads"], now) == datetime(2024, 5, 2)
+        assert retention.retained_since(policies, ["analytics_events"], now) == datetime(2024, 3, 3)
+        assert retention.retained_since(policies, ["performance_metrics"], now) is None
+
+
+class TestTTLIndexes:
+    """Test creating and adjusting TTL indexes"""
+
+    def test_creates_missing_and_converts_existing_timestamp_index(self):
+        db = FakeDB()
+        db["resource_downloads"].indexes.append({"name": "timestamp_1", "key": {"timestamp": 1}})
+        db.command = AsyncMock()
+
+        results = asyncio.run(retention.apply_ttl_indexes(db, [
+            RetentionPolicy("analytics_events", 30),
+            RetentionPolicy("resource_downloads", 365),
+        ]))
+
+        assert results == {"analytics_events": "created", "resource_downloads": "updated"}
+        assert db["analytics_events"].indexes == [
+            {"name": "timestamp_1", "key": {"timestamp": 1}, "expireAfterSeconds": 30 * 86400}
+        ]
+        db.command.assert_awaited_once_with({
+            "collMod": "resource_downloads",
+            "index": {"name": "timestamp_1", "expireAfterSeconds": 365 * 86400},
+        })
+
+
+class TestArchiver:
+    """Test exporting events before they expire"""
+
+    def test_archives_events_past_cutoff_once(self, tmp_path):
+        now = datetime(2024, 3, 31, 12)
+        documents = [
+            {"id": "old-1", "timestamp": datetime(2024, 3, 1, 8)},
+            {"id": "old-2", "timestamp": datetime(2024, 3, 1, 9)},
+            {"id": "old-3", "timestamp": datetime(2024, 3, 2, 10)},
+            {"id": "recent", "timestamp": now - timedelta(days=1)},
+        ]
+        db = FakeDB(link_interactions=FakeCollection(documents))
+        archiver = RetentionArchiver(db, [RetentionPolicy("link_interactions", 30)], tmp_path, lead_days=2)
+
+        first = asyncio.run(archiver.run_once(now))
+        second = asyncio.run(archiver.run_once(now + timedelta(hours=1)))
+
+        assert first == {"link_interactions": 3}
+        assert second == {"link_interactions": 0}
+        archived = read_archive(tmp_path / "link_interactions" / "19700101T000000-20240303T120000.ndjson.gz")
+        assert [doc["id"] for doc in archived] == ["old-1", "old-2", "old-3"]
+        assert len(list((tmp_path / "link_interactions").iterdir())) == 1
+
+    def test_later_runs_write_one_file_per_range(self, tmp_path):
+        documents = [
+            {"id": "a", "timestamp": datetime(2024, 3, 1, 8)},
+            {"id": "b", "timestamp": datetime(2024, 3, 1, 20)},
+        ]
+        db = FakeDB(analytics_events=FakeCollection(documents))
+        archiver = RetentionArchiver(db, [RetentionPolicy("analytics_events", 10)], tmp_path, lead_days=1)
+
+        asyncio.run(archiver.run_once(datetime(2024, 3, 10, 12)))
+        asyncio.run(archiver.run_once(datetime(2024, 3, 11, 0)))
+
+        first = read_archive(tmp_path / "analytics_events" / "19700101T000000-20240301T120000.ndjson.gz")
+        second = read_archive(tmp_path / "analytics_events" / "20240301T120000-20240302T000000.ndjson.gz")
+        assert [doc["id"] for doc in first + second] == ["a", "b"]
+
+    def test_interrupted_run_rewrites_the_same_range(self, tmp_path):
+        documents = [{"id": "a", "timestamp": datetime(2024, 3, 1, 8)}]
+        db = FakeDB(analytics_events=FakeCollection(documents))
+        archiver = RetentionArchiver(db, [RetentionPolicy("analytics_events", 10)], tmp_path, lead_days=1)
+        state = db[retention.ARCHIVE_STATE_COLLECTION]
+        update_one = state.update_one
+
+        async def fail_to_advance(query, update, upsert=False):
+            if "$unset" in update:
+                raise ConnectionError("connection reset")
+            return await update_one(query, update, upsert)
+
+        state.update_one = fail_to_advance
+        interrupted = asyncio.run(archiver.run_once(datetime(2024, 3, 10, 12)))
+        state.update_one = update_one
+        finished = asyncio.run(archiver.run_once(datetime(2024, 3, 10, 18)))
+
+        assert interrupted == {"analytics_events": 0}
+        assert finished == {"analytics_events": 1}
+        files = list((tmp_path / "analytics_events").iterdir())
+        assert [path.name for path in files] == ["19700101T000000-20240301T120000.ndjson.gz"]
+        assert [doc["id"] for doc in read_archive(files[0])] == ["a"]
+        stored = asyncio.run(state.find_one({"_id": "analytics_events"}))
+        assert stored["archived_until"] == datetime(2024, 3, 1, 12)
+        assert "pending_until" not in stored
+
+    def test_collection_leased_by_another_worker_is_skipped(self, tmp_path):
+        documents = [{"id": "a", "timestamp": datetime(2024, 3, 1, 8)}]
+        db = FakeDB(analytics_events=FakeCollection(documents))
+        policies = [RetentionPolicy("analytics_events", 10)]
+        holder = RetentionArchiver(db, policies, tmp_path, lead_days=1)
+        other = RetentionArchiver(db, policies, tmp_path, lead_days=1)
+        state = db[retention.ARCHIVE_STATE_COLLECTION]
+
+        async def scenario():
+            await acquire_lease(state, "analytics_events", holder.owner, 600)
+            return await other.run_once(datetime(2024, 3, 10, 12))
+
+        assert asyncio.run(scenario()) == {"analytics_events": 0}
+        assert other.last_run["skipped"] == ["analytics_events"]
+        assert not (tmp_path / "analytics_events").exists()
+
+    def test_loop_survives_a_failing_run(self, tmp_path, caplog):
+        archiver = RetentionArchiver(FakeDB(), [RetentionPolicy("analytics_events", 10)], tmp_path, interval=0)
+        calls = []
+
+        async def run_once(now=None):
+            calls.append(now)
+            if len(calls) == 1:
+                raise RuntimeError("connection reset")
+            if len(calls) == 3:
+                raise asyncio.CancelledError
+
+        archiver.run_once = run_once
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(archiver._run())
+
+        assert len(calls) == 3
+        assert "Retention archiving failed" in caplog.text
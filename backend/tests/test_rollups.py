@@ -0,0 +1,218 @@
+"""
+Tests for analytics rollup maintenance
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import rollups
+from rollups import (
+    ROLLUP_COLLECTION, TOTALS_ID,
+    RollupBootstrap, bootstrap_rollups, build_rollup_operations, get_download_trend, rebuild_rollups,
+)
+from rebuilds import STATE_COLLECTION, staging_name
+from tests.fakes import FakeDB, record_operations
+
+
+@pytest.fixture(autouse=True)
+def recorded_operations(monkeypatch):
+    record_operations(monkeypatch, rollups)
+
+
+def updates_by_id(operations):
+    return {op.filter["_id"]: op.update for op in operations}
+
+
+class TestBuildRollupOperations:
+    """Test folding raw documents into rollup upserts"""
+
+    def test_downloads_fold_into_totals_resource_and_hour(self):
+        timestamp = datetime(2024, 5, 1, 13, 45, 10)
+        documents = [
+            {"resource_id": "r1", "timestamp": timestamp},
+            {"resource_id": "r1", "timestamp": timestamp.replace(minute=50)},
+            {"resource_id": "r2", "timestamp": timestamp},
+        ]
+
+        updates = updates_by_id(build_rollup_operations("resource_downloads", documents))
+
+        assert updates[TOTALS_ID]["$inc"] == {"downloads": 3}
+        assert updates["resource:r1"]["$inc"] == {"downloads": 2}
+        assert updates["resource:r1"]["$max"] == {"last_download_at": timestamp.replace(minute=50)}
+        hour = updates["hour:2024-05-01T13"]
+        assert hour["$inc"] == {
+            "downloads": 3,
+            "downloads_by_resource.r1": 2,
+            "downloads_by_resource.r2": 1,
+            "downloads_by_category.unknown": 3,
+        }
+        assert hour["$setOnInsert"] == {"kind": "hour", "bucket": datetime(2024, 5, 1, 13)}
+
+    def test_downloads_fold_into_their_denormalized_category(self):
+        documents = [
+            {"resource_id": "r1", "resource_category": "white-paper", "timestamp": datetime(2024, 5, 1, 9)},
+            {"resource_id": "r2", "resource_category": "white-paper", "timestamp": datetime(2024, 5, 1, 9)},
+            {"resource_id": "r3", "timestamp": datetime(2024, 5, 1, 9)},
+        ]
+
+        updates = updates_by_id(build_rollup_operations("resource_downloads", documents))
+
+        assert updates["download_category:white-paper"]["$inc"] == {"downloads": 2}
+        assert updates["download_category:white-paper"]["$setOnInsert"] == {
+            "kind": "download_category", "key": "white-paper"
+        }
+        # Records written before the category was denormalized are left to the backfill
+        assert [rollup_id for rollup_id in updates if rollup_id.startswith("download_category:")] == [
+            "download_category:white-paper"
+        ]
+
+    def test_interactions_fold_into_categories(self):
+        documents = [
+            {"link_category": "download", "timestamp": datetime(2024, 5, 1, 9)},
+            {"link_category": "nav.main", "timestamp": datetime(2024, 5, 1, 10)},
+        ]
+
+        updates = updates_by_id(build_rollup_operations("link_interactions", documents))
+
+        assert updates[TOTALS_ID]["$inc"] == {"interactions": 2}
+        assert updates["link_category:download"]["$inc"] == {"interactions": 1}
+        assert updates["link_category:nav.main"]["$setOnInsert"] == {"kind": "link_category", "key": "nav.main"}
+        # Dots in user-supplied keys must not create nested paths
+        assert updates["hour:2024-05-01T10"]["$inc"]["interactions_by_category.nav_main"] == 1
+
+    def test_events_fold_into_event_types(self):
+        documents = [{"event_type": "page_view", "timestamp": datetime(2024, 5, 1, 9)}]
+
+        updates = updates_by_id(build_rollup_operations("analytics_events", documents))
+
+        assert updates[TOTALS_ID]["$inc"] == {"events": 1}
+        assert updates["hour:2024-05-01T09"]["$inc"]["events_by_type.page_view"] == 1
+
+    def test_unknown_collection_is_ignored(self):
+        assert build_rollup_operations("contact_forms", [{"id": "1"}]) == []
+
+
+def downloads_db():
+    db = FakeDB()
+    db["resource_downloads"].documents = [
+        {"resource_id": "r1", "resource_category": "guides", "timestamp": datetime(2024, 5, 1, 9)},
+        {"resource_id": "r2", "resource_category": "tools", "timestamp": datetime(2024, 5, 1, 10)},
+    ]
+    return db
+
+
+def rollup(db, rollup_id):
+    return next((document for document in db[ROLLUP_COLLECTION].documents if document["_id"] == rollup_id), None)
+
+
+class TestRebuildRollups:
+    """Test rebuilding the rollups from the raw collections"""
+
+    def test_rebuild_swaps_in_a_complete_collection(self):
+        db = downloads_db()
+        db[ROLLUP_COLLECTION].documents = [{"_id": TOTALS_ID, "downloads": 99}, {"_id": "resource:gone", "downloads": 5}]
+        seen_during_rebuild = []
+        find = db["link_interactions"].find
+
+        def observe_live_rollups(*args):
+            # Readers keep the old counts until the swap
+            seen_during_rebuild.append(rollup(db, TOTALS_ID)["downloads"])
+            return find(*args)
+
+        db["link_interactions"].find = observe_live_rollups
+
+        processed = asyncio.run(rebuild_rollups(db))
+
+        assert processed == {"resource_downloads": 2, "link_interactions": 0, "analytics_events": 0}
+        assert seen_during_rebuild == [99]
+        assert rollup(db, TOTALS_ID)["downloads"] == 2
+        assert rollup(db, "resource:gone") is None
+        assert db[staging_name(ROLLUP_COLLECTION)].documents == []
+        assert {index["name"] for index in db[ROLLUP_COLLECTION].indexes} >= {"kind_1_bucket_1"}
+
+    def test_rebuild_skips_while_another_process_holds_the_lease(self):
+        db = downloads_db()
+        db[STATE_COLLECTION].documents = [
+            {"_id": ROLLUP_COLLECTION, "lease_owner": "other", "lease_until": datetime.utcnow() + timedelta(minutes=5)},
+        ]
+
+        assert asyncio.run(rebuild_rollups(db)) is None
+        assert db[ROLLUP_COLLECTION].documents == []
+
+
+class TestBootstrapRollups:
+    """Test building the rollups for data that predates them"""
+
+    def test_bootstraps_when_the_rollups_are_empty(self):
+        db = downloads_db()
+
+        processed = asyncio.run(bootstrap_rollups(db))
+
+        assert processed["resource_downloads"] == 2
+        assert rollup(db, "download_category:guides")["downloads"] == 1
+
+    def test_service_start_returns_before_the_rollups_are_built(self):
+        db = downloads_db()
+        bootstrap = RollupBootstrap(db)
+
+        async def scenario():
+            await bootstrap.start()
+            built_at_start = rollup(db, TOTALS_ID)
+            running_at_start = bootstrap.running
+            await bootstrap._task
+            return built_at_start, running_at_start
+
+        built_at_start, running_at_start = asyncio.run(scenario())
+
+        assert built_at_start is None and running_at_start
+        assert bootstrap.result["resource_downloads"] == 2
+        assert rollup(db, TOTALS_ID)["downloads"] == 2
+
+    def test_service_logs_failures_instead_of_raising(self, caplog):
+        db = downloads_db()
+
+        def fail(*args):
+            raise RuntimeError("connection reset")
+
+        db["resource_downloads"].find_one = fail
+        bootstrap = RollupBootstrap(db)
+
+        async def scenario():
+            await bootstrap.start()
+            await bootstrap._task
+
+        asyncio.run(scenario())
+
+        assert "Error bootstrapping analytics rollups" in caplog.text
+
+    def test_leaves_existing_rollups_and_empty_databases_alone(self):
+        db = downloads_db()
+        db[ROLLUP_COLLECTION].documents = [{"_id": TOTALS_ID, "downloads": 7}]
+
+        assert asyncio.run(bootstrap_rollups(db)) is None
+        assert asyncio.run(bootstrap_rollups(FakeDB())) is None
+        assert rollup(db, TOTALS_ID)["downloads"] == 7
+
+
+class TestDownloadTrend:
+    """Test reading download trends from the hourly rollups"""
+
+    def test_groups_by_the_category_stored_on_each_download(self):
+        db = downloads_db()
+        # r1 was recategorized after its first download
+        db["resource_downloads"].documents.append(
+            {"resource_id": "r1", "resource_category": "tools", "timestamp": datetime(2024, 5, 1, 11)}
+        )
+        asyncio.run(bootstrap_rollups(db))
+
+        trend = asyncio.run(get_download_trend(db, datetime(2024, 5, 1), datetime(2024, 5, 2), group_by="category"))
+
+        assert trend == [{"bucket": datetime(2024, 5, 1), "count": 3, "groups": {"guides": 1, "tools": 2}}]
+        with pytest.raises(ValueError):
+            asyncio.run(get_download_trend(db, datetime(2024, 5, 1), datetime(2024, 5, 2), group_by="category",
+                                           resource_id="r1"))
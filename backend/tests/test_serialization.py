@@ -0,0 +1,78 @@
+"""
+Tests for orjson rendering and trusted database responses
+"""
+
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+import orjson
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from starlette.responses import Response
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from serialization import dumps, project, projection, trusted_response
+from server import app, RecentInteraction, RESOURCE_PROJECTION
+
+client = TestClient(app)
+
+
+class TestSerialization:
+    """Test the orjson encoder"""
+
+    def test_datetimes_match_isoformat_and_object_ids_become_strings(self):
+        object_id = ObjectId()
+        timestamp = datetime(2024, 5, 1, 13, 45, 10, 123456)
+
+        decoded = orjson.loads(dumps({"_id": object_id, "timestamp": timestamp}))
+
+        assert decoded == {"_id": str(object_id), "timestamp": timestamp.isoformat()}
+
+    def test_trusted_response_keeps_headers_set_by_the_endpoint(self):
+        endpoint_response = Response()
+        del endpoint_response.headers["content-length"]
+        endpoint_response.headers["X-Next-Cursor"] = "abc"
+
+        response = trusted_response([{"id": "1"}], endpoint_response)
+
+        assert response.headers["x-next-cursor"] == "abc"
+        assert response.body == b'[{"id":"1"}]'
+
+    def test_projection_and_project_follow_the_model_fields(self):
+        assert projection(RecentInteraction) == {
+            "_id": 0, "id": 1, "link_id": 1, "link_category": 1, "action_type": 1, "session_id": 1, "timestamp": 1
+        }
+        cached = {"id": "1", "link_id": "l", "link_category": "docs", "action_type": "click", "ip_address": "10.0.0.1"}
+
+        assert project([cached], RecentInteraction) == [
+            {"id": "1", "link_id": "l", "link_category": "docs", "action_type": "click"}
+        ]
+
+
+class TestTrustedEndpoints:
+    """Test that resource documents are returned without model round-trips"""
+
+    def test_get_resource_returns_projected_document(self):
+        resource = {
+            "id": "resource-1",
+            "title": "Guide",
+            "description": "A guide",
+            "type": "pdf",
+            "category": "guides",
+            "file_path": "guides/guide.pdf",
+            "created_at": datetime(2024, 1, 1),
+            "updated_at": datetime(2024, 1, 2),
+            "download_count": 3,
+        }
+
+        with patch('server.db') as mock_db:
+            mock_db.resources.find_one = AsyncMock(return_value=resource)
+
+            response = client.get("/api/resources/resource-1")
+
+            assert response.status_code == 200
+            assert response.json()["updated_at"] == "2024-01-02T00:00:00"
+            assert mock_db.resources.find_one.call_args.args[1] == RESOURCE_PROJECTION
+            assert RESOURCE_PROJECTION["_id"] == 0
@@ -0,0 +1,150 @@
+"""
+Tests for session reconstruction and funnels
+"""
+
+import asyncio
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import server
+from server import app
+import sessionization
+from leases import acquire_lease
+from sessionization import SESSIONS_COLLECTION, Sessionizer, funnel, reached_steps, sessionize
+from tests.fakes import FakeCollection, FakeDB, record_operations
+
+client = TestClient(app)
+
+T0 = datetime(2024, 5, 1, 9, 0)
+TIMEOUT = timedelta(minutes=30)
+FRONTEND_DIR = Path(__file__).parents[2] / "frontend"
+
+
+@pytest.fixture(autouse=True)
+def recorded_operations(monkeypatch):
+    record_operations(monkeypatch, sessionization)
+
+
+def event(session_id, minutes, event_type):
+    return {"session_id": session_id, "timestamp": T0 + timedelta(minutes=minutes), "event_type": event_type}
+
+
+class TestSessionize:
+    """Test grouping events into sessions and matching funnel steps"""
+
+    def test_inactivity_splits_sessions_and_repeats_collapse(self):
+        events = [
+            {"session_id": "a", "timestamp": T0, "step": "page_load"},
+            {"session_id": "a", "timestamp": T0 + timedelta(minutes=1), "step": "page_load"},
+            {"session_id": "a", "timestamp": T0 + timedelta(minutes=5), "step": "scheduling_interaction"},
+            {"session_id": "a", "timestamp": T0 + timedelta(minutes=50), "step": "page_load"},
+        ]
+
+        summaries = sessionize(events, {}, TIMEOUT)
+
+        assert len(summaries) == 2
+        first, second = summaries
+        assert first["event_count"] == 3
+        assert [entry["step"] for entry in first["steps"]] == ["page_load", "scheduling_interaction"]
+        assert second["started_at"] == T0 + timedelta(minutes=50)
+
+    def test_steps_must_happen_in_order_and_within_the_limit(self):
+        steps = [{"step": name, "at": T0 + timedelta(minutes=minutes)}
+                 for name, minutes in [("scheduling_interaction", 0), ("page_load", 1), ("scheduling_interaction", 20)]]
+        funnel_steps = ["page_load", "scheduling_interaction", "contact_form_submission"]
+
+        assert reached_steps(steps, funnel_steps, None) == 2
+        assert reached_steps(steps, funnel_steps, timedelta(minutes=10)) == 1
+
+
+class TestSessionizer:
+    """Test incremental sessionization and funnels over the summaries"""
+
+    def test_incremental_runs_extend_open_sessions(self):
+        db = FakeDB()
+        db["analytics_events"] = FakeCollection([
+            event("a", 0, "page_load"), event("b", 0, "page_load"), event("b", 2, "scheduling_interaction"),
+            {"session_id": None, "timestamp": T0, "event_type": "page_load"},
+        ])
+        db["link_interactions"] = FakeCollection([
+            {"session_id": "a", "timestamp": T0 + timedelta(minutes=3), "link_id": "schedule-consultation"},
+        ])
+        sessionizer = Sessionizer(db, inactivity_timeout=1800, settle_lag=60, window=600)
+
+        async def scenario():
+            first = await sessionizer.run_once(now=T0 + timedelta(minutes=10))
+            # Arrives after the first run, continuing session b across the window boundary
+            db["analytics_events"].documents.append(event("b", 25, "contact_form_submission"))
+            db["analytics_events"].documents.append(event("c", 40, "page_load"))
+            second = await sessionizer.run_once(now=T0 + timedelta(hours=2))
+            result = await funnel(db, ["page_load", "scheduling_interaction", "contact_form_submission"],
+                                  T0 - timedelta(days=1), T0 + timedelta(days=1))
+            return first, second, result
+
+        first, second, result = asyncio.run(scenario())
+
+        assert first["events"] == 4
+        assert second["events"] == 2
+        sessions = {session["session_id"]: session for session in db[SESSIONS_COLLECTION].documents}
+        assert len(db[SESSIONS_COLLECTION].documents) == 3
+        assert [entry["step"] for entry in sessions["a"]["steps"]] == ["page_load", "link_click:schedule-consultation"]
+        assert sessions["b"]["event_count"] == 3
+        assert result["sessions"] == 3
+        assert [step["sessions"] for step in result["steps"]] == [3, 1, 1]
+        assert result["steps"][1]["conversion_from_previous"] == round(1 / 3, 4)
+
+    def test_replayed_window_is_not_counted_twice(self):
+        db = FakeDB()
+        db["analytics_events"] = FakeCollection([
+            event("a", 0, "page_load"), event("a", 2, "scheduling_interaction"), event("b", 5, "page_load"),
+        ])
+        sessionizer = Sessionizer(db, inactivity_timeout=1800, settle_lag=60, window=600)
+
+        async def scenario():
+            await sessionizer.run_once(now=T0 + timedelta(minutes=10))
+            # Crash after the summaries were written but before the watermark moved
+            await db[sessionization.STATE_COLLECTION].update_one(
+                {"_id": sessionization.STATE_ID}, {"$unset": {"processed_until": ""}}
+            )
+            return await sessionizer.run_once(now=T0 + timedelta(minutes=10))
+
+        replay = asyncio.run(scenario())
+
+        sessions = {session["session_id"]: session for session in db[SESSIONS_COLLECTION].documents}
+        assert replay["events"] == 3
+        assert len(sessions) == 2
+        assert sessions["a"]["event_count"] == 2
+        assert [entry["step"] for entry in sessions["a"]["steps"]] == ["page_load", "scheduling_interaction"]
+
+    def test_run_is_skipped_while_another_worker_holds_the_lease(self):
+        db = FakeDB()
+        db["analytics_events"] = FakeCollection([event("a", 0, "page_load")])
+        holder = Sessionizer(db, settle_lag=60)
+        other = Sessionizer(db, settle_lag=60)
+
+        async def scenario():
+            await acquire_lease(db[sessionization.STATE_COLLECTION], sessionization.STATE_ID, holder.owner, 600)
+            return await other.run_once(now=T0 + timedelta(minutes=10))
+
+        result = asyncio.run(scenario())
+
+        assert result["skipped"] is True
+        assert db[SESSIONS_COLLECTION].documents == []
+
+    def test_funnel_endpoint_rejects_single_step(self):
+        response = client.get("/api/analytics/funnel", params={"step": "page_load"})
+
+        assert response.status_code == 400
+
+    def test_default_funnel_uses_event_types_that_are_sent(self):
+        source = (FRONTEND_DIR / "src" / "utils" / "analyticsService.js").read_text()
+        # The last step is recorded by the contact endpoint itself
+        sent = set(re.findall(r"trackEvent\('([a-z_]+)'", source)) | {"contact_form_submission"}
+
+        assert set(server.DEFAULT_FUNNEL_STEPS) <= sent
@@ -0,0 +1,115 @@
+"""
+Tests for query-shape profiling and the slow-query log
+"""
+
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import server
+from slow_queries import QueryProfiler, fingerprint
+
+client = TestClient(server.app)
+
+
+def run_command(profiler, request_id, command_name, command, reply, duration_ms):
+    connection = ("localhost", 27017)
+    profiler.started(SimpleNamespace(
+        command_name=command_name, command=command, request_id=request_id,
+        connection_id=connection, database_name="trustml_db",
+    ))
+    profiler.succeeded(SimpleNamespace(
+        command_name=command_name, reply=reply, request_id=request_id,
+        connection_id=connection, database_name="trustml_db", duration_micros=int(duration_ms * 1000),
+    ))
+
+
+class TestFingerprint:
+    """Test query-shape redaction"""
+
+    def test_values_are_redacted_but_fields_operators_and_sort_kept(self):
+        first = fingerprint("find", "resource_downloads", {
+            "find": "resource_downloads",
+            "filter": {"resource_id": "abc", "timestamp": {"$gte": 1}},
+            "sort": {"timestamp": -1},
+            "limit": 10,
+        })
+        second = fingerprint("find", "resource_downloads", {
+            "find": "resource_downloads",
+            "filter": {"resource_id": "xyz", "timestamp": {"$gte": 2}},
+            "sort": {"timestamp": -1},
+            "limit": 50,
+        })
+
+        assert first == second
+        assert "abc" not in first
+        assert '"$gte": "?"' in first
+        assert '"timestamp": -1' in first
+
+    def test_pipeline_field_paths_are_kept(self):
+        shape = fingerprint("aggregate", "resource_downloads", {
+            "aggregate": "resource_downloads",
+            "pipeline": [
+                {"$match": {"resource_category": "$guides", "timestamp": {"$gte": 1}}},
+                {"$lookup": {"from": "resources", "localField": "resource_id", "foreignField": "id", "as": "resource"}},
+                {"$group": {"_id": {"category": "$resource_category", "day": {"$dayOfYear": "$timestamp"}},
+                            "count": {"$sum": 1}, "label": {"$concat": ["$resource_title", " - ", "$$ROOT.id"]}}},
+            ],
+        })
+
+        assert "guides" not in shape and " - " not in shape
+        assert '"category": "$resource_category"' in shape
+        assert '"$dayOfYear": "$timestamp"' in shape
+        assert '"$sum": "?"' in shape
+        assert '["$resource_title", "?", "$$ROOT.id"]' in shape
+        assert '"from": "resources"' in shape and '"as": "resource"' in shape
+
+
+class TestQueryProfiler:
+    """Test per-shape aggregation"""
+
+    def test_get_more_batches_count_toward_the_originating_find(self):
+        profiler = QueryProfiler(slow_threshold_ms=50)
+        find = {"find": "link_interactions", "filter": {"link_category": "download"}}
+
+        run_command(profiler, 1, "find", find, {"cursor": {"id": 99, "firstBatch": [{}] * 101}}, 10)
+        run_command(profiler, 2, "getMore", {"getMore": 99, "collection": "link_interactions"},
+                    {"cursor": {"id": 0, "nextBatch": [{}] * 40}}, 60)
+        run_command(profiler, 3, "find", {"find": "resources", "filter": {"id": "r1"}},
+                    {"cursor": {"id": 0, "firstBatch": [{}]}}, 1)
+
+        top = profiler.top_shapes(limit=1)
+        assert top[0]["collection"] == "link_interactions"
+        assert top[0]["count"] == 2
+        assert top[0]["documents_returned"] == 141
+        assert top[0]["total_ms"] == 70
+        assert top[0]["slow_count"] == 1
+        assert profiler.recent_slow()[0]["command"] == "getMore"
+
+    def test_handshake_commands_are_ignored(self):
+        profiler = QueryProfiler()
+
+        run_command(profiler, 1, "hello", {"hello": 1}, {"ok": 1}, 5)
+
+        assert profiler.top_shapes() == []
+
+
+class TestSlowQueriesEndpoint:
+    """Test the admin endpoint"""
+
+    def test_returns_top_shapes(self):
+        server.query_profiler.reset()
+        run_command(server.query_profiler, 1, "aggregate",
+                    {"aggregate": "resource_downloads", "pipeline": [{"$match": {"resource_id": "r1"}}]},
+                    {"cursor": {"id": 0, "firstBatch": [{}, {}]}}, 250)
+
+        response = client.get("/api/admin/slow-queries?limit=5")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["top_shapes"][0]["command"] == "aggregate"
+        assert data["top_shapes"][0]["documents_returned"] == 2
+        assert len(data["recent_slow"]) == 1
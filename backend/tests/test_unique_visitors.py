@@ -0,0 +1,166 @@
+"""
+Tests for HyperLogLog unique-session and unique-visitor counts
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import server
+from server import app
+import unique_visitors
+from rebuilds import STATE_COLLECTION
+from tests.fakes import FakeDB, record_operations
+from unique_visitors import (
+    HyperLogLog, REGISTERS, UNIQUE_COLLECTION, apply_unique_counts, build_sketches, get_unique_counts,
+    rebuild_unique_counts,
+)
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def recorded_operations(monkeypatch):
+    record_operations(monkeypatch, unique_visitors)
+
+
+def stored(db, sketch_id):
+    return next(document for document in db[UNIQUE_COLLECTION].documents if document["_id"] == sketch_id)
+
+
+def event(session_id, ip="10.0.0.1", timestamp=datetime(2024, 5, 1, 12), **extra):
+    return {"session_id": session_id, "ip_address": ip, "user_agent": "Mozilla/5.0", "timestamp": timestamp, **extra}
+
+
+class TestHyperLogLog:
+    """Test estimation accuracy and merging"""
+
+    def test_estimates_are_within_a_few_percent(self):
+        for cardinality in (100, 5000, 100000):
+            sketch = HyperLogLog()
+            for i in range(cardinality):
+                sketch.add(f"session-{i}")
+                sketch.add(f"session-{i}")
+
+            assert abs(sketch.count() - cardinality) <= cardinality * 0.05
+
+    def test_merge_counts_the_union_and_survives_binary_round_trip(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            first.add(f"v{i}")
+        for i in range(2000, 6000):
+            second.add(f"v{i}")
+
+        merged = HyperLogLog(bytes(first.to_binary()))
+        merged.merge(second)
+
+        assert len(first.to_binary()) == REGISTERS
+        assert abs(merged.count() - 6000) <= 6000 * 0.05
+
+
+class TestUniqueCountSketches:
+    """Test per-scope, per-day sketch maintenance and range queries"""
+
+    def test_documents_update_overall_and_scoped_sketches(self):
+        documents = [event("s1", resource_id="r1"), event("s2", ip=None, resource_id="r1"), event(None, ip=None)]
+
+        sketches = build_sketches("resource_downloads", documents)
+
+        assert set(sketches) == {"all|2024-05-01", "resource:r1|2024-05-01"}
+        assert sketches["resource:r1|2024-05-01"]["sessions"].count() == 2
+        assert sketches["resource:r1|2024-05-01"]["visitors"].count() == 1
+
+    def test_updates_merge_and_ranges_union_days(self):
+        db = FakeDB()
+        day = datetime(2024, 5, 1, 12)
+
+        async def scenario():
+            await apply_unique_counts(db, "analytics_events", [event(f"s{i}", ip=f"10.0.0.{i}") for i in range(50)])
+            await apply_unique_counts(db, "analytics_events", [event(f"s{i}", ip=f"10.0.0.{i}") for i in range(25, 75)])
+            await apply_unique_counts(db, "analytics_events", [
+                event(f"s{i}", timestamp=day + timedelta(days=1)) for i in range(60, 100)
+            ])
+            one_day = await get_unique_counts(db, day, day + timedelta(hours=1))
+            both_days = await get_unique_counts(db, day, day + timedelta(days=2))
+            return one_day, both_days
+
+        one_day, both_days = asyncio.run(scenario())
+
+        # Linear counting is near-exact at these cardinalities
+        assert abs(one_day["sessions"] - 75) <= 2 and abs(one_day["visitors"] - 75) <= 2
+        assert abs(both_days["sessions"] - 100) <= 2
+        assert stored(db, "all|2024-05-01")["version"] == 2
+
+    def test_conflicting_writer_falls_back_to_compare_and_set(self):
+        db = FakeDB()
+
+        async def scenario():
+            await apply_unique_counts(db, "analytics_events", [event("s1")])
+            collection = db[UNIQUE_COLLECTION]
+            original_find = collection.find
+
+            def find_then_race(query, projection=None):
+                # Another process merges between our read and our write
+                cursor = original_find(query, projection)
+                stored(db, "all|2024-05-01")["version"] += 1
+                return cursor
+
+            collection.find = find_then_race
+            await apply_unique_counts(db, "analytics_events", [event("s2")])
+            collection.find = original_find
+            return await get_unique_counts(db, datetime(2024, 5, 1), datetime(2024, 5, 2))
+
+        counts = asyncio.run(scenario())
+
+        assert counts["sessions"] == 2
+        assert stored(db, "all|2024-05-01")["version"] == 3
+
+    def test_rebuild_keeps_expired_days_and_recounts_the_retained_ones(self):
+        db = FakeDB()
+        old_day, current_day = datetime(2024, 4, 1, 12), datetime(2024, 5, 1, 12)
+        asyncio.run(apply_unique_counts(db, "analytics_events", [
+            *[event(f"old{i}", timestamp=old_day) for i in range(10)], event("stale", timestamp=current_day),
+        ]))
+        # Raw events from before the cutoff have expired
+        db["analytics_events"].documents = [event(f"s{i}", timestamp=current_day) for i in range(3)]
+
+        processed = asyncio.run(rebuild_unique_counts(db, retained_since=datetime(2024, 4, 15, 8)))
+
+        assert processed["analytics_events"] == 3
+        old = asyncio.run(get_unique_counts(db, datetime(2024, 4, 1), datetime(2024, 4, 2)))
+        current = asyncio.run(get_unique_counts(db, datetime(2024, 5, 1), datetime(2024, 5, 2)))
+        assert old["sessions"] == 10
+        assert current["sessions"] == 3
+
+    def test_rebuild_skips_while_another_process_holds_the_lease(self):
+        db = FakeDB()
+        asyncio.run(apply_unique_counts(db, "analytics_events", [event("s1")]))
+        db[STATE_COLLECTION].documents = [
+            {"_id": UNIQUE_COLLECTION, "lease_owner": "other", "lease_until": datetime.utcnow() + timedelta(minutes=5)},
+        ]
+
+        assert asyncio.run(rebuild_unique_counts(db)) is None
+        assert stored(db, "all|2024-05-01")["version"] == 1
+
+    def test_endpoint_accepts_the_longest_range_in_days(self, monkeypatch):
+        monkeypatch.setattr(server, "db", FakeDB())
+
+        response = client.get("/api/analytics/unique-visitors", params={
+            "days": unique_visitors.MAX_RANGE_DAYS, "end": "2024-05-01T15:30:00",
+        })
+
+        assert response.status_code == 200
+        # Whole days up to and including the one holding ``end``
+        assert response.json()["start"] == "2023-05-02T00:00:00"
+
+    def test_endpoint_rejects_two_scopes(self):
+        with patch('server.db'):
+            response = client.get("/api/analytics/unique-visitors", params={"resource_id": "r1", "link_category": "docs"})
+
+        assert response.status_code == 400
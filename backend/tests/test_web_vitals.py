@@ -0,0 +1,224 @@
+"""
+Tests for the web vitals percentile sketches
+"""
+
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+import client_telemetry
+import rollups
+import server
+from server import app
+import web_vitals
+from rebuilds import STATE_COLLECTION
+from tests.fakes import FakeDB, record_operations
+from web_vitals import (
+    DDSketch, RELATIVE_ACCURACY, SKETCH_COLLECTION, apply_sketches, normalize_page, query_percentiles, rebuild_sketches,
+)
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def recorded_operations(monkeypatch):
+    record_operations(monkeypatch, web_vitals, rollups)
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def store_sketches(documents, db=None):
+    """Fold performance documents into the sketches of an in-memory database"""
+    db = db if db is not None else FakeDB()
+    asyncio.run(apply_sketches(db, documents))
+    return db
+
+
+def stored(db, sketch_id):
+    return next(document for document in db[SKETCH_COLLECTION].documents if document["_id"] == sketch_id)
+
+
+class TestDDSketch:
+    """Test accuracy, merging and persistence of the sketch"""
+
+    def test_quantiles_are_within_the_relative_accuracy(self):
+        rng = random.Random(7)
+        values = [rng.lognormvariate(7.5, 0.6) for _ in range(20000)]
+        sketch = DDSketch()
+        for value in values:
+            sketch.add(value)
+
+        for q in (0.5, 0.75, 0.95, 0.99):
+            expected = exact_quantile(values, q)
+            assert abs(sketch.quantile(q) - expected) <= expected * RELATIVE_ACCURACY * 1.01
+
+    def test_merged_sketches_match_a_single_sketch(self):
+        rng = random.Random(3)
+        values = [rng.uniform(0, 0.5) for _ in range(5000)] + [0.0] * 100
+        whole, first, second = DDSketch(), DDSketch(), DDSketch()
+        for index, value in enumerate(values):
+            whole.add(value)
+            (first if index % 2 else second).add(value)
+
+        first.merge(DDSketch.from_document(second.to_document()))
+
+        assert first.count == whole.count
+        assert first.bins == whole.bins
+        assert first.quantile(0.95) == whole.quantile(0.95)
+        assert first.quantile(0.01) == 0.0
+
+    def test_bins_stay_bounded(self):
+        sketch = DDSketch()
+        for exponent in range(-8, 12):
+            for step in range(200):
+                sketch.add(10 ** exponent * (1 + step / 200))
+
+        assert len(sketch.bins) < 1300
+        assert sketch.max == 1e7
+
+
+class TestSketchOperations:
+    """Test folding performance beacons into sketch upserts"""
+
+    def test_web_vitals_fold_per_metric_page_and_day(self):
+        timestamp = datetime(2024, 5, 1, 13, 45)
+        documents = [
+            {"type": "web_vitals", "page_url": "https://trustml.example/resources/123?ref=x", "timestamp": timestamp,
+             "data": {"largest_contentful_paint": 2100, "cumulative_layout_shift": 0.05, "first_input_delay": None}},
+            {"type": "web_vitals", "page_url": "https://trustml.example/resources/456", "timestamp": timestamp,
+             "data": {"largest_contentful_paint": 2500}},
+            {"type": "resource_timing", "page_url": "https://trustml.example/", "timestamp": timestamp,
+             "data": {"type": "api", "duration": 180}},
+            {"type": "resource_timing", "page_url": "https://trustml.example/", "timestamp": timestamp,
+             "data": {"type": "image", "duration": 900}},
+        ]
+
+        db = store_sketches(documents)
+
+        assert {document["_id"] for document in db[SKETCH_COLLECTION].documents} == {
+            "lcp|/resources/:id|2024-05-01", "cls|/resources/:id|2024-05-01", "api|/|2024-05-01",
+        }
+        lcp = stored(db, "lcp|/resources/:id|2024-05-01")
+        assert lcp["count"] == 2
+        assert lcp["bucket"] == datetime(2024, 5, 1)
+        assert (lcp["min"], lcp["max"]) == (2100, 2500)
+
+    def test_page_load_beacons_carry_only_load_timings(self):
+        # Older clients sent the vitals getters' Promises, which arrive as {}
+        db = store_sketches([{"type": "page_load", "page_url": "/", "timestamp": datetime(2024, 5, 1), "data": {
+            "first_contentful_paint": 800, "largest_contentful_paint": {}, "cumulative_layout_shift": {},
+            "first_input_delay": {},
+        }}])
+
+        assert [document["metric"] for document in db[SKETCH_COLLECTION].documents] == ["fcp"]
+
+    def test_normalize_page(self):
+        assert normalize_page("https://a.example/blog/2024/post?x=1#top") == "/blog/:id/post"
+        assert normalize_page(None) == "unknown"
+
+
+class TestQueryPercentiles:
+    """Test merging stored sketches at query time"""
+
+    def test_merges_days_and_groups_by_page(self):
+        day = datetime(2024, 5, 1, 12)
+        db = FakeDB()
+        for offset, (page, values) in enumerate([("/", [100, 200, 300]), ("/", [400]), ("/about", [1000])]):
+            store_sketches([{"type": "resource_timing", "page_url": page, "timestamp": day + timedelta(days=offset),
+                             "data": {"type": "api", "duration": value}} for value in values], db)
+
+        merged = asyncio.run(query_percentiles(db, ["api"], day - timedelta(days=1), day + timedelta(days=5), [0.5, 1.0]))
+        by_page = asyncio.run(query_percentiles(
+            db, ["api"], day - timedelta(days=1), day + timedelta(days=5), [0.5], group_by="page"
+        ))
+
+        assert merged[0]["count"] == 5
+        assert abs(merged[0]["quantiles"]["p50"] - 300) <= 3
+        assert merged[0]["quantiles"]["p100"] == 1000
+        assert [(entry["page"], entry["count"]) for entry in by_page] == [("/", 4), ("/about", 1)]
+
+    def test_endpoint_rejects_unknown_metrics(self):
+        with patch('server.db'):
+            response = client.get("/api/analytics/web-vitals", params={"metric": "bogus"})
+
+        assert response.status_code == 400
+
+
+class TestRebuildSketches:
+    """Test recomputing the sketches from the retained performance documents"""
+
+    def beacon(self, timestamp, lcp):
+        return {"type": "web_vitals", "page_url": "/", "timestamp": timestamp, "data": {"largest_contentful_paint": lcp}}
+
+    def test_keeps_expired_days_and_recounts_the_retained_ones(self):
+        db = store_sketches([
+            self.beacon(datetime(2024, 4, 1, 9), 1000),
+            self.beacon(datetime(2024, 4, 20, 9), 1100),
+            self.beacon(datetime(2024, 5, 1, 9), 9999),
+        ])
+        # TTL has expired everything before 2024-04-20 06:00, and the stale 05-01 sample is gone too
+        db["performance_metrics"].documents = [
+            self.beacon(datetime(2024, 4, 20, 12), 1200),
+            self.beacon(datetime(2024, 5, 1, 10), 1300),
+        ]
+
+        count = asyncio.run(rebuild_sketches(db, "performance_metrics", retained_since=datetime(2024, 4, 20, 6)))
+
+        assert count == 1
+        assert stored(db, "lcp|/|2024-04-01")["max"] == 1000
+        # The partly expired day is kept rather than recounted from what is left of it
+        assert stored(db, "lcp|/|2024-04-20")["max"] == 1100
+        assert (stored(db, "lcp|/|2024-05-01")["count"], stored(db, "lcp|/|2024-05-01")["max"]) == (1, 1300)
+
+    def test_skips_while_another_process_holds_the_lease(self):
+        db = store_sketches([self.beacon(datetime(2024, 5, 1, 9), 1000)])
+        db[STATE_COLLECTION].documents = [
+            {"_id": SKETCH_COLLECTION, "lease_owner": "other", "lease_until": datetime.utcnow() + timedelta(minutes=5)},
+        ]
+
+        assert asyncio.run(rebuild_sketches(db, "performance_metrics")) is None
+        assert stored(db, "lcp|/|2024-05-01")["count"] == 1
+
+
+class TestPerformanceEndpoint:
+    """Test the sketches built from beacons in the shape performanceMonitor.js sends"""
+
+    def test_web_vitals_beacon_updates_the_sketches(self, monkeypatch):
+        db = FakeDB()
+        monkeypatch.setattr(server, "db", db)
+        monkeypatch.setattr(server, "performance_gate", client_telemetry.TelemetryGate(sample_rate=1.0))
+        beacon = {
+            "type": "web_vitals",
+            "data": {
+                "largest_contentful_paint": 2300.5,
+                "cumulative_layout_shift": 0.12,
+                "first_input_delay": None,
+                "interaction_to_next_paint": 184,
+            },
+            "timestamp": 1714567500000,
+            "user_agent": "Mozilla/5.0",
+            "url": "https://trustml.example/resources/42",
+            "session_id": "session_1714567000000_abc123def",
+        }
+
+        # sendBeacon posts the JSON as text/plain
+        response = client.post("/api/analytics/performance", content=json.dumps(beacon),
+                               headers={"Content-Type": "text/plain;charset=UTF-8"})
+
+        assert response.status_code == 200
+        assert response.json()["stored"] == 1
+        sketches = {document["metric"]: document for document in db[SKETCH_COLLECTION].documents}
+        assert set(sketches) == {"lcp", "cls", "inp"}
+        assert sketches["inp"]["page"] == "/resources/:id"
+        assert (sketches["lcp"]["min"], sketches["cls"]["max"]) == (2300.5, 0.12)
@@ -0,0 +1,176 @@
+"""
+Tests for the write-behind buffer
+"""
+
+import asyncio
+from unittest.mock import AsyncMock
+
+from pymongo.errors import BulkWriteError
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from tests.fakes import FakeDB
+from write_buffer import WriteBehindBuffer
+
+
+def make_db():
+    db = FakeDB()
+    for name in ("analytics_events", "link_interactions"):
+        db[name].insert_many = AsyncMock(wraps=db[name].insert_many)
+    return db
+
+
+class TestWriteBehindBuffer:
+    """Test batching, shutdown flush and metrics"""
+
+    def test_flushes_on_shutdown_grouped_by_collection(self):
+        db = make_db()
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, max_batch_size=100, flush_interval=60)
+            await buffer.start()
+            await buffer.put("analytics_events", {"id": "1"})
+            await buffer.put("link_interactions", {"id": "2"})
+            await buffer.put("analytics_events", {"id": "3"})
+            await buffer.stop()
+            return buffer.metrics()
+
+        metrics = asyncio.run(scenario())
+
+        events = db["analytics_events"].insert_many.call_args
+        assert [doc["id"] for doc in events.args[0]] == ["1", "3"]
+        assert events.kwargs["ordered"] is False
+        assert db["link_interactions"].insert_many.call_count == 1
+        assert [doc["id"] for doc in db["analytics_events"].documents] == ["1", "3"]
+        assert metrics["written"] == 3
+        assert metrics["queue_depth"] == 0
+        assert metrics["running"] is False
+
+    def test_flushes_when_batch_size_reached(self):
+        db = make_db()
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, max_batch_size=2, flush_interval=60)
+            await buffer.start()
+            await buffer.put_many("analytics_events", [{"id": "1"}, {"id": "2"}])
+            for _ in range(10):
+                await asyncio.sleep(0)
+            written_before_stop = buffer.metrics()["written"]
+            await buffer.stop()
+            return written_before_stop
+
+        assert asyncio.run(scenario()) == 2
+
+    def test_backpressure_when_queue_full(self):
+        db = make_db()
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, max_batch_size=10, flush_interval=0.01, max_queue_size=2)
+            await buffer.start()
+            await buffer.put_many("analytics_events", [{"id": str(i)} for i in range(5)])
+            await buffer.stop()
+            return buffer.metrics()
+
+        metrics = asyncio.run(scenario())
+
+        assert metrics["written"] == 5
+        assert metrics["backpressure_waits"] >= 1
+
+    def test_flush_hooks_receive_only_written_documents(self):
+        db = make_db()
+        db["analytics_events"].insert_many = AsyncMock(
+            side_effect=BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "duplicate key"}]})
+        )
+        received = []
+
+        async def hook(collection, documents):
+            received.append((collection, [doc["id"] for doc in documents]))
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, flush_interval=60)
+            buffer.add_flush_hook(hook)
+            await buffer.start()
+            await buffer.put_many("analytics_events", [{"id": "dup"}, {"id": "new"}])
+            await buffer.stop()
+            return buffer.metrics()
+
+        metrics = asyncio.run(scenario())
+
+        assert received == [("analytics_events", ["new"])]
+        assert metrics["failed"] == 1
+        assert metrics["written"] == 1
+
+    def test_drops_after_retries_exhausted(self):
+        db = make_db()
+        db["analytics_events"].insert_many = AsyncMock(side_effect=Exception("connection refused"))
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, flush_interval=60, max_retries=1, retry_backoff=0)
+            await buffer.start()
+            await buffer.put("analytics_events", {"id": "1"})
+            await buffer.stop()
+            return buffer.metrics()
+
+        metrics = asyncio.run(scenario())
+
+        assert db["analytics_events"].insert_many.call_count == 2
+        assert metrics["dropped"] == 1
+
+    def test_duplicates_on_retry_count_as_written(self):
+        db = make_db()
+        # The first attempt was applied for "a" before the connection dropped
+        db["analytics_events"].insert_many = AsyncMock(side_effect=[
+            Exception("connection reset"),
+            BulkWriteError({"writeErrors": [
+                {"index": 0, "code": 11000, "errmsg": "duplicate key"},
+                {"index": 1, "code": 121, "errmsg": "document failed validation"},
+            ]}),
+        ])
+        received = []
+
+        async def hook(collection, documents):
+            received.extend(doc["id"] for doc in documents)
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, flush_interval=60, retry_backoff=0)
+            buffer.add_flush_hook(hook)
+            await buffer.start()
+            await buffer.put_many("analytics_events", [{"id": "a"}, {"id": "invalid"}, {"id": "c"}])
+            await buffer.stop()
+            return buffer.metrics()
+
+        metrics = asyncio.run(scenario())
+
+        assert received == ["a", "c"]
+        assert metrics["written"] == 2
+        assert metrics["failed"] == 1
+
+    def test_dead_flush_task_is_reported_and_stops_accepting_documents(self, caplog):
+        db = make_db()
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, max_batch_size=1, flush_interval=60)
+            flush = buffer._flush
+            failures = []
+
+            async def flush_failing_once(batch):
+                if not failures:
+                    failures.append(batch)
+                    raise RuntimeError("bug in a flush")
+                await flush(batch)
+
+            buffer._flush = flush_failing_once
+            await buffer.start()
+            await buffer.put("analytics_events", {"id": "1"})
+            for _ in range(10):
+                await asyncio.sleep(0)
+            running_after_crash = buffer.running
+            await buffer._queue.put(("analytics_events", {"id": "2"}))
+            await buffer.stop()
+            return running_after_crash
+
+        assert asyncio.run(scenario()) is False
+        assert "Write-behind flush task died" in caplog.text
+        # stop() still writes what the dead task left queued
+        assert [doc["id"] for doc in db["analytics_events"].documents] == ["2"]
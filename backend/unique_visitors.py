@@ -0,0 +1,230 @@
+"""
+Approximate unique-session and unique-visitor counts from HyperLogLog sketches.
+
+Every tracking document written updates two HyperLogLog sketches (sessions,
+keyed by ``session_id``, and visitors, keyed by IP address and user agent) for
+its day, overall and for its resource or link category. A sketch is 2^12 one-
+byte registers stored as BSON binary (4 KB), estimates cardinality with about
+1.6% standard error, and merges with other sketches by taking the register-wise
+maximum. Counting a date range therefore merges one sketch per day, whatever
+the traffic, and no raw identifiers are kept.
+
+Register-wise maximum is idempotent, so sketches are updated with a
+compare-and-set on a version field and conflicting writers simply retry.
+"""
+
+import hashlib
+import logging
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from bson import Binary
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from rebuilds import first_complete_day, rebuild_collection
+from rollups import field_key, trend_buckets, truncate_timestamp
+
+logger = logging.getLogger(__name__)
+
+UNIQUE_COLLECTION = "unique_counts"
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+SKETCH_FIELDS = ("sessions", "visitors")
+MAX_MERGE_ATTEMPTS = 5
+MAX_RANGE_DAYS = 366
+REBUILD_BATCH_SIZE = 1000
+
+# Raw collections that feed the sketches, and the scope each document adds to besides "all"
+TRACKED_COLLECTIONS = ("analytics_events", "link_interactions", "resource_downloads")
+
+_HASH_BITS = 64
+_REMAINDER_BITS = _HASH_BITS - PRECISION
+_REMAINDER_MASK = (1 << _REMAINDER_BITS) - 1
+
+
+class HyperLogLog:
+    def __init__(self, registers: Optional[bytes] = None):
+        self.registers = bytearray(registers) if registers else bytearray(REGISTERS)
+
+    def add(self, value: str):
+        # Stable across processes, unlike hash()
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = hashed >> _REMAINDER_BITS
+        rank = _REMAINDER_BITS - (hashed & _REMAINDER_MASK).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS * REGISTERS / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_binary(self) -> Binary:
+        return Binary(bytes(self.registers))
+
+
+def scopes_for(collection_name: str, document: dict) -> List[str]:
+    scopes = ["all"]
+    if collection_name == "resource_downloads" and document.get("resource_id"):
+        scopes.append(f"resource:{field_key(document['resource_id'])}")
+    elif collection_name == "link_interactions":
+        scopes.append(f"link_category:{field_key(document.get('link_category'))}")
+    return scopes
+
+
+def visitor_key(document: dict) -> Optional[str]:
+    if not document.get("ip_address"):
+        return None
+    return f"{document['ip_address']}|{document.get('user_agent') or ''}"
+
+
+def day_id(scope: str, bucket: datetime) -> str:
+    return f"{scope}|{bucket.strftime('%Y-%m-%d')}"
+
+
+def build_sketches(collection_name: str, documents: Iterable[dict]) -> Dict[str, dict]:
+    """Batch-local sketches per (scope, day), keyed by their document id"""
+    sketches: Dict[str, dict] = {}
+    for document in documents:
+        identities = {"sessions": document.get("session_id"), "visitors": visitor_key(document)}
+        if not any(identities.values()):
+            continue
+        bucket = truncate_timestamp(document.get("timestamp") or datetime.utcnow(), "day")
+        for scope in scopes_for(collection_name, document):
+            entry = sketches.get(day_id(scope, bucket))
+            if entry is None:
+                entry = sketches[day_id(scope, bucket)] = {
+                    "scope": scope, "bucket": bucket, **{field: HyperLogLog() for field in SKETCH_FIELDS}
+                }
+            for field, identity in identities.items():
+                if identity:
+                    entry[field].add(str(identity))
+    return sketches
+
+
+def _merged_fields(current: Optional[dict], entry: dict) -> dict:
+    fields = {}
+    for field in SKETCH_FIELDS:
+        sketch = HyperLogLog(entry[field].registers)
+        if current and current.get(field):
+            sketch.merge(HyperLogLog(current[field]))
+        fields[field] = sketch.to_binary()
+    return fields
+
+
+async def _merge_one(collection, sketch_id: str, entry: dict) -> bool:
+    """Compare-and-set merge of one sketch document; True once it is stored"""
+    for _ in range(MAX_MERGE_ATTEMPTS):
+        current = await collection.find_one({"_id": sketch_id})
+        if current is None:
+            try:
+                await collection.insert_one({
+                    "_id": sketch_id, "scope": entry["scope"], "bucket": entry["bucket"],
+                    **_merged_fields(None, entry), "version": 1,
+                })
+                return True
+            except DuplicateKeyError:
+                continue
+        result = await collection.update_one(
+            {"_id": sketch_id, "version": current.get("version", 0)},
+            {"$set": _merged_fields(current, entry), "$inc": {"version": 1}},
+        )
+        if result.matched_count:
+            return True
+    return False
+
+
+async def apply_unique_counts(db, collection_name: str, documents: List[dict], target: str = UNIQUE_COLLECTION):
+    """Merge the sessions and visitors in freshly written documents into the stored sketches"""
+    sketches = build_sketches(collection_name, documents)
+    if not sketches:
+        return
+    collection = db[target]
+    current = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": list(sketches)}})}
+
+    # Fast path: one unordered bulk write; any conflict falls back to per-document
+    # compare-and-set, which is safe to repeat because merging is idempotent
+    operations = []
+    for sketch_id, entry in sketches.items():
+        if sketch_id in current:
+            operations.append(UpdateOne(
+                {"_id": sketch_id, "version": current[sketch_id].get("version", 0)},
+                {"$set": _merged_fields(current[sketch_id], entry), "$inc": {"version": 1}},
+            ))
+        else:
+            operations.append(InsertOne({
+                "_id": sketch_id, "scope": entry["scope"], "bucket": entry["bucket"],
+                **_merged_fields(None, entry), "version": 1,
+            }))
+    try:
+        result = await collection.bulk_write(operations, ordered=False)
+        conflicted = result.matched_count + result.inserted_count < len(operations)
+    except BulkWriteError:
+        conflicted = True
+    if not conflicted:
+        return
+    for sketch_id, entry in sketches.items():
+        if not await _merge_one(collection, sketch_id, entry):
+            logger.warning(f"Gave up merging unique-count sketch {sketch_id} after {MAX_MERGE_ATTEMPTS} attempts")
+
+
+async def get_unique_counts(db, start: datetime, end: datetime, scope: str = "all") -> Dict[str, int]:
+    """Estimated unique sessions and visitors in [start, end), merging one sketch per day"""
+    buckets = trend_buckets(start, end, "day")
+    if len(buckets) > MAX_RANGE_DAYS:
+        raise ValueError(f"Requested range spans more than {MAX_RANGE_DAYS} days")
+    merged = {field: HyperLogLog() for field in SKETCH_FIELDS}
+    cursor = db[UNIQUE_COLLECTION].find(
+        {"_id": {"$in": [day_id(scope, bucket) for bucket in buckets]}},
+        {"_id": 0, **{field: 1 for field in SKETCH_FIELDS}},
+    )
+    async for document in cursor:
+        for field in SKETCH_FIELDS:
+            if document.get(field):
+                merged[field].merge(HyperLogLog(document[field]))
+    return {field: merged[field].count() for field in SKETCH_FIELDS}
+
+
+async def rebuild_unique_counts(db, retained_since: Optional[datetime] = None) -> Optional[Dict[str, int]]:
+    """Recompute the sketches from the raw tracking collections still retained.
+
+    Days before ``retained_since`` (the latest retention cutoff of the tracked
+    collections) have lost raw events, so their sketches are kept as they are.
+    The sketches are swapped in once complete; returns None when another
+    process is rebuilding.
+    """
+    since = first_complete_day(retained_since)
+    projection = {"_id": 0, "session_id": 1, "ip_address": 1, "user_agent": 1, "timestamp": 1,
+                  "resource_id": 1, "link_category": 1}
+
+    async def build(target: str, renew) -> Dict[str, int]:
+        processed = {}
+        query = {"timestamp": {"$gte": since}} if since else {}
+        for collection_name in TRACKED_COLLECTIONS:
+            count = 0
+            batch = []
+            async for document in db[collection_name].find(query, projection):
+                batch.append(document)
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    await apply_unique_counts(db, collection_name, batch, target=target)
+                    count += len(batch)
+                    batch = []
+                    await renew()
+            if batch:
+                await apply_unique_counts(db, collection_name, batch, target=target)
+                count += len(batch)
+            processed[collection_name] = count
+        logger.info(f"Rebuilt unique-count sketches from {sum(processed.values())} documents")
+        return processed
+
+    return await rebuild_collection(db, UNIQUE_COLLECTION, build, keep={"bucket": {"$lt": since}} if since else None)
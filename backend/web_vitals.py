@@ -0,0 +1,274 @@
+"""
+Core Web Vitals and API timing percentiles from mergeable quantile sketches.
+
+Every performance beacon that is stored updates a DDSketch per (metric, page,
+day). A DDSketch maps each value to a logarithmic bin, so any quantile read
+from it is within ``RELATIVE_ACCURACY`` of the true value, and two sketches
+merge by adding their bin counts. Sketches are persisted as one document per
+(metric, page, day) in ``web_vitals_sketches`` with the bins as counters, so
+ingestion is a single ``$inc`` upsert and never reads the sketch back.
+Values are clamped to [MIN_VALUE, MAX_VALUE], which bounds a document to about
+1,300 bins however many samples it absorbs. Queries merge the sketches of the
+requested days (and pages) and read the quantiles from the merged sketch.
+"""
+
+import logging
+import math
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from pymongo import UpdateOne
+
+from rebuilds import first_complete_day, rebuild_collection
+from rollups import truncate_timestamp
+
+logger = logging.getLogger(__name__)
+
+SKETCH_COLLECTION = "web_vitals_sketches"
+RELATIVE_ACCURACY = 0.01
+# Milliseconds for timings; CLS is unitless and typically 0.0001-1
+MIN_VALUE = 1e-4
+MAX_VALUE = 1e7
+REBUILD_BATCH_SIZE = 1000
+
+# Beacon type -> beacon fields (performanceMonitor.js) -> metric name. The
+# frontend sends LCP, CLS, FID and INP in one "web_vitals" beacon when the page
+# is hidden, because they keep changing after the load event.
+BEACON_METRICS = {
+    "page_load": {
+        "first_contentful_paint": "fcp",
+        "first_byte_time": "ttfb",
+        "page_load_time": "page_load",
+    },
+    "web_vitals": {
+        "largest_contentful_paint": "lcp",
+        "cumulative_layout_shift": "cls",
+        "interaction_to_next_paint": "inp",
+        "first_input_delay": "fid",
+    },
+}
+API_METRIC = "api"
+METRICS = sorted({metric for fields in BEACON_METRICS.values() for metric in fields.values()} | {API_METRIC})
+
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{16,})$")
+
+
+class DDSketch:
+    """Logarithmically binned quantile sketch with relative-error guarantees"""
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value: float):
+        value = min(max(value, 0.0), MAX_VALUE)
+        if value < MIN_VALUE:
+            self.zero_count += 1
+        else:
+            self.bins[self.index(value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "DDSketch"):
+        for index, count in other.bins.items():
+            self.bins[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        value = self.max
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # Midpoint (in relative terms) of the bin (gamma^(i-1), gamma^i]
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                break
+        return min(max(value, self.min), self.max)
+
+    def to_document(self) -> dict:
+        return {
+            "bins": {str(index): count for index, count in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_document(cls, document: dict) -> "DDSketch":
+        sketch = cls()
+        for index, count in (document.get("bins") or {}).items():
+            sketch.bins[int(index)] += count
+        sketch.zero_count = document.get("zero_count", 0)
+        sketch.count = document.get("count", 0)
+        sketch.sum = document.get("sum", 0.0)
+        sketch.min = document.get("min")
+        sketch.max = document.get("max")
+        return sketch
+
+
+def normalize_page(url: Optional[str]) -> str:
+    """Page key for a URL: path only, id-like segments collapsed, usable as a field value"""
+    if not url:
+        return "unknown"
+    path = urlsplit(str(url)).path or "/"
+    segments = [":id" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")]
+    return "/".join(segments)[:200] or "/"
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+        return None
+    return float(value)
+
+
+def extract_samples(document: dict) -> List[Tuple[str, str, float]]:
+    """(metric, page, value) samples carried by one stored performance document"""
+    data = document.get("data") or {}
+    page = normalize_page(document.get("page_url"))
+    samples = []
+    if document.get("type") in BEACON_METRICS:
+        for field, metric in BEACON_METRICS[document["type"]].items():
+            value = _number(data.get(field))
+            if value is not None:
+                samples.append((metric, page, value))
+    elif document.get("type") == "resource_timing" and data.get("type") == "api":
+        value = _number(data.get("duration"))
+        if value is not None:
+            samples.append((API_METRIC, page, value))
+    return samples
+
+
+def sketch_id(metric: str, page: str, bucket: datetime) -> str:
+    return f"{metric}|{page}|{bucket.strftime('%Y-%m-%d')}"
+
+
+def build_sketch_operations(documents: Iterable[dict]) -> List[UpdateOne]:
+    """Fold a batch of performance documents into one upsert per (metric, page, day)"""
+    sketches: Dict[Tuple[str, str, datetime], DDSketch] = {}
+    for document in documents:
+        bucket = truncate_timestamp(document.get("timestamp") or datetime.utcnow(), "day")
+        for metric, page, value in extract_samples(document):
+            key = (metric, page, bucket)
+            if key not in sketches:
+                sketches[key] = DDSketch()
+            sketches[key].add(value)
+
+    operations = []
+    for (metric, page, bucket), sketch in sketches.items():
+        increments = {"count": sketch.count, "sum": sketch.sum, "zero_count": sketch.zero_count}
+        increments.update({f"bins.{index}": count for index, count in sketch.bins.items()})
+        operations.append(UpdateOne(
+            {"_id": sketch_id(metric, page, bucket)},
+            {
+                "$inc": increments,
+                "$min": {"min": sketch.min},
+                "$max": {"max": sketch.max},
+                "$setOnInsert": {"metric": metric, "page": page, "bucket": bucket},
+            },
+            upsert=True,
+        ))
+    return operations
+
+
+async def apply_sketches(db, documents: List[dict], target: str = SKETCH_COLLECTION):
+    """Update the sketches for performance documents that were just written"""
+    operations = build_sketch_operations(documents)
+    if operations:
+        await db[target].bulk_write(operations, ordered=False)
+
+
+async def query_percentiles(
+    db,
+    metrics: List[str],
+    start: datetime,
+    end: datetime,
+    quantiles: List[float],
+    page: Optional[str] = None,
+    group_by: Optional[str] = None,
+) -> List[dict]:
+    """Merge the stored sketches in [start, end) and read quantiles from the result.
+
+    Without ``group_by`` there is one entry per metric; ``"page"`` or ``"day"``
+    splits each metric by page or by day bucket.
+    """
+    query = {"metric": {"$in": metrics}, "bucket": {"$gte": truncate_timestamp(start, "day"), "$lt": end}}
+    if page is not None:
+        query["page"] = normalize_page(page)
+
+    merged: Dict[Tuple, DDSketch] = {}
+    async for document in db[SKETCH_COLLECTION].find(query, {"_id": 0}):
+        group = None
+        if group_by == "page":
+            group = document["page"]
+        elif group_by == "day":
+            group = document["bucket"]
+        key = (document["metric"], group)
+        if key not in merged:
+            merged[key] = DDSketch()
+        merged[key].merge(DDSketch.from_document(document))
+
+    results = []
+    for (metric, group), sketch in sorted(merged.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        entry = {"metric": metric, "count": sketch.count, "mean": sketch.sum / sketch.count if sketch.count else None,
+                 "min": sketch.min, "max": sketch.max}
+        if group_by:
+            entry[group_by] = group
+        entry["quantiles"] = {f"p{round(q * 100, 1):g}": sketch.quantile(q) for q in quantiles}
+        results.append(entry)
+    return results
+
+
+async def rebuild_sketches(db, collection_name: str, retained_since: Optional[datetime] = None) -> Optional[int]:
+    """Recompute the sketches from the raw performance documents still retained.
+
+    Days before ``retained_since`` (from the retention policy) are partly or
+    wholly expired, so their sketches are kept as they are. The sketches are
+    swapped in once complete; returns None when another process is rebuilding.
+    """
+    since = first_complete_day(retained_since)
+
+    async def build(target: str, renew) -> int:
+        count = 0
+        batch = []
+        query = {"timestamp": {"$gte": since}} if since else {}
+        async for document in db[collection_name].find(query, {"_id": 0, "type": 1, "data": 1, "page_url": 1, "timestamp": 1}):
+            batch.append(document)
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                await apply_sketches(db, batch, target=target)
+                count += len(batch)
+                batch = []
+                await renew()
+        if batch:
+            await apply_sketches(db, batch, target=target)
+            count += len(batch)
+        logger.info(f"Rebuilt web vitals sketches from {count} {collection_name} documents")
+        return count
+
+    return await rebuild_collection(db, SKETCH_COLLECTION, build, keep={"bucket": {"$lt": since}} if since else None)
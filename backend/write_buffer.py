@@ -0,0 +1,202 @@
+"""
+Write-behind buffer for high-volume tracking documents.
+
+Tracking endpoints enqueue documents here and return immediately; a background
+task flushes them to MongoDB with unordered ``insert_many`` calls once a size or
+time threshold is reached.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+FlushHook = Callable[[str, List[dict]], Awaitable[None]]
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteBehindBuffer:
+    """Bounded asyncio queue of (collection, document) pairs flushed in bulk.
+
+    Memory is bounded by ``max_queue_size``: once the queue is full, ``put``
+    waits for the flusher to make room, which applies backpressure to callers
+    instead of growing without limit.
+    """
+
+    def __init__(
+        self,
+        db,
+        max_batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+    ):
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._flush_hooks: List[FlushHook] = []
+
+        self._enqueued = 0
+        self._written = 0
+        self._failed = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._backpressure_waits = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        # A flush task that died leaves nobody to empty the queue; callers then write directly
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def add_flush_hook(self, hook: FlushHook):
+        """Register a coroutine called with (collection, documents) after each successful write"""
+        self._flush_hooks.append(hook)
+
+    async def start(self):
+        """Start the background flush task"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._task_done)
+        logger.info(
+            f"Write-behind buffer started (batch={self.max_batch_size}, "
+            f"interval={self.flush_interval}s, capacity={self.max_queue_size})"
+        )
+
+    async def stop(self):
+        """Stop accepting documents and flush everything still queued"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        if self._task.done():
+            # The flush task died; write what it left behind
+            await self._drain()
+        else:
+            await self._task
+        self._task = None
+        logger.info(f"Write-behind buffer stopped after writing {self._written} documents")
+
+    def _task_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Write-behind flush task died; tracking writes go directly to MongoDB",
+                         exc_info=task.exception())
+
+    async def put(self, collection: str, document: dict):
+        """Queue a single document, waiting for room when the buffer is full"""
+        if self._queue.full():
+            self._backpressure_waits += 1
+        await self._queue.put((collection, document))
+        self._enqueued += 1
+        if self._queue.qsize() >= self.max_batch_size:
+            self._wakeup.set()
+
+    async def put_many(self, collection: str, documents: List[dict]):
+        """Queue several documents for the same collection"""
+        for document in documents:
+            await self.put(collection, document)
+
+    def metrics(self) -> dict:
+        """Snapshot of queue depth, throughput and flush latency"""
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue_size,
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "failed": self._failed,
+            "dropped": self._dropped,
+            "flushes": self._flushes,
+            "backpressure_waits": self._backpressure_waits,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+            "max_flush_ms": round(self._max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self._flushes, 3) if self._flushes else 0.0,
+        }
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._drain()
+        # Final drain on shutdown
+        await self._drain()
+
+    async def _drain(self):
+        while not self._queue.empty():
+            batch: List[Tuple[str, dict]] = []
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[str, dict]]):
+        grouped: Dict[str, List[dict]] = defaultdict(list)
+        for collection, document in batch:
+            grouped[collection].append(document)
+
+        started = time.perf_counter()
+        for collection, documents in grouped.items():
+            written = await self._write(collection, documents)
+            if written:
+                for hook in self._flush_hooks:
+                    try:
+                        await hook(collection, written)
+                    except Exception as e:
+                        logger.error(f"Write-behind flush hook failed for {collection}: {str(e)}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._flushes += 1
+        self._last_flush_ms = elapsed_ms
+        self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    async def _write(self, collection: str, documents: List[dict]) -> List[dict]:
+        """Insert documents, retrying transient failures; returns the documents written"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.db[collection].insert_many(documents, ordered=False)
+                self._written += len(documents)
+                return documents
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                if attempt > 0:
+                    # A failed earlier attempt may have been partly applied before the
+                    # error reached us; duplicate keys on a retry are those documents
+                    write_errors = [error for error in write_errors if error.get("code") != DUPLICATE_KEY_ERROR]
+                failed_indexes = {error["index"] for error in write_errors}
+                self._failed += len(failed_indexes)
+                written = [doc for i, doc in enumerate(documents) if i not in failed_indexes]
+                self._written += len(written)
+                if failed_indexes:
+                    logger.warning(f"Write-behind flush to {collection}: {len(failed_indexes)} documents rejected")
+                return written
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._dropped += len(documents)
+                    logger.error(f"Write-behind flush to {collection} dropped {len(documents)} documents: {str(e)}")
+                    return []
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+        return []
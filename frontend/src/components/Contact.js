@@ -151,7 +151,9 @@ const ContactSection = ({ prefilledService = null, prefilledInquiry = null } = {
           interested_in: formData.interestedIn,
           service_type: formData.serviceType,
           urgency: formData.urgency,
-          message: formData.message
+          message: formData.message,
+          // Ties the submission to the visitor's analytics session for funnel analysis
+          session_id: sessionStorage.getItem('analytics_session_id')
         })
       });
 
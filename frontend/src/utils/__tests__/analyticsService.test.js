@@ -348,7 +348,7 @@ describe('AnalyticsService', () => {
       await analyticsService.retryFailedEvents();
 
       expect(fetch).toHaveBeenCalledWith(
-        'http://localhost:8000/api/analytics/track',
+        'http://localhost:8000/api/analytics/track/batch',
         expect.objectContaining({
           method: 'POST',
           body: expect.stringContaining('test_event')
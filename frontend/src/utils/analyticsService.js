@@ -357,18 +357,19 @@ class AnalyticsService {
       const failedEvents = JSON.parse(localStorage.getItem('analytics_failed_events') || '[]');
       if (failedEvents.length === 0) return;
 
-      const retryPromises = failedEvents.map(event => 
-        fetch(`${this.backendUrl}/api/analytics/track`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify(event)
-        }).catch(() => null) // Ignore retry failures
-      );
+      // Replay all failed events in a single batched request
+      const response = await fetch(`${this.backendUrl}/api/analytics/track/batch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(failedEvents)
+      });
+
+      if (!response.ok) {
+        throw new Error(`Analytics batch retry failed: ${response.status}`);
+      }
 
-      await Promise.all(retryPromises);
-      
       // Clear failed events on successful retry
       localStorage.removeItem('analytics_failed_events');
     } catch (error) {
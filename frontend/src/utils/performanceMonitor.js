@@ -9,6 +9,14 @@ class PerformanceMonitor {
     this.observers = new Map();
     this.isEnabled = process.env.NODE_ENV !== 'test';
     this.backendUrl = process.env.REACT_APP_BACKEND_URL || "";
+    // Core Web Vitals, updated by the observers until the page is hidden
+    this.webVitals = {
+      largest_contentful_paint: null,
+      cumulative_layout_shift: null,
+      first_input_delay: null,
+      interaction_to_next_paint: null
+    };
+    this.webVitalsReported = false;
     
     if (this.isEnabled) {
       this.initializeObservers();
@@ -59,12 +67,64 @@ class PerformanceMonitor {
           longTaskObserver.observe({ entryTypes: ['longtask'] });
           this.observers.set('longtask', longTaskObserver);
         }
+
+        this.observeWebVitals();
       }
     } catch (error) {
       console.warn('Failed to initialize performance observers:', error);
     }
   }
 
+  /**
+   * Observe Core Web Vitals for the lifetime of the page
+   */
+  observeWebVitals() {
+    const observe = (type, callback, options = {}) => {
+      if (!(PerformanceObserver.supportedEntryTypes || []).includes(type)) {
+        return false;
+      }
+      const observer = new PerformanceObserver((list) => callback(list.getEntries()));
+      observer.observe({ type, buffered: true, ...options });
+      this.observers.set(type, observer);
+      return true;
+    };
+
+    observe('largest-contentful-paint', (entries) => {
+      const lastEntry = entries[entries.length - 1];
+      if (lastEntry) {
+        this.webVitals.largest_contentful_paint = lastEntry.startTime;
+      }
+    });
+
+    const observingLayoutShifts = observe('layout-shift', (entries) => {
+      for (const entry of entries) {
+        if (!entry.hadRecentInput) {
+          this.webVitals.cumulative_layout_shift += entry.value;
+        }
+      }
+    });
+    if (observingLayoutShifts) {
+      // A page without layout shifts has a CLS of 0, not an unknown one
+      this.webVitals.cumulative_layout_shift = this.webVitals.cumulative_layout_shift || 0;
+    }
+
+    observe('first-input', (entries) => {
+      const firstInput = entries[0];
+      if (firstInput && this.webVitals.first_input_delay === null) {
+        this.webVitals.first_input_delay = firstInput.processingStart - firstInput.startTime;
+      }
+    });
+
+    // INP is approximated by the slowest interaction, which it equals below 50 interactions
+    observe('event', (entries) => {
+      for (const entry of entries) {
+        if (entry.interactionId && entry.duration > (this.webVitals.interaction_to_next_paint || 0)) {
+          this.webVitals.interaction_to_next_paint = entry.duration;
+        }
+      }
+    }, { durationThreshold: 40 });
+  }
+
   /**
    * Start performance tracking
    */
@@ -81,7 +141,11 @@ class PerformanceMonitor {
     // Track visibility changes
     document.addEventListener('visibilitychange', () => {
       this.recordVisibilityChange();
+      if (document.visibilityState === 'hidden') {
+        this.reportWebVitals();
+      }
     });
+    window.addEventListener('pagehide', () => this.reportWebVitals());
 
     // Track memory usage periodically
     if ('memory' in performance) {
@@ -203,11 +267,8 @@ class PerformanceMonitor {
       request_time: timing.responseEnd - timing.requestStart,
       unload_time: timing.unloadEventEnd - timing.unloadEventStart,
       
-      // Core Web Vitals
+      // LCP, CLS, FID and INP are still changing at load; reportWebVitals sends them
       first_contentful_paint: this.getFirstContentfulPaint(),
-      largest_contentful_paint: this.getLargestContentfulPaint(),
-      first_input_delay: this.getFirstInputDelay(),
-      cumulative_layout_shift: this.getCumulativeLayoutShift(),
       
       // Additional metrics
       connection_type: this.getConnectionType(),
@@ -222,6 +283,20 @@ class PerformanceMonitor {
     this.analyzePerformanceIssues(loadMetrics);
   }
 
+  /**
+   * Report the final Core Web Vitals once, when the page is hidden
+   */
+  reportWebVitals() {
+    if (this.webVitalsReported) {
+      return;
+    }
+    this.webVitalsReported = true;
+    const vitals = { ...this.webVitals };
+    this.metrics.set('web_vitals', vitals);
+    this.reportMetrics('web_vitals', vitals);
+    this.analyzePerformanceIssues(vitals);
+  }
+
   /**
    * Record memory usage
    */
@@ -293,79 +368,31 @@ class PerformanceMonitor {
   }
 
   /**
-   * Get Largest Contentful Paint timing
+   * Get Largest Contentful Paint timing observed so far
    */
   getLargestContentfulPaint() {
-    return new Promise((resolve) => {
-      if ('PerformanceObserver' in window) {
-        const observer = new PerformanceObserver((list) => {
-          const entries = list.getEntries();
-          const lastEntry = entries[entries.length - 1];
-          resolve(lastEntry ? lastEntry.startTime : null);
-          observer.disconnect();
-        });
-        observer.observe({ entryTypes: ['largest-contentful-paint'] });
-        
-        // Timeout after 10 seconds
-        setTimeout(() => {
-          observer.disconnect();
-          resolve(null);
-        }, 10000);
-      } else {
-        resolve(null);
-      }
-    });
+    return this.webVitals.largest_contentful_paint;
   }
 
   /**
-   * Get First Input Delay
+   * Get First Input Delay, once there has been an input
    */
   getFirstInputDelay() {
-    return new Promise((resolve) => {
-      if ('PerformanceObserver' in window) {
-        const observer = new PerformanceObserver((list) => {
-          const firstInput = list.getEntries()[0];
-          resolve(firstInput ? firstInput.processingStart - firstInput.startTime : null);
-          observer.disconnect();
-        });
-        observer.observe({ entryTypes: ['first-input'] });
-        
-        // Timeout after 30 seconds
-        setTimeout(() => {
-          observer.disconnect();
-          resolve(null);
-        }, 30000);
-      } else {
-        resolve(null);
-      }
-    });
+    return this.webVitals.first_input_delay;
   }
 
   /**
-   * Get Cumulative Layout Shift
+   * Get Cumulative Layout Shift observed so far
    */
   getCumulativeLayoutShift() {
-    return new Promise((resolve) => {
-      if ('PerformanceObserver' in window) {
-        let clsValue = 0;
-        const observer = new PerformanceObserver((list) => {
-          for (const entry of list.getEntries()) {
-            if (!entry.hadRecentInput) {
-              clsValue += entry.value;
-            }
-          }
-        });
-        observer.observe({ entryTypes: ['layout-shift'] });
-        
-        // Resolve after 10 seconds
-        setTimeout(() => {
-          observer.disconnect();
-          resolve(clsValue);
-        }, 10000);
-      } else {
-        resolve(null);
-      }
-    });
+    return this.webVitals.cumulative_layout_shift;
+  }
+
+  /**
+   * Get Interaction to Next Paint observed so far
+   */
+  getInteractionToNextPaint() {
+    return this.webVitals.interaction_to_next_paint;
   }
 
   /**
@@ -612,7 +639,8 @@ class PerformanceMonitor {
     const summary = {
       page_load_time: metrics.page_load?.page_load_time || null,
       first_contentful_paint: metrics.page_load?.first_contentful_paint || null,
-      largest_contentful_paint: metrics.page_load?.largest_contentful_paint || null,
+      largest_contentful_paint: this.getLargestContentfulPaint(),
+      interaction_to_next_paint: this.getInteractionToNextPaint(),
       memory_usage: metrics.memory_usage?.memory_usage_percentage || null,
       slow_resources: this.getSlowResourcesCount(),
       long_tasks: this.getLongTasksCount(),
@@ -650,7 +678,7 @@ class PerformanceMonitor {
     // Deduct points for slow metrics
     if (metrics.page_load.page_load_time > 3000) score -= 20;
     if (metrics.page_load.first_contentful_paint > 2500) score -= 15;
-    if (metrics.page_load.largest_contentful_paint > 4000) score -= 20;
+    if (this.getLargestContentfulPaint() > 4000) score -= 20;
     if (metrics.memory_usage?.memory_usage_percentage > 80) score -= 10;
 
     return Math.max(0, score);